@@ -32,6 +32,7 @@ import yaml
 
 from pyramid_mako import add_mako_renderer
 from pyramid.interfaces import IStaticURLInfo
+from pyramid.events import NewRequest
 
 import sqlalchemy
 import sqlahelper
@@ -40,7 +41,7 @@ import pyramid_tm
 from papyrus.renderers import GeoJSON, XSD
 import simplejson as json
 
-from c2cgeoportal.lib import dbreflection, get_setting, caching, \
+from c2cgeoportal.lib import dbreflection, get_setting, caching, upstream, \
     MultiDomainPregenerator, MultiDomainStaticURLInfo
 
 
@@ -394,8 +395,12 @@ def includeme(config):
     dbreflection.init(engine)
 
     # dogpile.cache configuration
-    caching.init_region(settings['cache'])
-    caching.invalidate_region()
+    caching.init_regions(settings['cache'])
+    caching.invalidate_regions()
+    config.add_subscriber(caching.new_request, NewRequest)
+
+    # upstream HTTP client configuration
+    upstream.init(settings.get('http_client'))
 
     # bind the mako renderer to other file extensions
     add_mako_renderer(config, '.html')
@@ -447,6 +452,8 @@ def includeme(config):
     config.add_route('xapihelp', '/xapihelp.html')
     config.add_route('themes', '/themes')
     config.add_route('invalidate', '/invalidate')
+    config.add_route('cache_stats', '/cache_stats')
+    config.add_route('upstream_stats', '/upstream_stats')
 
     # checker routes, Checkers are web services to test and assess that
     # the application is correctly functioning.
@@ -462,6 +469,7 @@ def includeme(config):
     config.add_route('checker_fts', '/checker_fts')
     config.add_route('checker_wmscapabilities', '/checker_wmscapabilities')
     config.add_route('checker_wfscapabilities', '/checker_wfscapabilities')
+    config.add_route('checker_upstreams', '/checker_upstreams')
     # collector
     config.add_route('check_collector', '/check_collector')
 
@@ -39,34 +39,89 @@ from pyramid.compat import WIN
 from pyramid.config.views import StaticURLInfo
 
 
-def get_url(url, request, default=None, errors=None):
-    if url is None:
-        return default
+class URLResolver(object):
+    """ Resolve the ``static://`` and ``config://`` URLs of an application,
+    the results are memoized by URL and application URL, and by cache
+    version for the ``static://`` URLs which contain the cache buster
+    token. """
+
+    MAX_ENTRIES = 10000
+    _scheme_re = re.compile("^[a-z]*://")
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._urls = {}
+        self._cache_version = None
+
+    def resolve(self, url, request):
+        """ Return the resolved URL and the error, the resolved URL is
+        ``None`` if the server of a ``config://`` URL isn't found. """
+        key = (url, request.application_url)
+        if url.startswith('static://'):
+            from c2cgeoportal.lib.cacheversion import get_cache_version
+            cache_version = get_cache_version()
+            if cache_version != self._cache_version:
+                # the old tokens are no more used
+                self._urls.clear()
+                self._cache_version = cache_version
+            key += (cache_version,)
+        try:
+            return self._urls[key]
+        except KeyError:
+            pass
+
+        result = self._resolve(url, request)
+        if len(self._urls) >= self.MAX_ENTRIES:  # pragma: no cover
+            self._urls.clear()
+        self._urls[key] = result
+        return result
+
+    def _resolve(self, url, request):
+        if self._scheme_re.match(url) is None:
+            return url, None
+
+        obj = urlparse(url)
+        if obj.scheme == 'static':
+            netloc = obj.netloc
+            if netloc == '':
+                netloc = self.settings['package'] + ':static'
+            elif ':' not in netloc:
+                netloc += ':static'
+
+            return request.static_url(netloc + obj.path), None
+
+        if obj.scheme == 'config':
+            server = self.settings.get('servers', {}).get(obj.netloc, None)
+            if server is None:
+                return None, "The server '%s' isn't found in the config" % obj.netloc
+            else:
+                return "%s%s?%s" % (server, obj.path, obj.query), None
 
-    if re.match("^[a-z]*://", url) is None:
-        return url
+        else:
+            return url, None
 
-    obj = urlparse(url)
-    if obj.scheme == 'static':
-        netloc = obj.netloc
-        if netloc == '':
-            netloc = request.registry.settings['package'] + ':static'
-        elif ':' not in netloc:
-            netloc += ':static'
 
-        return request.static_url(netloc + obj.path)
+def get_url_resolver(registry):
+    """ Return the ``URLResolver`` of the application, a new one is created
+    when the settings are replaced. """
+    resolver = getattr(registry, 'c2cgeoportal_url_resolver', None)
+    if resolver is None or resolver.settings is not registry.settings:
+        resolver = URLResolver(registry.settings)
+        registry.c2cgeoportal_url_resolver = resolver
+    return resolver
 
-    if obj.scheme == 'config':
-        server = request.registry.settings.get('servers', {}).get(obj.netloc, None)
-        if server is None:
-            if default is None and errors is not None:
-                errors.append("The server '%s' isn't found in the config" % obj.netloc)
-            return default
-        else:
-            return "%s%s?%s" % (server, obj.path, obj.query)
 
-    else:
-        return url
+def get_url(url, request, default=None, errors=None):
+    if url is None:
+        return default
+
+    result, error = get_url_resolver(request.registry).resolve(url, request)
+    if result is None:
+        # report an unknown server only once
+        if default is None and errors is not None and error not in errors:
+            errors.append(error)
+        return default
+    return result
 
 
 def get_setting(settings, path, default=None):
@@ -79,21 +134,6 @@ def get_setting(settings, path, default=None):
     return value if value else default
 
 
-def get_protected_layers_query(role_id, what=None):
-    from c2cgeoportal.models import DBSession, LayerV1, \
-        Layer, RestrictionArea, Role, layer_ra, role_ra
-
-    q = DBSession.query(what if what is not None else LayerV1)
-    q = q.join(
-        (layer_ra, Layer.id == layer_ra.c.layer_id),
-        (RestrictionArea,
-            RestrictionArea.id == layer_ra.c.restrictionarea_id),
-        (role_ra, role_ra.c.restrictionarea_id == RestrictionArea.id),
-        (Role, Role.id == role_ra.c.role_id))
-    q = q.filter(Role.id == role_id)
-    return q.filter(Layer.public.is_(False))
-
-
 @implementer(IRoutePregenerator)
 class MultiDomainPregenerator:  # pragma: no cover
     def __call__(self, request, elements, kw):
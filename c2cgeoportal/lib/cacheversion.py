@@ -30,13 +30,10 @@
 
 import uuid
 from pyramid.static import PathSegmentMd5CacheBuster
-from c2cgeoportal.lib.caching import get_region
+from c2cgeoportal.lib.caching import cache_on_arguments
 
 
-cache_region = get_region()
-
-
-@cache_region.cache_on_arguments()
+@cache_on_arguments()
 def get_cache_version():
     "Return a cache version that is regenerate after each cache invalidation"
     return uuid.uuid4().hex
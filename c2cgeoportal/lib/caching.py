@@ -28,21 +28,164 @@
 # either expressed or implied, of the FreeBSD Project.
 
 
+import os
+import time
+import fcntl
+import hashlib
+import zlib
+import uuid
 import inspect
+import logging
+import threading
+from urllib import quote
+from functools import wraps
+from collections import OrderedDict, Mapping
 
-from dogpile.cache import compat
+from dogpile.cache import compat, register_backend
+from dogpile.cache.api import CacheBackend, NO_VALUE
+from dogpile.cache.proxy import ProxyBackend
 from dogpile.cache.region import make_region
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm.state import InstanceState
+
+log = logging.getLogger(__name__)
 
 _regions = {}
+_local_caches = {}
+_serializers = {}
+_expiration_times = {}
+
+# The named regions with their default configuration, they are configured
+# with the cache configuration overridden by the property of the same name.
+#
+# * upstream: what we get from the upstream servers, like the GetCapabilities.
+# * tree: the layer trees.
+# * permission: what depends on the role.
+# * enumeration: the enumerations and the metadata read in the database.
+# * print: the print information.
+# * ogc: the cacheable OGC responses of the MapServer proxy, by request type.
+REGIONS = {
+    'upstream': {
+        'refresh_in_background': True,
+    },
+    'tree': {},
+    'permission': {},
+    'enumeration': {},
+    'print': {},
+    'ogc': {
+        'backend': 'c2cgeoportal.memory_lru',
+        'arguments': {
+            'max_entries': 1000,
+            'max_size': 100000000,
+        },
+        'expiration_times': {
+            'getlegendgraphic': 86400,
+            'describefeaturetype': 3600,
+        },
+    },
+}
+
+
+# The maximum length of a key, the longer keys are hashed (memcached
+# doesn't accept keys longer than 250 bytes).
+MAX_KEY_LENGTH = 250
+
+# The headers that can change the response of MapServer, the other
+# headers are not used in the cache keys.
+PROXY_HEADERS = (
+    'Host', 'X-Forwarded-Host', 'X-Forwarded-Proto', 'Accept-Language',
+)
+
+# The characters that are not escaped in the key parts, the other ones are
+# used as separators or aren't accepted by memcached.
+_KEY_SAFE = '/:'
+
+
+def _key_text(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = compat.text_type(value).encode('utf-8')
+    return quote(value, _KEY_SAFE)
+
+
+def _object_identity(value):
+    state = sa_inspect(value, raiseerr=False)
+    if isinstance(state, InstanceState) and state.identity is not None:
+        return '%s#%s' % (
+            type(value).__name__, ','.join(_key_text(i) for i in state.identity)
+        )
+    return None
+
+
+def canonicalize(value, allow_list=None):
+    """
+    Return a text that represents the value in a cache key, the dictionaries
+    and the sets are sorted and the ORM objects are represented by their
+    class and their primary key, then equal values give equal texts.
+
+    With ``allow_list`` only the listed keys of a dictionary are used,
+    case insensitively.
+    """
+    if value is None:
+        return '~'
+    if isinstance(value, (str, unicode)):
+        return _key_text(value)
+    if isinstance(value, (bool, int, long, float)):
+        return _key_text(value)
+    if isinstance(value, Mapping):
+        if allow_list is not None:
+            allowed = set(k.lower() for k in allow_list)
+            value = dict(
+                (k, v) for k, v in value.items() if k.lower() in allowed
+            )
+        return '{%s}' % ','.join(sorted(
+            '%s=%s' % (canonicalize(k), canonicalize(v))
+            for k, v in value.items()
+        ))
+    if isinstance(value, (set, frozenset)):
+        return '(%s)' % ','.join(sorted(canonicalize(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ','.join(canonicalize(v) for v in value)
+    identity = _object_identity(value)
+    if identity is not None:
+        return identity
+    return _key_text(value)
+
+
+def _bound_key(key):
+    if len(key) > MAX_KEY_LENGTH:
+        digest = hashlib.sha1(key).hexdigest()
+        key = '%s|%s' % (key[:MAX_KEY_LENGTH - len(digest) - 1], digest)
+    return key
+
+
+def make_key(*parts):
+    """
+    Return a cache key made of the canonicalized parts (see
+    ``canonicalize``), bounded like the keys of ``keygen_function``.
+    """
+    return _bound_key('|'.join(canonicalize(part) for part in parts))
 
 
-def keygen_function(namespace, fn):
+def keygen_function(namespace, fn, tags=(), allow_lists=None):
     """Return a function that generates a string
     key, based on a given function as well as
     arguments to the returned function itself.
 
     This is used by :meth:`.CacheRegion.cache_on_arguments`
     to generate a cache key from a decorated function.
+
+    The arguments are canonicalized (see ``canonicalize``), the keyword
+    arguments are placed like the positional arguments and the keys
+    longer than ``MAX_KEY_LENGTH`` are truncated and ended by a hash of
+    the whole key, then they keep a readable prefix.
+
+    Arguments:
+
+    * ``tags`` What the cached value depends on, see ``keygen_with_tags``.
+    * ``allow_lists`` The allowed keys of the dictionary arguments,
+      by argument name, e.g.: ``{'headers': PROXY_HEADERS}``.
     """
 
     if namespace is None:
@@ -50,37 +193,538 @@ def keygen_function(namespace, fn):
     else:  # pragma: nocover
         namespace = '%s:%s|%s' % (fn.__module__, fn.__name__, namespace)
 
-    args = inspect.getargspec(fn)
-    has_self = args[0] and args[0][0] in ('self', 'cls')
+    argspec = inspect.getargspec(fn)
+    has_self = argspec.args and argspec.args[0] in ('self', 'cls')
+    names = argspec.args[1:] if has_self else argspec.args
+    if allow_lists is None:
+        allow_lists = {}
 
     def generate_key(*args, **kw):
-        if kw:  # pragma: nocover
-            raise ValueError(
-                "key creation function does not accept keyword arguments.")
+        extra_kw = {}
+        if kw or argspec.defaults:
+            callargs = inspect.getcallargs(fn, *args, **kw)
+            args = [callargs[name] for name in argspec.args]
+            if argspec.varargs is not None:
+                args.extend(callargs[argspec.varargs])
+            if argspec.keywords is not None:
+                extra_kw = callargs[argspec.keywords]
         parts = [namespace]
         if has_self:
             self_ = args[0]
             if hasattr(self_, 'request'):
-                parts.append(self_.request.application_url)
+                parts.append(_key_text(self_.request.application_url))
             args = args[1:]
-        parts.append(" ".join(map(compat.text_type, args)))
-        return "|".join(parts)
+        parts.extend(
+            canonicalize(arg, allow_lists.get(names[i]) if i < len(names) else None)
+            for i, arg in enumerate(args)
+        )
+        parts.extend(
+            '%s=%s' % (_key_text(name), canonicalize(extra_kw[name]))
+            for name in sorted(extra_kw)
+        )
+        if tags:
+            parts.extend(_get_tag_versions(get_region(), tags))
+        key = _bound_key('|'.join(parts))
+        log.debug('Cache key: %s' % key)
+        return key
     return generate_key
 
 
+TAG_KEY = 'c2cgeoportal:tag:%s'
+TAGS_EPOCH_KEY = 'c2cgeoportal:tags'
+
+# The tags of what the cached values depends on
+TREE = 'tree'
+RESTRICTION = 'restriction'
+ROLE = 'role'
+FUNCTIONALITY = 'functionality'
+
+
+def capabilities_tag(url):
+    """
+    Return the tag of the values that depend on the capabilities of the
+    OGC server at ``url`` (as it's configured).
+    """
+    return 'capabilities:%s' % url
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def _get_tag_versions(cache_region, tags):
+    # the epoch is the first version, a new epoch is set when the default
+    # region is invalidated, also softly. The epoch and the tags versions
+    # never expire, they are got in one round trip and the missing ones
+    # are created.
+    keys = [TAGS_EPOCH_KEY] + [_bound_key(TAG_KEY % _key_text(tag)) for tag in tags]
+    versions = cache_region.get_multi(keys, ignore_expiration=True)
+    missing = dict(
+        (key, _new_version()) for key, version in zip(keys, versions)
+        if version is NO_VALUE
+    )
+    if missing:
+        cache_region.set_multi(missing)
+    return [missing.get(key, version) for key, version in zip(keys, versions)]
+
+
+def keygen_with_tags(*tags, **kwargs):
+    """Return a key generator that works like ``keygen_function``
+    and adds the current version of the given tags to the key,
+    the ``allow_lists`` keyword argument is also supported.
+
+    Used with the ``function_key_generator`` argument of
+    :meth:`.CacheRegion.cache_on_arguments`, the cached values are
+    invalidated by ``invalidate_tags``.
+    """
+    def keygen(namespace, fn):
+        return keygen_function(namespace, fn, tags, **kwargs)
+    return keygen
+
+
+def get_tags_version(*tags):
+    """
+    Return the current version of the given tags, it changes when one of
+    them is invalidated.
+    """
+    return '|'.join(_get_tag_versions(get_region(), tags))
+
+
+def invalidate_tags(*tags):
+    """
+    Invalidate the cached values that depend on the given tags.
+
+    The versions of the tags are stored in the default region,
+    the old values are no more used and expire with the region.
+    """
+    get_region().set_multi(dict(
+        (_bound_key(TAG_KEY % _key_text(tag)), _new_version()) for tag in tags
+    ))
+    if None in _local_caches:
+        _local_caches[None].new_generation()
+
+
+class MemoryLRUBackend(CacheBackend):
+    """
+    A memory backend with a maximum number of entries, given by the
+    ``max_entries`` argument, and optionally a maximum size in bytes of
+    the pickled values, given by the ``max_size`` argument, the least
+    recently used entries are dropped.
+
+    Registered as ``c2cgeoportal.memory_lru``.
+    """
+
+    def __init__(self, arguments):
+        self.max_entries = arguments.get('max_entries', 1000)
+        self.max_size = arguments.get('max_size')
+        self.size = 0
+        self._cache = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._cache.pop(key, NO_VALUE)
+            if value is not NO_VALUE:
+                self._cache[key] = value
+            return value
+
+    def get_multi(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        if self.max_size is not None:
+            size = len(compat.pickle.dumps(value, compat.pickle.HIGHEST_PROTOCOL))
+            if size > self.max_size:
+                self.delete(key)
+                return
+        with self._lock:
+            self._pop(key)
+            self._cache[key] = value
+            if self.max_size is not None:
+                self._sizes[key] = size
+                self.size += size
+            while len(self._cache) > self.max_entries or (
+                self.max_size is not None and self.size > self.max_size
+            ):
+                self._pop(next(iter(self._cache)))
+
+    def _pop(self, key):
+        self._cache.pop(key, None)
+        self.size -= self._sizes.pop(key, 0)
+
+    def set_multi(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._sizes.clear()
+            self.size = 0
+
+
+register_backend('c2cgeoportal.memory_lru', 'c2cgeoportal.lib.caching', 'MemoryLRUBackend')
+
+
+# The ``should_cache_fn`` of the function called by ``cache_on_arguments``
+# in the thread, the background refresh gets it
+_calling = threading.local()
+
+
+def _async_creation_runner(cache, key, creator, mutex):
+    """ Create the new value in a background thread, meanwhile the
+    expired value is still served. A value refused by the
+    ``should_cache_fn`` of the function isn't stored, then the expired
+    value is still served. """
+    should_cache_fn = getattr(_calling, 'should_cache_fn', None)
+
+    def runner():
+        try:
+            value = creator()
+            if should_cache_fn is None or should_cache_fn(value):
+                cache.set(key, value)
+            else:
+                log.warning("The refreshed value of the cache key %s isn't cached" % key)
+        except Exception:  # pragma: no cover
+            log.exception("Error while refreshing the cache key: %s" % key)
+        finally:
+            mutex.release()
+
+    thread = threading.Thread(target=runner)
+    thread.daemon = True
+    thread.start()
+
+
+class MaxStaleBackend(ProxyBackend):
+    """ Don't return the values older than ``max_age`` seconds, then
+    an expired value is served only up to a maximum staleness. """
+
+    def __init__(self, max_age):
+        ProxyBackend.__init__(self)
+        self.max_age = max_age
+
+    def _check(self, value):
+        if value is not NO_VALUE and \
+                time.time() - value.metadata['ct'] > self.max_age:
+            return NO_VALUE
+        return value
+
+    def get(self, key):
+        return self._check(self.proxied.get(key))
+
+    def get_multi(self, keys):
+        return [self._check(value) for value in self.proxied.get_multi(keys)]
+
+
+GENERATION_KEY = 'c2cgeoportal:generation:%s'
+
+# The number of the current request of the thread, see ``new_request``
+_request = threading.local()
+
+
+def new_request(event=None):
+    """
+    Subscriber of the ``NewRequest`` event, the local caches check the
+    generation of their shared cache on their first use in a request.
+    """
+    _request.number = getattr(_request, 'number', 0) + 1
+
+
+class LocalCacheBackend(ProxyBackend):
+    """
+    An in-process LRU cache (see ``MemoryLRUBackend``) in front of a
+    shared backend.
+
+    The shared backend stores a generation of the region, a new generation
+    is set on invalidation and the other processes drop their local cache
+    when they see it, at most once per request (without request at each
+    access).
+    """
+
+    def __init__(self, name, arguments):
+        ProxyBackend.__init__(self)
+        self.generation_key = GENERATION_KEY % name
+        self.local = MemoryLRUBackend(arguments)
+        self._generation = None
+        self._checked = threading.local()
+
+    def _check_generation(self):
+        number = getattr(_request, 'number', None)
+        if number is not None and getattr(self._checked, 'number', None) == number:
+            return
+        self._checked.number = number
+        generation = self.proxied.get(self.generation_key)
+        if generation is NO_VALUE:
+            generation = None
+        if generation != self._generation:
+            self.local.clear()
+            self._generation = generation
+
+    def new_generation(self):
+        """ Drop the local caches of all the processes. """
+        self._generation = uuid.uuid4().hex
+        self.proxied.set(self.generation_key, self._generation)
+        self.local.clear()
+
+    def get(self, key):
+        self._check_generation()
+        value = self.local.get(key)
+        if value is NO_VALUE:
+            value = self.proxied.get(key)
+            if value is not NO_VALUE:
+                self.local.set(key, value)
+        return value
+
+    def get_multi(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.proxied.set(key, value)
+        self.local.set(key, value)
+
+    def set_multi(self, mapping):
+        self.proxied.set_multi(mapping)
+        self.local.set_multi(mapping)
+
+    def delete(self, key):
+        self.proxied.delete(key)
+        self.local.delete(key)
+
+    def delete_multi(self, keys):
+        self.proxied.delete_multi(keys)
+        self.local.delete_multi(keys)
+
+
+class FileLock(object):
+    """ A mutex shared by all the processes of the host, based on ``flock``. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fd = None
+
+    def acquire(self, wait=True):
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd = self._fd
+        self._fd = None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class FileLockBackend(ProxyBackend):
+    """ Use a ``FileLock`` in ``lock_dir`` as the dogpile lock of each key,
+    then only one process creates a value. """
+
+    def __init__(self, lock_dir):
+        ProxyBackend.__init__(self)
+        self.lock_dir = lock_dir
+        if not os.path.exists(lock_dir):  # pragma: no cover
+            os.makedirs(lock_dir)
+
+    def get_mutex(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return FileLock(os.path.join(
+            self.lock_dir, hashlib.sha1(key).hexdigest() + '.lock'
+        ))
+
+
+CHUNK_KEY = 'c2cgeoportal:chunk:%s:%i'
+
+# The first character of the serialized values
+_PICKLED = 'p'
+_COMPRESSED = 'z'
+_CHUNKED = 'c'
+
+
+class SerializingBackend(ProxyBackend):
+    """
+    Store the values as strings: pickled with the highest protocol,
+    compressed with zlib when they are bigger than ``compress_threshold``
+    bytes, and split across several keys when they are bigger than
+    ``chunk_size`` bytes (memcached refuses the values bigger than 1 MB by
+    default).
+
+    The hits, the misses and the sizes are counted in ``stats``.
+    """
+
+    def __init__(self, compress_threshold=1024, chunk_size=1000000 - 1024):
+        ProxyBackend.__init__(self)
+        self.compress_threshold = compress_threshold
+        self.chunk_size = chunk_size
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'read_bytes': 0,
+            'written_bytes': 0,
+            'compressed': 0,
+            'chunked': 0,
+        }
+
+    def _dumps(self, value):
+        data = compat.pickle.dumps(value, compat.pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.compress_threshold:
+            compressed = zlib.compress(data)
+            if len(compressed) < len(data):
+                self.stats['compressed'] += 1
+                return _COMPRESSED + compressed
+        return _PICKLED + data
+
+    def _loads(self, data):
+        if data[:1] == _COMPRESSED:
+            return compat.pickle.loads(zlib.decompress(data[1:]))
+        return compat.pickle.loads(data[1:])
+
+    def _chunk_keys(self, manifest):
+        uid, count = manifest[1:].split(':')
+        return [CHUNK_KEY % (uid, i) for i in range(int(count))]
+
+    def get(self, key):
+        data = self.proxied.get(key)
+        if isinstance(data, str) and data[:1] == _CHUNKED:
+            chunks = self.proxied.get_multi(self._chunk_keys(data))
+            data = NO_VALUE if NO_VALUE in chunks else ''.join(chunks)
+        if data is NO_VALUE:
+            self.stats['misses'] += 1
+            return NO_VALUE
+        self.stats['hits'] += 1
+        if not isinstance(data, str):  # pragma: no cover
+            # stored without serialization
+            return data
+        self.stats['read_bytes'] += len(data)
+        return self._loads(data)
+
+    def get_multi(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        data = self._dumps(value)
+        self.stats['sets'] += 1
+        self.stats['written_bytes'] += len(data)
+        self._delete_chunks(key)
+        if len(data) > self.chunk_size:
+            self.stats['chunked'] += 1
+            count = (len(data) - 1) // self.chunk_size + 1
+            manifest = '%s%s:%i' % (_CHUNKED, uuid.uuid4().hex, count)
+            self.proxied.set_multi(dict(
+                (chunk_key, data[i * self.chunk_size:(i + 1) * self.chunk_size])
+                for i, chunk_key in enumerate(self._chunk_keys(manifest))
+            ))
+            data = manifest
+        self.proxied.set(key, data)
+
+    def set_multi(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def _delete_chunks(self, key):
+        manifest = self.proxied.get(key)
+        if isinstance(manifest, str) and manifest[:1] == _CHUNKED:
+            self.proxied.delete_multi(self._chunk_keys(manifest))
+
+    def delete(self, key):
+        self._delete_chunks(key)
+        self.proxied.delete(key)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+
 def init_region(conf, region=None):
     """
     Initialize the caching module.
+
+    In addition to the dogpile.cache configuration (``backend``,
+    ``expiration_time`` and ``arguments``) the following optional
+    properties are supported:
+
+    * ``refresh_in_background``: when a value is expired it is still
+      served while one thread creates the new value.
+    * ``max_stale``: the number of seconds after the expiration time
+      during which an expired value can still be served.
+    * ``lock_dir``: a directory used to store file locks, to have only one
+      process that creates a value.
+    * ``local_cache``: the arguments of an in-process LRU cache in front of
+      the backend (``max_entries`` and ``max_size``), see
+      ``LocalCacheBackend``.
+    * ``serializer``: store the values as compressed and chunked strings,
+      with the ``compress_threshold`` and ``chunk_size`` arguments, see
+      ``SerializingBackend``.
+    * ``expiration_times``: expiration times by kind of value, see
+      ``get_expiration_time``.
     """
-    cache_region = make_region(function_key_generator=keygen_function)
+    cache_region = make_region(
+        function_key_generator=keygen_function,
+        async_creation_runner=_async_creation_runner
+        if conf.get('refresh_in_background', False) else None,
+    )
     kwargs = dict(
         (k, conf[k]) for k in
         ('arguments', 'expiration_time') if k in conf)
-    cache_region.configure(conf['backend'], **kwargs)
+    wrap = []
+    if conf.get('max_stale') is not None and conf.get('expiration_time') is not None:
+        wrap.append(MaxStaleBackend(conf['expiration_time'] + conf['max_stale']))
+    if conf.get('lock_dir') is not None:
+        wrap.append(FileLockBackend(conf['lock_dir']))
+    _local_caches.pop(region, None)
+    if conf.get('local_cache') is not None:
+        # the last one is directly in front of the backend
+        _local_caches[region] = LocalCacheBackend(
+            region or 'default', conf['local_cache']
+        )
+        wrap.append(_local_caches[region])
+    _serializers.pop(region, None)
+    if conf.get('serializer') is not None:
+        _serializers[region] = SerializingBackend(**conf['serializer'])
+        wrap.append(_serializers[region])
+    cache_region.configure(conf['backend'], wrap=wrap, **kwargs)
     _regions[region] = cache_region
+    _expiration_times[region] = conf.get('expiration_times', {})
     return cache_region
 
 
+def get_region_conf(conf, region):
+    """
+    Return the configuration of a named region, it's the ``cache``
+    configuration overridden by the default configuration of the region
+    and by the property of the same name.
+    """
+    region_conf = dict(
+        (k, v) for k, v in conf.items() if k not in REGIONS
+    )
+    region_conf.update(REGIONS[region])
+    region_conf.update(conf.get(region, {}))
+    return region_conf
+
+
+def init_regions(conf):
+    """
+    Initialize the default region and the named regions.
+    """
+    init_region(conf)
+    for region in REGIONS:
+        init_region(get_region_conf(conf, region), region)
+
+
 def get_region(region=None):
     """
     Return a cache region.
@@ -93,5 +737,110 @@ def get_region(region=None):
             "initialized before it can be used")
 
 
-def invalidate_region(region=None):
-    return get_region(region).invalidate()
+def get_named_region(region):
+    """
+    Return a named region, or the default region if it isn't initialized.
+    """
+    cache_region = _regions.get(region, None)
+    if cache_region is None:
+        cache_region = get_region()
+    return cache_region
+
+
+def get_expiration_time(region, kind):
+    """
+    Return the expiration time of a kind of value in a named region, None
+    means the expiration time of the region.
+    """
+    return _expiration_times.get(region, {}).get(kind)
+
+
+def cache_on_arguments(region=None, tags=(), allow_lists=None, **kwargs):
+    """
+    Decorator that caches the function in the given named region, see
+    :meth:`.CacheRegion.cache_on_arguments`.
+
+    The region is got when the function is called, then it doesn't need to
+    be initialized when the module is imported. A named region that isn't
+    initialized is replaced by the default region.
+
+    Arguments:
+
+    * ``region`` The name of the region.
+    * ``tags`` What the cached value depends on, see ``keygen_with_tags``.
+    * ``allow_lists`` The allowed keys of the dictionary arguments, see
+      ``keygen_function``.
+
+    A ``should_cache_fn`` is also used by the refresh in background.
+    """
+    should_cache_fn = kwargs.get('should_cache_fn')
+    if len(tags) > 0 or allow_lists is not None:
+        kwargs['function_key_generator'] = keygen_with_tags(
+            *tags, allow_lists=allow_lists
+        )
+
+    def decorator(fn):
+        # the region and the function decorated by the region
+        decorated = [None, None]
+
+        @wraps(fn)
+        def cached_fn(*args, **kw):
+            cache_region = get_named_region(region)
+            if decorated[0] is not cache_region:
+                decorated[1] = cache_region.cache_on_arguments(**kwargs)(fn)
+                decorated[0] = cache_region
+            previous = getattr(_calling, 'should_cache_fn', None)
+            _calling.should_cache_fn = should_cache_fn
+            try:
+                return decorated[1](*args, **kw)
+            finally:
+                _calling.should_cache_fn = previous
+        return cached_fn
+    return decorator
+
+
+def get_stats():
+    """
+    Return the statistics of the regions that have a serializer or a
+    local cache, by region name.
+    """
+    stats = {}
+    for region in set(_serializers) | set(_local_caches):
+        region_stats = {}
+        if region in _serializers:
+            region_stats.update(_serializers[region].stats)
+        if region in _local_caches:
+            local = _local_caches[region].local
+            region_stats['local_entries'] = len(local._cache)
+            region_stats['local_size'] = local.size
+        stats[region or 'default'] = region_stats
+    return stats
+
+
+def invalidate_region(region=None, hard=True):
+    """
+    Invalidate a cache region, with a soft invalidation the values are
+    considered as expired, they can be served while they are refreshed.
+    """
+    cache_region = get_region(region)
+    if region in _local_caches:
+        _local_caches[region].new_generation()
+    # the soft invalidation requires an expiration time
+    cache_region.invalidate(
+        hard=hard or cache_region.expiration_time is None
+    )
+    if region is None:
+        # the tags versions never expire, they are renewed with the epoch
+        cache_region.set(TAGS_EPOCH_KEY, _new_version())
+
+
+def invalidate_regions():
+    """
+    Invalidate the default region and the named regions, the regions that
+    refresh the values in the background are invalidated softly.
+    """
+    for region in [None] + list(REGIONS):
+        if region in _regions:
+            invalidate_region(
+                region, hard=_regions[region].async_creation_runner is None
+            )
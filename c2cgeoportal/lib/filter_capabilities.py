@@ -29,7 +29,6 @@
 
 
 import logging
-import httplib2
 from StringIO import StringIO
 from urlparse import urlparse, urljoin
 from urllib import urlopen
@@ -41,31 +40,15 @@ from xml.sax.xmlreader import InputSource
 
 from pyramid.httpexceptions import HTTPBadGateway
 
-from sqlalchemy import distinct
+from c2cgeoportal.lib import caching, upstream
+from c2cgeoportal.lib.permission import get_permission_index
+from c2cgeoportal.lib.wmscapabilities import parse_capabilities
 
-from owslib.wms import WebMapService
-
-from c2cgeoportal.lib import caching, get_protected_layers_query
-from c2cgeoportal.models import DBSession, Layer
-
-cache_region = caching.get_region()
 log = logging.getLogger(__name__)
 
 
-@cache_region.cache_on_arguments()
-def _get_protected_layers(role_id):
-    q = get_protected_layers_query(role_id, distinct(Layer.name))
-    return [r for r, in q.all()]
-
-
-@cache_region.cache_on_arguments()
-def _get_private_layers():
-    q = DBSession.query(Layer.name).filter(Layer.public.is_(False))
-    return [r for r, in q.all()]
-
-
-@cache_region.cache_on_arguments()
-def _wms_structure(wms_url, host):
+@caching.cache_on_arguments('upstream')
+def _wms_structure(wms_url, host, capabilities_version):
     params = (
         ('SERVICE', 'WMS'),
         ('VERSION', '1.1.1'),
@@ -82,12 +65,13 @@ def _wms_structure(wms_url, host):
     log.info("Get WMS GetCapabilities for URL: %s" % wms_url)
 
     # forward request to target (without Host Header)
-    http = httplib2.Http()
     headers = dict()
     if url.hostname == 'localhost' and host is not None:  # pragma: no cover
         headers['Host'] = host
     try:
-        resp, content = http.request(wms_url, method='GET', headers=headers)
+        resp, content = upstream.request(
+            wms_url, method='GET', headers=headers, name='mapserver'
+        )
     except:  # pragma: no cover
         raise HTTPBadGateway("Unable to GetCapabilities from wms_url %s" % wms_url)
 
@@ -98,28 +82,25 @@ def _wms_structure(wms_url, host):
         )
 
     try:
-        wms = WebMapService(None, xml=content)
-        result = {}
-
-        def _fill(name, parent):
-            if parent is None:
-                return
-            if parent.name not in result:
-                result[parent.name] = []
-            result[parent.name].append(name)
-            _fill(name, parent.parent)
-
-        for layer in wms.contents.values():
-            _fill(layer.name, layer.parent)
-        return result
-
-    except AttributeError:  # pragma: no cover
+        wms = parse_capabilities(content)
+    except ValueError:  # pragma: no cover
         error = "WARNING! an error occured while trying to " \
             "read the mapfile and recover the themes."
         error = "%s\nurl: %s\nxml:\n%s" % (error, wms_url, content)
         log.exception(error)
         raise HTTPBadGateway(error)
 
+    result = {}
+    for layer in wms.layers.values():
+        parents = set()
+        parent = layer.parent
+        # a duplicated layer name can create a loop
+        while parent is not None and parent not in parents:
+            parents.add(parent)
+            result.setdefault(parent, []).append(layer.name)
+            parent = wms[parent].parent
+    return result
+
 
 def enable_proxies(proxies):  # pragma: no cover
     old_prepare_input_source = saxutils.prepare_input_source
@@ -154,16 +135,11 @@ def filter_capabilities(content, role_id, wms, wms_url, headers, proxies):
     if proxies:  # pragma: no cover
         enable_proxies(proxies)
 
-    wms_structure = _wms_structure(wms_url, headers.get('Host', None))
-    tmp_private_layers = list(_get_private_layers())
-    for name in _get_protected_layers(role_id):
-        tmp_private_layers.remove(name)
-
-    private_layers = set()
-    for layer in tmp_private_layers:
-        private_layers.add(layer)
-        if layer in wms_structure:
-            private_layers.update(wms_structure[layer])
+    wms_structure = _wms_structure(
+        wms_url, headers.get('Host', None),
+        caching.get_tags_version(caching.capabilities_tag(wms_url))
+    )
+    private_layers = get_permission_index(role_id).private_layers(wms_structure)
 
     parser = sax.make_parser()
     result = StringIO()
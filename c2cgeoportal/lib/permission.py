@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+from collections import Counter
+
+from sqlalchemy import inspect
+
+from c2cgeoportal.lib import caching
+from c2cgeoportal.models import DBSession, TreeItem, Layer, LayerV1, \
+    LayerInternalWMS, LayerExternalWMS, LayerWMTS, RestrictionArea, Interface, \
+    layer_ra, role_ra, interface_layer
+
+_LAYER_TYPES = {
+    1: frozenset([inspect(LayerV1).polymorphic_identity]),
+    2: frozenset([
+        inspect(cls).polymorphic_identity
+        for cls in (LayerInternalWMS, LayerExternalWMS, LayerWMTS)
+    ]),
+}
+
+
+class PermissionIndex(object):
+    """ A snapshot of what the role identified by ``role_id`` is allowed to
+    access, ``role_id`` is ``None`` for the anonymous user.
+
+    Attributes:
+
+    * ``layers`` a dict layer id => ``(name, public, item_type, interfaces)``.
+    * ``protected_layers`` the ids of the non public layers granted to the role.
+    * ``readwrite_layers`` the ids of the layers editable by the role.
+
+    The geometries of the restriction areas aren't loaded, the access to the
+    features is checked with a query in each request, see
+    ``Layers._proto_read``.
+    """
+
+    def __init__(self, role_id):
+        self.role_id = role_id
+        self.layers = {}
+        self.protected_layers = frozenset()
+        self.readwrite_layers = frozenset()
+        self._visible_layers = {}
+
+    def load(self):
+        interfaces = {}
+        query = DBSession.query(interface_layer.c.layer_id, Interface.name) \
+            .join(Interface, Interface.id == interface_layer.c.interface_id)
+        for layer_id, interface in query.all():
+            interfaces.setdefault(layer_id, set()).add(interface)
+
+        query = DBSession.query(
+            Layer.id, TreeItem.name, Layer.public, TreeItem.item_type
+        )
+        for layer_id, name, public, item_type in query.all():
+            self.layers[layer_id] = (
+                name, public, item_type,
+                frozenset(interfaces.get(layer_id, ())),
+            )
+
+        if self.role_id is None:
+            return self
+
+        query = DBSession.query(
+            RestrictionArea.id, RestrictionArea.readwrite,
+        ).join(role_ra, role_ra.c.restrictionarea_id == RestrictionArea.id) \
+            .filter(role_ra.c.role_id == self.role_id)
+        restriction_areas = dict(query.all())
+        if len(restriction_areas) == 0:
+            return self
+
+        protected_layers = set()
+        readwrite_layers = set()
+        query = DBSession.query(
+            layer_ra.c.layer_id, layer_ra.c.restrictionarea_id
+        ).filter(layer_ra.c.restrictionarea_id.in_(restriction_areas.keys()))
+        for layer_id, ra_id in query.all():
+            if layer_id not in self.layers:  # pragma: no cover
+                continue
+            if not self.layers[layer_id][1]:
+                protected_layers.add(layer_id)
+            if restriction_areas[ra_id]:
+                readwrite_layers.add(layer_id)
+
+        self.protected_layers = frozenset(protected_layers)
+        self.readwrite_layers = frozenset(readwrite_layers)
+        return self
+
+    def is_visible(self, layer_id):
+        return self.layers[layer_id][1] or layer_id in self.protected_layers
+
+    def visible_layers(self, version, interface=None):
+        """ Return the names of the layers of the ``version`` that the role
+        can see in the ``interface``. """
+        key = (version, interface)
+        if key not in self._visible_layers:
+            types = _LAYER_TYPES[version]
+            self._visible_layers[key] = frozenset([
+                name
+                for layer_id, (name, public, item_type, interfaces)
+                in self.layers.items()
+                if item_type in types and self.is_visible(layer_id) and
+                (interface is None or interface in interfaces)
+            ])
+        return self._visible_layers[key]
+
+    def private_layers(self, wms_structure=None):
+        """ Return the names of the layers hidden to the role, including the
+        layers contained in a hidden WMS group (``wms_structure`` is a dict
+        group name => names of all the contained layers). """
+        # a name shared by several layers stays private while one of them
+        # is, like the query on ``Layer.public.is_(False)`` a layer without
+        # public flag isn't private
+        names = Counter(
+            name for name, public, item_type, interfaces in self.layers.values()
+            if public is False
+        )
+        names.subtract(
+            set(self.layers[layer_id][0] for layer_id in self.protected_layers)
+        )
+        private_layers = set()
+        for name, count in names.items():
+            if count > 0:
+                private_layers.add(name)
+                if wms_structure is not None and name in wms_structure:
+                    private_layers.update(wms_structure[name])
+        return private_layers
+
+
+@caching.cache_on_arguments(
+    'permission', tags=(caching.TREE, caching.RESTRICTION, caching.ROLE)
+)
+def get_permission_index(role_id):
+    """ Return the cached ``PermissionIndex`` of the role. """
+    return PermissionIndex(role_id).load()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class Tree(object):
+    """ The layer tree loaded in memory.
+
+    Arguments:
+
+    * ``items`` A dict of all the tree items by id, the relations used
+      to build the themes (``children``, ``ui_metadata``, ``interfaces``,
+      ``functionalities``, ``restricted_roles`` and ``dimensions``) are
+      already loaded.
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    @property
+    def themes(self):
+        """ The themes ordered by ``ordering``. """
+        from c2cgeoportal.models import Theme
+
+        return sorted(
+            [item for item in self.items.values() if isinstance(item, Theme)],
+            key=lambda theme: theme.ordering
+        )
+
+
+def _group_by(rows):
+    result = {}
+    for key, value in rows:
+        result.setdefault(key, []).append(value)
+    return result
+
+
+def load_tree(session):
+    """ Load the whole layer tree with a fixed number of queries,
+    whatever the depth of the tree, and return a ``Tree``.
+
+    The relations are set as committed values on the mapped objects,
+    then walking through the tree doesn't reach the database anymore.
+    """
+    from c2cgeoportal.models import TreeItem, TreeGroup, Layer, Theme, \
+        LayerWMTS, LayergroupTreeitem, UIMetadata, Interface, Functionality, \
+        Role, WMTSDimension, interface_layer, interface_theme, \
+        theme_functionality, restricted_role_theme
+
+    items = dict(
+        (item.id, item) for item in
+        session.query(TreeItem).with_polymorphic('*').all()
+    )
+
+    links = session.query(LayergroupTreeitem).order_by(
+        LayergroupTreeitem.treegroup_id,
+        LayergroupTreeitem.ordering,
+        LayergroupTreeitem.id,
+    ).all()
+
+    metadata = _group_by(
+        (m.item_id, m) for m in
+        session.query(UIMetadata).order_by(UIMetadata.id).all()
+    )
+
+    layer_interfaces = _group_by(session.query(
+        interface_layer.c.layer_id, Interface
+    ).join(Interface, Interface.id == interface_layer.c.interface_id).all())
+
+    theme_interfaces = _group_by(session.query(
+        interface_theme.c.theme_id, Interface
+    ).join(Interface, Interface.id == interface_theme.c.interface_id).all())
+
+    functionalities = _group_by(session.query(
+        theme_functionality.c.theme_id, Functionality
+    ).join(
+        Functionality,
+        Functionality.id == theme_functionality.c.functionality_id
+    ).all())
+
+    restricted_roles = _group_by(session.query(
+        restricted_role_theme.c.theme_id, Role
+    ).join(Role, Role.id == restricted_role_theme.c.role_id).all())
+
+    dimensions = _group_by(
+        (d.layer_id, d) for d in
+        session.query(WMTSDimension).order_by(WMTSDimension.id).all()
+    )
+
+    children = {}
+    parents = {}
+    for link in links:
+        group = items.get(link.treegroup_id)
+        item = items.get(link.treeitem_id)
+        set_committed_value(link, 'group', group)
+        set_committed_value(link, 'item', item)
+        children.setdefault(link.treegroup_id, []).append(link)
+        parents.setdefault(link.treeitem_id, []).append(link)
+
+    for id_, item in items.items():
+        set_committed_value(item, 'ui_metadata', metadata.get(id_, []))
+        set_committed_value(item, 'parents_relation', parents.get(id_, []))
+        if isinstance(item, TreeGroup):
+            set_committed_value(item, 'children_relation', children.get(id_, []))
+        if isinstance(item, Layer):
+            set_committed_value(item, 'interfaces', layer_interfaces.get(id_, []))
+        if isinstance(item, LayerWMTS):
+            set_committed_value(item, 'dimensions', dimensions.get(id_, []))
+        if isinstance(item, Theme):
+            set_committed_value(item, 'interfaces', theme_interfaces.get(id_, []))
+            set_committed_value(item, 'functionalities', functionalities.get(id_, []))
+            set_committed_value(item, 'restricted_roles', restricted_roles.get(id_, []))
+
+    return Tree(items)
@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+import time
+import socket
+import httplib
+import logging
+import threading
+from urlparse import urlparse
+
+import httplib2
+
+log = logging.getLogger(__name__)
+
+# The default configuration of the upstream HTTP client, overridden by
+# the ``http_client`` settings:
+#
+# * pool_size: the number of idle clients kept by upstream host, each one
+#   keeps its connection alive.
+# * connect_timeout: the timeout in seconds to open a connection.
+# * read_timeout: the timeout in seconds to wait for the response data,
+#   None to wait without limit (the print can be long).
+# * retries: the number of times a GET or a HEAD request is sent again
+#   after a connection error. httplib2 also sends a request again once
+#   by itself after a connection error, then a buffered GET can be sent
+#   up to 2 * (retries + 1) times while the ``retried`` and ``errors``
+#   statistics only count the attempts of the pool.
+# * failure_threshold: the number of consecutive failures that open the
+#   circuit breaker, the requests then fail immediately.
+# * reset_timeout: the number of seconds the circuit breaker stays open,
+#   one request is then sent to probe the upstream server (half open).
+# * max_in_flight: the maximum number of requests sent at the same time,
+#   None for no limit.
+#
+# The ``upstreams`` property of the settings overrides this configuration
+# by upstream name (e.g. mapserver, print), see ``get_pool``, over the
+# ``DEFAULT_UPSTREAMS``.
+DEFAULT_CONFIG = {
+    'pool_size': 10,
+    'connect_timeout': 10,
+    'read_timeout': None,
+    'retries': 1,
+    'failure_threshold': 5,
+    'reset_timeout': 30,
+    'max_in_flight': None,
+}
+
+# The default configuration by upstream name, a MapServer or a print
+# server that doesn't answer shouldn't block the workers forever.
+DEFAULT_UPSTREAMS = {
+    'mapserver': {'read_timeout': 60},
+    'print': {'read_timeout': 300},
+}
+
+_config = dict(DEFAULT_CONFIG)
+_upstreams = dict((name, dict(c)) for name, c in DEFAULT_UPSTREAMS.items())
+_pools = {}
+_pools_lock = threading.Lock()
+
+# the methods that can be sent again
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+# the maximum size of the chunks of a streamed response
+CHUNK_SIZE = 64 * 1024
+
+# the states of the circuit breaker
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# the response statuses that count as a failure of the upstream server
+FAILURE_STATUSES = (502, 503, 504)
+
+
+class Unavailable(Exception):
+    """ The request isn't sent because the circuit breaker of the upstream
+    server is open or because too many requests are in flight. """
+
+
+def _connection_type(base, read_timeout):
+    """ Return a connection class that uses the read timeout once the
+    connection is opened with the connect timeout. """
+    class Connection(base):
+        def connect(self):
+            base.connect(self)
+            self.sock.settimeout(read_timeout)
+    return Connection
+
+
+class HttpPool(object):
+    """
+    A pool of ``httplib2.Http`` for an upstream host, an ``Http`` isn't
+    thread safe and keeps its connections alive, then each one is used
+    by one thread at a time.
+
+    The pool has a circuit breaker: after ``failure_threshold`` consecutive
+    connection errors, timeouts or gateway errors the requests raise
+    ``Unavailable`` during ``reset_timeout`` seconds, then one request
+    probes the server, its success closes the circuit.
+    """
+
+    def __init__(self, key, config):
+        self.key = key
+        self.size = int(config['pool_size'])
+        self.connect_timeout = config['connect_timeout']
+        self.read_timeout = config['read_timeout']
+        self.retries = int(config['retries'])
+        self._connection_types = {
+            'http': _connection_type(
+                httplib2.HTTPConnectionWithTimeout, self.read_timeout
+            ),
+            'https': _connection_type(
+                httplib2.HTTPSConnectionWithTimeout, self.read_timeout
+            ),
+        }
+        self.failure_threshold = int(config['failure_threshold'])
+        self.reset_timeout = config['reset_timeout']
+        self.max_in_flight = config['max_in_flight']
+        self._idle = []
+        self._connections = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.requests = 0
+        self.retried = 0
+        self.errors = 0
+        self.rejected = 0
+        self.in_use = 0
+        self.in_flight = 0
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def _admit(self):
+        """ Check the circuit breaker and the number of requests in flight
+        before sending a request, ``_done`` should then be called. """
+        with self._lock:
+            if self.state == OPEN and \
+                    time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                self.rejected += 1
+                raise Unavailable("The circuit of %s is open" % self.key)
+            if self.max_in_flight is not None and \
+                    self.in_flight >= self.max_in_flight:
+                self.rejected += 1
+                raise Unavailable("Too many requests in flight to %s" % self.key)
+            if self.state == HALF_OPEN:
+                self._probing = True
+            self.in_flight += 1
+
+    def _record(self, success):
+        """ Update the circuit breaker with the result of a request,
+        ``success`` is ``None`` for an interrupted request (e.g. by a
+        ``KeyboardInterrupt``) that isn't a failure of the server. """
+        with self._lock:
+            self._probing = False
+            if success is None:
+                return
+            if success:
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    log.warning("Open the circuit of %s" % self.key)
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def _done(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _acquire(self):
+        with self._lock:
+            self.in_use += 1
+            if len(self._idle) > 0:
+                return self._idle.pop()
+            self.created += 1
+        return httplib2.Http(timeout=self.connect_timeout)
+
+    def _release(self, http, reusable=True):
+        with self._lock:
+            self.in_use -= 1
+            if reusable and len(self._idle) < self.size:
+                self._idle.append(http)
+                return
+        _close(http)
+
+    def close(self):
+        """ Close the connections of the idle clients. """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            connections, self._connections = self._connections, []
+        for http in idle:
+            _close(http)
+        for connection in connections:
+            connection.close()
+
+    def _acquire_connection(self, scheme, netloc, reuse=True):
+        """ Return a connection and whether it's an idle connection of the
+        pool, with ``reuse`` false a new connection is opened. """
+        with self._lock:
+            self.in_use += 1
+            if reuse and len(self._connections) > 0:
+                return self._connections.pop(), True
+            self.created += 1
+        return self._connection_types[scheme](netloc, timeout=self.connect_timeout), False
+
+    def _release_connection(self, connection, reusable=True):
+        with self._lock:
+            self.in_use -= 1
+            if reusable and len(self._connections) < self.size:
+                self._connections.append(connection)
+                return
+        connection.close()
+
+    def request(self, url, method='GET', body=None, headers=None):
+        """ Send the request and return the ``httplib2.Response`` and
+        the content, like ``httplib2.Http.request``. """
+        return self._request(url, method, body, headers)
+
+    def _request(self, url, method, body, headers):
+        self._admit()
+        success = None
+        try:
+            resp, content = self._send(url, method, body, headers)
+            success = resp.status not in FAILURE_STATUSES
+            return resp, content
+        except Exception:
+            success = False
+            raise
+        finally:
+            self._record(success)
+            self._done()
+
+    def _send(self, url, method, body, headers):
+        scheme = urlparse(url).scheme
+        attempt = 0
+        while True:
+            http = self._acquire()
+            with self._lock:
+                self.requests += 1
+            reusable = False
+            try:
+                result = http.request(
+                    url, method=method, body=body, headers=headers,
+                    connection_type=self._connection_types.get(scheme),
+                )
+                reusable = True
+            except (socket.error, httplib.HTTPException):
+                with self._lock:
+                    self.errors += 1
+                if method not in IDEMPOTENT_METHODS or attempt >= self.retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retried += 1
+                log.info("Retry %i on the URL: %s" % (attempt, url))
+                continue
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                self._release(http, reusable)
+            return result
+
+    def stream(self, url, method='GET', body=None, headers=None,
+               chunk_size=CHUNK_SIZE):
+        """ Send the request and return a ``StreamedResponse``, the
+        ``body`` can be a file. """
+        obj = urlparse(url)
+        path = obj.path or '/'
+        if obj.query:
+            path += '?' + obj.query
+        self._admit()
+        response = success = None
+        try:
+            response = self._stream(obj, path, url, method, body, headers, chunk_size)
+            success = response.status not in FAILURE_STATUSES
+            return response
+        except Exception:
+            success = False
+            raise
+        finally:
+            self._record(success)
+            if response is None:
+                self._done()
+
+    def _stream(self, obj, path, url, method, body, headers, chunk_size):
+        # the server may have closed an idle connection, then a request
+        # that can't be sent again (not idempotent or with a body read from
+        # a file) is sent on a new connection, and the other ones are sent
+        # again once on a new connection if the idle one fails
+        reuse = method in IDEMPOTENT_METHODS and not hasattr(body, 'read')
+        attempt = 0
+        while True:
+            connection, reused = self._acquire_connection(
+                obj.scheme, obj.netloc, reuse
+            )
+            with self._lock:
+                self.requests += 1
+            response = None
+            try:
+                connection.request(method, path, body, headers or {})
+                response = connection.getresponse()
+            except (socket.error, httplib.HTTPException):
+                with self._lock:
+                    self.errors += 1
+                if reused:
+                    reuse = False
+                    with self._lock:
+                        self.retried += 1
+                    log.info("Reconnect on the URL: %s" % url)
+                    continue
+                if method not in IDEMPOTENT_METHODS or attempt >= self.retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retried += 1
+                log.info("Retry %i on the URL: %s" % (attempt, url))
+                continue
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                # the connection of a response goes back to the pool when
+                # the response is read
+                if response is None:
+                    self._release_connection(connection, False)
+            return StreamedResponse(self, connection, response, chunk_size)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'idle_connections': len(self._connections),
+                'in_use': self.in_use,
+                'created': self.created,
+                'requests': self.requests,
+                'retried': self.retried,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'in_flight': self.in_flight,
+                'state': self.state,
+                'failures': self.failures,
+            }
+
+
+class StreamedResponse(object):
+    """
+    A response which body is read by chunks of at most ``chunk_size``
+    bytes by iterating on it, usable as a WSGI ``app_iter``. The connection
+    goes back to the pool when the body is completely read, it's closed
+    if the response is closed before.
+    """
+
+    def __init__(self, pool, connection, response, chunk_size):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = dict(response.getheaders())
+        self._pool = pool
+        self._connection = connection
+        self._response = response
+        self._chunk_size = chunk_size
+
+    def __contains__(self, name):
+        return name in self.headers
+
+    def __getitem__(self, name):
+        return self.headers[name]
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._connection is None:
+            raise StopIteration
+        data = None
+        try:
+            data = self._response.read(self._chunk_size)
+        finally:
+            if data is None:
+                self._release(False)
+        if not data:
+            self._release(not self._response.will_close)
+            raise StopIteration
+        return data
+
+    def read(self):
+        """ Return the whole body. """
+        return ''.join(self)
+
+    def close(self):
+        if self._connection is not None:
+            self._release(False)
+
+    def _release(self, reusable):
+        connection, self._connection = self._connection, None
+        self._pool._release_connection(connection, reusable)
+        self._pool._done()
+
+
+def _close(http):
+    for connection in http.connections.values():
+        connection.close()
+
+
+def init(conf):
+    """
+    Configure the upstream HTTP client with the ``http_client`` settings,
+    the existing pools are closed.
+    """
+    global _config, _upstreams
+    _config = dict(DEFAULT_CONFIG)
+    _config.update(conf or {})
+    _upstreams = dict((name, dict(c)) for name, c in DEFAULT_UPSTREAMS.items())
+    for name, upstream_conf in (_config.pop('upstreams', None) or {}).items():
+        _upstreams.setdefault(name, {}).update(upstream_conf or {})
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def get_pool(url, name=None):
+    """ Return the pool of the upstream host of the URL, with a ``name``
+    the pool is configured with the named upstream configuration and
+    it doesn't share its circuit breaker with the other upstreams on the
+    same host. """
+    obj = urlparse(url)
+    key = "%s://%s" % (obj.scheme, obj.netloc)
+    if name is not None:
+        key = "%s:%s" % (name, key)
+    try:
+        return _pools[key]
+    except KeyError:
+        with _pools_lock:
+            if key not in _pools:
+                config = dict(_config)
+                config.update(_upstreams.get(name) or {})
+                _pools[key] = HttpPool(key, config)
+            return _pools[key]
+
+
+def request(url, method='GET', body=None, headers=None, name=None):
+    """
+    Send a request to an upstream server through the pool of its host (see
+    ``get_pool`` for the ``name``), return the ``httplib2.Response`` and
+    the content, raise ``Unavailable`` when the request isn't sent.
+    """
+    return get_pool(url, name).request(
+        url, method=method, body=body, headers=headers
+    )
+
+
+def stream(url, method='GET', body=None, headers=None, chunk_size=CHUNK_SIZE,
+           name=None):
+    """
+    Send a request to an upstream server through the pool of its host,
+    return a ``StreamedResponse`` to read the body by chunks. The
+    connections of the streamed responses don't use a proxy.
+    """
+    return get_pool(url, name).stream(
+        url, method=method, body=body, headers=headers, chunk_size=chunk_size
+    )
+
+
+def get_stats():
+    """ Return the statistics of the pools by upstream host. """
+    return dict(
+        (key, pool.get_stats()) for key, pool in _pools.items()
+    )
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+import time
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+import transaction
+from pyramid.request import Request
+from pyramid.scripting import prepare
+
+log = logging.getLogger(__name__)
+
+
+class RoleUser(object):
+    """ A user that only has a role, used to build what depends on the role. """
+
+    def __init__(self, role):
+        self.id = None
+        self.username = u'warmup'
+        self.role = role
+        self.parent_role = None
+
+
+def get_items(versions=(1, 2)):
+    """
+    Return the items to warm up, for each role (``None`` for the anonymous
+    user): ``('capabilities', role_id)``, for each interface
+    ``('mobile', role_id, interface)`` and for each interface and version
+    ``('themes', role_id, interface, version)``.
+    """
+    from c2cgeoportal.models import DBSession, Role, Interface
+
+    role_ids = [None] + [r.id for r in DBSession.query(Role.id).order_by(Role.id)]
+    interfaces = [i.name for i in DBSession.query(Interface.name).order_by(Interface.name)]
+    items = []
+    for role_id in role_ids:
+        items.append(('capabilities', role_id))
+        for interface in interfaces:
+            items.append(('mobile', role_id, interface))
+            for version in versions:
+                items.append(('themes', role_id, interface, version))
+    return items
+
+
+def _prepare(registry, application_url, path, role_id):
+    from c2cgeoportal.models import DBSession, Role
+
+    env = prepare(Request.blank(path, base_url=application_url), registry)
+    request = env['request']
+    request._user = None if role_id is None else \
+        RoleUser(DBSession.query(Role).get(role_id))
+    return request, env['closer']
+
+
+def warmup_item(registry, application_url, item):
+    """
+    Fill the caches of an item (see ``get_items``), return the item, the
+    time taken and the errors.
+    """
+    from c2cgeoportal.views.entry import Entry
+    from c2cgeoportal.views.mapserverproxy import MapservProxy
+
+    start = time.time()
+    errors = []
+    role_id = item[1]
+    try:
+        request, closer = _prepare(registry, application_url, '/', role_id)
+        try:
+            entry = Entry(request)
+            if item[0] in ('themes', 'mobile'):
+                # fill the payloads used by the views, not only the tree
+                wms, _ = entry._wms_layers()
+                wms_version = getattr(wms, 'version', None)
+                if item[0] == 'themes':
+                    errors += entry._themes_payload(
+                        role_id, role_id, item[2], item[3], False, 1, wms_version
+                    )['errors']
+                else:
+                    errors += entry._mobile_themes(role_id, item[2], wms_version)[1]
+            else:
+                entry._functionality()
+                errors += entry._internal_wfs_types(role_id)[1]
+                errors += entry._external_wfs_types(role_id)[1]
+        finally:
+            closer()
+
+        if item[0] == 'capabilities':
+            for service in ('WMS', 'WFS'):
+                request, closer = _prepare(
+                    registry, application_url,
+                    '/mapserv_proxy?SERVICE=%s&REQUEST=GetCapabilities' % service,
+                    role_id
+                )
+                try:
+                    response = MapservProxy(request).proxy()
+                    if response.status_int != 200:  # pragma: no cover
+                        errors.append('%s GetCapabilities returns the status %s' % (
+                            service, response.status
+                        ))
+                finally:
+                    closer()
+    except Exception:  # pragma: no cover
+        log.exception('Error while warming up the cache for %s' % (item,))
+        errors.append('Unable to warm up the cache, see logs for details')
+    finally:
+        transaction.abort()
+
+    duration = time.time() - start
+    log.info('Cache warmed up for %s in %.3fs' % (item, duration))
+    return item, duration, errors
+
+
+def warmup(registry, application_url, versions=(1, 2), threads=4):
+    """
+    Fill the caches for all the roles, interfaces and theme versions with a
+    pool of ``threads`` threads, return the list of the results of
+    ``warmup_item``.
+
+    ``application_url`` should be the URL used by the users, it is a part of
+    the cache keys.
+    """
+    try:
+        items = get_items(versions)
+    finally:
+        transaction.abort()
+
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(
+            lambda item: warmup_item(registry, application_url, item), items
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+
+def warmup_in_background(registry, application_url, versions=(1, 2), threads=4):
+    """
+    Run ``warmup`` in a background thread, used after an invalidation.
+    """
+    def run():
+        start = time.time()
+        try:
+            warmup(registry, application_url, versions, threads)
+            log.info('Cache warmed up in %.3fs' % (time.time() - start))
+        except Exception:  # pragma: no cover
+            log.exception('Error while warming up the cache')
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
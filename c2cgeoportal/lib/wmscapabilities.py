@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+import logging
+import hashlib
+from collections import namedtuple, OrderedDict
+from itertools import count
+from math import sqrt
+from StringIO import StringIO
+from xml.etree.cElementTree import iterparse, ParseError
+
+log = logging.getLogger(__name__)
+
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+
+WMSLayer = namedtuple('WMSLayer', [
+    # the layer name, None for the unnamed layers
+    'name',
+    # the name of the nearest named parent layer
+    'parent',
+    # the tuple of the child ``WMSLayer``, named or not
+    'children',
+    # the queryable attribute as an integer
+    'queryable',
+    # the (min, max) resolution hint of the layer and its sub layers,
+    # (inf, 0) if there is no scale hint
+    'resolution_hint',
+    # the metadata URLs of the layer and its sub layers, as dicts with
+    # the keys ``type``, ``format`` and ``url``
+    'metadata_urls',
+    # the time positions as a list of strings, or None
+    'timepositions',
+    # the default time position, or None
+    'defaulttimeposition',
+])
+
+
+class WMSCapabilities(object):
+    """ A compact index of the layers of a WMS GetCapabilities document.
+
+    It behaves like a read only dict of the named layers (``WMSLayer``)
+    in the document order and can be pickled to be stored in the cache.
+
+    ``version`` is a hash of the document, it changes when the
+    capabilities change.
+    """
+
+    def __init__(self, layers, version=None):
+        self.layers = layers
+        self.version = version
+
+    def __getitem__(self, name):
+        return self.layers[name]
+
+    def __contains__(self, name):
+        return name in self.layers
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def get(self, name, default=None):
+        return self.layers.get(name, default)
+
+
+def _tag(elem):
+    # ignore the namespace
+    return elem.tag.rsplit('}', 1)[-1]
+
+
+def _text(elem):
+    if elem is None or elem.text is None:
+        return None
+    text = elem.text.strip()
+    return text if text != '' else None
+
+
+class _LayerBuilder(object):
+    def __init__(self, queryable, parent):
+        self.name = None
+        self.order = None
+        self.queryable = queryable
+        self.parent = parent
+        self.scale_hint = None
+        self.metadata_urls = []
+        self.timepositions = None
+        self.defaulttimeposition = None
+        self.children = []
+
+    def named_parent(self):
+        parent = self.parent
+        while parent is not None and parent.name is None:
+            parent = parent.parent
+        return None if parent is None else parent.name
+
+    def add(self, elem):
+        """ Add a direct child element of the layer """
+        tag = _tag(elem)
+        if tag == 'Name':
+            self.name = _text(elem)
+        elif tag == 'ScaleHint':
+            if 'min' in elem.attrib and 'max' in elem.attrib:
+                self.scale_hint = (elem.attrib['min'], elem.attrib['max'])
+        elif tag == 'MetadataURL':
+            format_ = None
+            url = None
+            for child in elem:
+                if _tag(child) == 'Format':
+                    format_ = _text(child)
+                elif _tag(child) == 'OnlineResource':
+                    url = child.attrib.get(XLINK_HREF)
+            self.metadata_urls.append({
+                'type': elem.attrib.get('type'),
+                'format': format_,
+                'url': url,
+            })
+        elif tag == 'Extent':
+            if self.timepositions is None and \
+                    elem.attrib.get('name', '').lower() == 'time' and elem.text:
+                self.timepositions = elem.text.split(',')
+                self.defaulttimeposition = elem.attrib.get('default')
+
+    def build(self):
+        resolution_min = float('inf')
+        resolution_max = 0
+        if self.scale_hint is not None:
+            # scaleHint is based upon a pixel diagonal length whereas we use
+            # resolutions based upon a pixel edge length. There is a sqrt(2)
+            # ratio between edge and diagonal of a square.
+            resolution_min = float(self.scale_hint[0]) / sqrt(2)
+            resolution_max = float(self.scale_hint[1]) / sqrt(2)
+        metadata_urls = list(self.metadata_urls)
+        for child in self.children:
+            resolution_min = min(resolution_min, child.resolution_hint[0])
+            resolution_max = max(resolution_max, child.resolution_hint[1])
+            metadata_urls.extend(child.metadata_urls)
+
+        return WMSLayer(
+            name=self.name,
+            parent=self.named_parent(),
+            children=tuple(self.children),
+            queryable=self.queryable,
+            resolution_hint=(resolution_min, resolution_max),
+            metadata_urls=tuple(metadata_urls),
+            timepositions=self.timepositions,
+            defaulttimeposition=self.defaulttimeposition,
+        )
+
+
+def parse_capabilities(content):
+    """ Parse a WMS GetCapabilities document and return a ``WMSCapabilities``.
+
+    The document is parsed in streaming, the layer elements are dropped
+    as soon as they are read.
+
+    Raise a ``ValueError`` if the document is not a valid capabilities
+    document.
+    """
+    layers = OrderedDict()
+    # the layers are ordered like their start tags, as in OWSLib, and a
+    # duplicated name is given to the last one in this order
+    orders = {}
+    counter = count()
+    # the element stack, with the layer builder for the Layer elements
+    stack = []
+    root = None
+
+    try:
+        for event, elem in iterparse(StringIO(content), events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                builder = None
+                if _tag(elem) == 'Layer':
+                    parent = None
+                    for _, parent in reversed(stack):
+                        if parent is not None:
+                            break
+                    builder = _LayerBuilder(
+                        int(elem.attrib.get('queryable', 0)), parent
+                    )
+                stack.append((elem, builder))
+                continue
+
+            _, builder = stack.pop()
+            if builder is not None:
+                layer = builder.build()
+                if builder.parent is not None:
+                    builder.parent.children.append(layer)
+                if layer.name is not None:
+                    if orders[layer.name] == builder.order:
+                        layers[layer.name] = layer
+                elem.clear()
+            elif len(stack) > 0 and stack[-1][1] is not None:
+                parent = stack[-1][1]
+                parent.add(elem)
+                if _tag(elem) == 'Name' and parent.name is not None:
+                    parent.order = next(counter)
+                    if parent.name in orders:
+                        log.warning(
+                            "Content metadata for layer '%s' already exists. "
+                            "Using child layer" % parent.name
+                        )
+                    else:
+                        layers[parent.name] = None
+                    orders[parent.name] = parent.order
+    except ParseError as e:
+        raise ValueError("Unable to parse the capabilities: %s" % e)
+
+    if root is None or _tag(root) not in ('WMT_MS_Capabilities', 'WMS_Capabilities'):
+        raise ValueError("The document is not a WMS capabilities document")
+
+    return WMSCapabilities(layers, hashlib.sha1(content).hexdigest())
@@ -30,6 +30,11 @@
 
 import isodate
 import datetime
+import heapq
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=isodate.UTC)
+_MICROSECONDS = 1000000
+_DAY = 86400
 
 
 class TimeInformation(object):
@@ -79,12 +84,20 @@ class TimeExtentValue(object):
         """
         Arguments:
 
-        * ``values`` A set() of datetime
+        * ``values`` An iterable of datetime
         * ``resolution`` The resolution from the mapfile time definition
         * ``min_def_value`` the minimum default value as a datetime
         * ``max_def_value`` the maximum default value as a datetime
+
+        The values are stored as a sorted tuple of ``(ordinal, formatted
+        value)`` where the ordinal is the number of microseconds since
+        the epoch, to be merged and exported without handling the
+        datetimes again.
         """
-        self.values = values
+        values = sorted((_ordinal(value), value) for value in values)
+        self.values = tuple(_unique(
+            (ordinal, _format_date(value)) for ordinal, value in values
+        ))
         self.resolution = resolution
         self.min_def_value = min_def_value
         self.max_def_value = max_def_value
@@ -94,25 +107,80 @@ class TimeExtentValue(object):
             raise ValueError(
                 "Could not mix time defined as a list of "
                 "values with other type of definition")
-        self.values.update(extent.values)
+        # the values tuple is replaced (not updated), then a shallow copy
+        # of an extent is enough to merge it
+        self.values = tuple(_unique(heapq.merge(self.values, extent.values)))
         self.min_def_value = min(self.min_def_value, extent.min_def_value)
         self.max_def_value = max(self.max_def_value, extent.max_def_value)
 
     def to_dict(self):
-        values = sorted(self.values)
         min_def_value = _format_date(self.min_def_value) \
             if self.min_def_value else None
         max_def_value = _format_date(self.max_def_value) \
             if self.max_def_value else None
 
-        return {
-            "minValue": _format_date(values[0]),
-            "maxValue": _format_date(values[-1]),
-            "values": map(_format_date, values),
+        result = {
+            "minValue": self.values[0][1],
+            "maxValue": self.values[-1][1],
             "resolution": self.resolution,
             "minDefValue": min_def_value,
             "maxDefValue": max_def_value,
+            "values": [value for ordinal, value in self.values],
         }
+        # the regularly spaced values also give their interval
+        interval = self._regular_interval()
+        if interval is not None:
+            result["interval"] = interval
+        return result
+
+    def _regular_interval(self):
+        """
+        Return the interval as a tuple (years, months, days, seconds) if
+        there is more than two values, all separated by the same interval,
+        otherwise ``None``.
+        """
+        if len(self.values) < 3:
+            return None
+
+        if self.resolution in ("year", "month"):
+            months = []
+            for ordinal, value in self.values:
+                date = _EPOCH + datetime.timedelta(microseconds=ordinal)
+                if date.day != 1 or date.time() != datetime.time():
+                    return None
+                months.append(date.year * 12 + date.month - 1)
+            step = _constant_step(months)
+            if step is None:
+                return None
+            return (step / 12, 0, 0, 0) if step % 12 == 0 else (0, step, 0, 0)
+
+        step = _constant_step([ordinal for ordinal, value in self.values])
+        if step is None or step % _MICROSECONDS != 0:
+            return None
+        step /= _MICROSECONDS
+        return (0, 0, step / _DAY, step % _DAY)
+
+
+def _ordinal(date):
+    delta = date - _EPOCH
+    return (delta.days * _DAY + delta.seconds) * _MICROSECONDS + delta.microseconds
+
+
+def _unique(values):
+    """ Remove the successive values with the same ordinal. """
+    last = None
+    for value in values:
+        if value[0] != last:
+            last = value[0]
+            yield value
+
+
+def _constant_step(ordinals):
+    step = ordinals[1] - ordinals[0]
+    for i in range(2, len(ordinals)):
+        if ordinals[i] - ordinals[i - 1] != step:
+            return None
+    return step
 
 
 class TimeExtentInterval(object):
@@ -199,7 +267,7 @@ def parse_extent(extent, default_values):
             # case "value1, value2, ..., valueN"
             dates = [_parse_date(d) for d in extent]
             resolution = dates[0][0]
-            values = set(d[1] for d in dates)
+            values = [d[1] for d in dates]
 
             return TimeExtentValue(values, resolution, min_def_value,
                                    max_def_value)
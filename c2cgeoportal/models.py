@@ -95,7 +95,22 @@ else:  # pragma: nocover
 
 
 def cache_invalidate_cb(*args):
-    caching.invalidate_region()
+    """ Event listener that invalidates the cached values depending on
+    the models, whatever the changed model. """
+    caching.invalidate_tags(
+        caching.TREE, caching.RESTRICTION, caching.ROLE, caching.FUNCTIONALITY
+    )
+
+
+def tags_invalidate_cb(*tags):
+    """ Return an event listener that invalidates the cached values
+    depending on the given tags. """
+    def callback(*args):
+        caching.invalidate_tags(*tags)
+    return callback
+
+
+_tree_invalidate_cb = tags_invalidate_cb(caching.TREE)
 
 
 class TsVector(UserDefinedType):
@@ -145,6 +160,13 @@ class Functionality(Base):
     def __unicode__(self):
         return "%s - %s" % (self.name or u'', self.value or u'')  # pragma: nocover
 
+
+_functionality_invalidate_cb = tags_invalidate_cb(caching.FUNCTIONALITY, caching.TREE)
+event.listen(Functionality, 'after_insert', _functionality_invalidate_cb)
+event.listen(Functionality, 'after_update', _functionality_invalidate_cb)
+event.listen(Functionality, 'after_delete', _functionality_invalidate_cb)
+
+
 # association table role <> functionality
 role_functionality = Table(
     'role_functionality', Base.metadata,
@@ -283,6 +305,14 @@ class Role(Base):
         return to_shape(self.extent).bounds
 
 
+_role_invalidate_cb = tags_invalidate_cb(
+    caching.ROLE, caching.RESTRICTION, caching.TREE
+)
+event.listen(Role, 'after_insert', _role_invalidate_cb)
+event.listen(Role, 'after_update', _role_invalidate_cb)
+event.listen(Role, 'after_delete', _role_invalidate_cb)
+
+
 class TreeItem(Base):
     __tablename__ = 'treeitem'
     __table_args__ = {'schema': _schema}
@@ -314,9 +344,10 @@ class TreeItem(Base):
     def __unicode__(self):
         return self.name or u''  # pragma: nocover
 
-event.listen(TreeItem, 'after_insert', cache_invalidate_cb, propagate=True)
-event.listen(TreeItem, 'after_update', cache_invalidate_cb, propagate=True)
-event.listen(TreeItem, 'after_delete', cache_invalidate_cb, propagate=True)
+
+event.listen(TreeItem, 'after_insert', _tree_invalidate_cb, propagate=True)
+event.listen(TreeItem, 'after_update', _tree_invalidate_cb, propagate=True)
+event.listen(TreeItem, 'after_delete', _tree_invalidate_cb, propagate=True)
 
 
 # association table LayerGroup <> TreeItem
@@ -362,9 +393,10 @@ class LayergroupTreeitem(Base):
         self.item = item
         self.ordering = ordering
 
-event.listen(LayergroupTreeitem, 'after_insert', cache_invalidate_cb, propagate=True)
-event.listen(LayergroupTreeitem, 'after_update', cache_invalidate_cb, propagate=True)
-event.listen(LayergroupTreeitem, 'after_delete', cache_invalidate_cb, propagate=True)
+
+event.listen(LayergroupTreeitem, 'after_insert', _tree_invalidate_cb, propagate=True)
+event.listen(LayergroupTreeitem, 'after_update', _tree_invalidate_cb, propagate=True)
+event.listen(LayergroupTreeitem, 'after_delete', _tree_invalidate_cb, propagate=True)
 
 
 class TreeGroup(TreeItem):
@@ -691,9 +723,11 @@ class RestrictionArea(Base):
     def __unicode__(self):  # pragma: nocover
         return self.name or u''
 
-event.listen(RestrictionArea, 'after_insert', cache_invalidate_cb)
-event.listen(RestrictionArea, 'after_update', cache_invalidate_cb)
-event.listen(RestrictionArea, 'after_delete', cache_invalidate_cb)
+
+_restriction_invalidate_cb = tags_invalidate_cb(caching.RESTRICTION)
+event.listen(RestrictionArea, 'after_insert', _restriction_invalidate_cb)
+event.listen(RestrictionArea, 'after_update', _restriction_invalidate_cb)
+event.listen(RestrictionArea, 'after_delete', _restriction_invalidate_cb)
 
 
 # association table interface <> layer
@@ -756,6 +790,11 @@ class Interface(Base):
         return self.name or u''
 
 
+event.listen(Interface, 'after_insert', _tree_invalidate_cb)
+event.listen(Interface, 'after_update', _tree_invalidate_cb)
+event.listen(Interface, 'after_delete', _tree_invalidate_cb)
+
+
 class UIMetadata(Base):
     __label__ = _(u'UI metadata')
     __plural__ = _(u'UI metadatas')
@@ -784,6 +823,11 @@ class UIMetadata(Base):
         return self.name or u''
 
 
+event.listen(UIMetadata, 'after_insert', _tree_invalidate_cb)
+event.listen(UIMetadata, 'after_update', _tree_invalidate_cb)
+event.listen(UIMetadata, 'after_delete', _tree_invalidate_cb)
+
+
 class WMTSDimension(Base):
     __label__ = _(u'WMTS dimension')
     __plural__ = _(u'WMTS dimensions')
@@ -812,6 +856,11 @@ class WMTSDimension(Base):
         return self.name or u''
 
 
+event.listen(WMTSDimension, 'after_insert', _tree_invalidate_cb)
+event.listen(WMTSDimension, 'after_update', _tree_invalidate_cb)
+event.listen(WMTSDimension, 'after_delete', _tree_invalidate_cb)
+
+
 if _parentschema is not None and _parentschema != '':  # pragma: no cover
     class ParentRole(Base):
         __label__ = _(u'parentrole')
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+import os.path
+import time
+import warnings
+from optparse import OptionParser
+
+from pyramid.paster import get_app
+
+
+def main():  # pragma: no cover
+    """
+    Fill the caches for all the roles, interfaces and theme versions,
+    exemple:
+    .build/venv/bin/cache_warmup -u https://geomapfish.example.com/
+
+    to get the options list, do:
+    .build/venv/bin/cache_warmup -h
+    """
+
+    usage = """Usage: %prog [options]
+
+Fill the caches for all the roles, interfaces and theme versions.
+The application URL should be the one used by the users, it's a part of the cache keys."""
+
+    parser = OptionParser(usage)
+    parser.add_option(
+        '-i', '--app-config', default='production.ini',
+        dest='app_config',
+        help='The application .ini config file (optional, default is '
+        'production.ini)'
+    )
+    parser.add_option(
+        '-n', '--app-name', default="app", dest='app_name',
+        help='The application name (optional, default is "app")'
+    )
+    parser.add_option(
+        '-u', '--url', default='http://localhost/',
+        help='The application URL (optional, default is "http://localhost/")'
+    )
+    parser.add_option(
+        '-t', '--threads', default=4, type='int',
+        help='The number of parallel threads (optional, default is 4)'
+    )
+    parser.add_option(
+        '-v', '--version', default=[], type='int', action='append',
+        dest='versions',
+        help='The themes version, can be repeated (optional, default is 1 and 2)'
+    )
+
+    (options, args) = parser.parse_args()
+
+    app_config = options.app_config
+    app_name = options.app_name
+
+    if app_name is None and '#' in app_config:
+        app_config, app_name = app_config.split('#', 1)
+    if not os.path.isfile(app_config):
+        parser.error('Can\'t find config file: %s' % app_config)
+
+    # Ignores pyramid deprecation warnings
+    warnings.simplefilter('ignore', DeprecationWarning)
+
+    app = get_app(app_config, name=app_name)
+
+    # must be done only once we have loaded the project config
+    from c2cgeoportal.lib.warmup import warmup
+
+    start = time.time()
+    results = warmup(
+        app.registry, options.url, tuple(options.versions) or (1, 2),
+        options.threads
+    )
+    for item, duration, errors in results:
+        print "%-50s %8.3fs" % (' '.join(str(i) for i in item), duration)
+        for error in errors:
+            print "    %s" % error
+
+    print "%i items warmed up in %.3fs" % (len(results), time.time() - start)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
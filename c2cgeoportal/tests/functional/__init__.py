@@ -54,6 +54,7 @@ if os.path.exists(configfile):
     mapserv_url = urljoin('http://localhost/', mapserv_url.path)
 
 c2cgeoportal.caching.init_region({'backend': 'dogpile.cache.memory'})
+c2cgeoportal.caching.init_region({'backend': 'dogpile.cache.memory'}, 'upstream')
 
 
 def set_up_common():
@@ -120,6 +121,7 @@ def tear_down_common():
     sqlahelper.reset()
 
     c2cgeoportal.caching.invalidate_region()
+    c2cgeoportal.caching.invalidate_region('upstream')
 
 
 def create_dummy_request(additional_settings={}, *args, **kargs):
@@ -36,7 +36,6 @@ import os
 import json
 from geoalchemy2 import WKTElement
 from pyramid import testing
-from owslib.wms import WebMapService
 
 from c2cgeoportal.tests.functional import (  # noqa
     tear_down_common as tearDownModule,
@@ -433,7 +432,7 @@ class TestEntryView(TestCase):
         entry = Entry(request)
 
         # unautenticated
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(len(themes), 1)
         layers = [l['name'] for l in themes[0]['children'][0]['children']]
         self.assertTrue('__test_public_layer' in layers)
@@ -441,7 +440,7 @@ class TestEntryView(TestCase):
 
         # autenticated on parent
         request.user = DBSession.query(User).filter_by(username=u'__test_user1').one()
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(len(themes), 1)
         layers = [l['name'] for l in themes[0]['children'][0]['children']]
         self.assertTrue('__test_public_layer' in layers)
@@ -450,7 +449,7 @@ class TestEntryView(TestCase):
         # autenticated
         request.params = {}
         request.user = DBSession.query(User).filter_by(username=u'__test_user1').one()
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(len(themes), 1)
         layers = [l['name'] for l in themes[0]['children'][0]['children']]
         self.assertTrue('__test_public_layer' in layers)
@@ -529,6 +528,7 @@ class TestEntryView(TestCase):
 
     @attr(entry_points=True)
     def test_entry_points(self):
+        from pyramid.response import Response
         from c2cgeoportal.views.entry import Entry
 
         request = self._create_request_obj()
@@ -598,9 +598,27 @@ class TestEntryView(TestCase):
             set(['lang', 'debug', 'queryable_layers', 'tiles_url', 'url_params'])
         )
         result = entry.apihelp()
-        self.assertEquals(set(result.keys()), set(['lang', 'debug']))
+        self.assertEquals(set(result.keys()), set(['lang', 'debug', 'cache_version']))
         result = entry.xapihelp()
-        self.assertEquals(set(result.keys()), set(['lang', 'debug']))
+        self.assertEquals(set(result.keys()), set(['lang', 'debug', 'cache_version']))
+
+        self.assertEquals(request.response.cache_control.no_cache, '*')
+        request.params['cache_version'] = result['cache_version']
+        request.response = Response()
+        entry.apijs()
+        self.assertEquals(request.response.cache_control.public, True)
+
+        # the queryable layers depend on the user
+        request = self._create_request_obj(
+            username=u'__test_user1',
+            params={'cache_version': result['cache_version']},
+        )
+        request.registry.settings.update({
+            'external_mapserv_url': mapserv,
+        })
+        Entry(request).apijs()
+        self.assertNotEquals(request.response.cache_control.public, True)
+        self.assertEquals(request.response.cache_control.private, '*')
 
     @attr(auth_home=True)
     def test_auth_home(self):
@@ -829,6 +847,7 @@ class TestEntryView(TestCase):
         from c2cgeoportal.views.entry import Entry
         from c2cgeoportal.models import LayerV1, LayerGroup
         from c2cgeoportal.lib.wmstparsing import TimeInformation
+        from c2cgeoportal.lib.wmscapabilities import parse_capabilities
 
         request = self._create_request_obj()
         request.static_url = lambda name: '/dummy/static/' + name
@@ -1044,8 +1063,8 @@ class TestEntryView(TestCase):
         h = {'Host': host}
         resp, xml = http.request(url, method='GET', headers=h)
 
-        wms = WebMapService(None, xml=xml)
-        wms_layers = list(wms.contents)
+        wms = parse_capabilities(xml)
+        wms_layers = list(wms)
 
         layer = LayerV1()
         layer.id = 20
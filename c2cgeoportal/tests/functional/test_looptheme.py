@@ -33,6 +33,7 @@ from nose.plugins.attrib import attr
 
 import transaction
 import os
+import json
 from pyramid import testing
 
 from c2cgeoportal.tests.functional import (  # noqa
@@ -83,7 +84,8 @@ class TestLoopTheme(TestCase):
         transaction.commit()
 
     def test_theme(self):
-        from c2cgeoportal.views.entry import Entry, cache_region
+        from c2cgeoportal.lib import caching
+        from c2cgeoportal.views.entry import Entry
 
         request = testing.DummyRequest()
         request.headers['Host'] = host
@@ -97,10 +99,10 @@ class TestLoopTheme(TestCase):
         request.user = None
         entry = Entry(request)
 
-        cache_region.invalidate()
-        themes = entry.themes()
+        caching.invalidate_regions()
+        themes = json.loads(entry.themes().body)
         self.assertEquals([t['name'] for t in themes], [u'__test_theme'])
 
-        cache_region.invalidate()
+        caching.invalidate_regions()
         themes, errors = entry._themes(None, u'main')
         self.assertEquals(len([e for e in errors if e == "Too many recursions with group '__test_layer_group'"]), 1)
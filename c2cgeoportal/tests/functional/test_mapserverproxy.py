@@ -268,6 +268,70 @@ class TestMapserverproxyView(TestCase):
         self.assertTrue(response.cache_control.public)
         self.assertEqual(response.cache_control.max_age, 1000)
 
+    def _count_mapserver_requests(self, request):
+        """ Proxy the request and return the number of requests sent to
+        MapServer, 0 when the response comes from the cache. """
+        from c2cgeoportal.views.mapserverproxy import MapservProxy
+
+        calls = []
+        proxy = MapservProxy(request)
+        send = proxy._proxy
+
+        def _proxy(*args):
+            calls.append(args)
+            return send(*args)
+
+        proxy._proxy = _proxy
+        response = proxy.proxy()
+        self.assertEqual(response.status_int, 200)
+        return len(calls)
+
+    @attr(cache_key=True)
+    def test_get_legend_graphic_cache_key(self):
+        from c2cgeoportal.lib.caching import invalidate_regions
+
+        invalidate_regions()
+        request = self._create_dummy_request()
+        request.headers['User-Agent'] = 'Mozilla/5.0 (X11; Linux x86_64) Firefox/45.0'
+        request.params.update(dict(
+            service='wms', version='1.1.1', request='getlegendgraphic',
+            layer='testpoint_unprotected', srs='EPSG:21781', format='image/png',
+        ))
+        self.assertEqual(self._count_mapserver_requests(request), 1)
+
+        # other User-Agent
+        request = self._create_dummy_request()
+        request.headers['User-Agent'] = 'Mozilla/5.0 (X11; Linux x86_64) Chrome/50.0'
+        request.params.update(dict(
+            service='wms', version='1.1.1', request='getlegendgraphic',
+            layer='testpoint_unprotected', srs='EPSG:21781', format='image/png',
+        ))
+        self.assertEqual(self._count_mapserver_requests(request), 0)
+
+        # other parameters case
+        request = self._create_dummy_request()
+        request.params.update(dict(
+            SERVICE='wms', VERSION='1.1.1', REQUEST='getlegendgraphic',
+            LAYER='testpoint_unprotected', SRS='EPSG:21781', FORMAT='image/png',
+        ))
+        self.assertEqual(self._count_mapserver_requests(request), 0)
+
+        # other values case
+        request = self._create_dummy_request()
+        request.params.update(dict(
+            service='WMS', version='1.1.1', request='GetLegendGraphic',
+            layer='testpoint_unprotected', srs='EPSG:21781', format='IMAGE/PNG',
+        ))
+        self.assertEqual(self._count_mapserver_requests(request), 0)
+
+        # other value of a case sensitive parameter
+        request = self._create_dummy_request()
+        request.params.update(dict(
+            service='wms', version='1.1.1', request='getlegendgraphic',
+            layer='testpoint_unprotected', srs='EPSG:4326', format='image/png',
+        ))
+        self.assertEqual(self._count_mapserver_requests(request), 1)
+
     def test_get_feature_info(self):
         from c2cgeoportal.views.mapserverproxy import MapservProxy
 
@@ -578,6 +642,21 @@ class TestMapserverproxyView(TestCase):
         response = MapservProxy(request).proxy()
         self.assertTrue(response.body.find('<Name>testpoint_protected</Name>') > 0)
 
+    @attr(getcapabilities=True)
+    @attr(cache_key=True)
+    def test_get_capabilities_cache_key(self):
+        from c2cgeoportal.lib.caching import invalidate_regions
+
+        invalidate_regions()
+        for username, count in (
+            (None, 1), (None, 0), (u'__test_user1', 1), (u'__test_user1', 0),
+        ):
+            request = self._create_getcap_request(username=username)
+            request.params.update(dict(
+                service='wms', version='1.1.1', request='getcapabilities',
+            ))
+            self.assertEqual(self._count_mapserver_requests(request), count)
+
     def _get_feature_is_equal_to(self, value):
         from c2cgeoportal.views.mapserverproxy import MapservProxy
 
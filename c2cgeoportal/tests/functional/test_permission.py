@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+from nose.plugins.attrib import attr
+from unittest import TestCase
+
+from c2cgeoportal.tests.functional import (  # noqa
+    tear_down_common as tearDownModule,
+    set_up_common as setUpModule
+)
+
+
+@attr(functional=True)
+class TestPermissionIndex(TestCase):
+
+    def setUp(self):  # noqa
+        import transaction
+        from geoalchemy2 import WKTElement
+        from c2cgeoportal.models import DBSession, Role, Interface, \
+            LayerV1, LayerInternalWMS, RestrictionArea
+
+        main = Interface(name=u'__test_main')
+        public = LayerV1(name=u'__test_public')
+        public.interfaces = [main]
+        private = LayerV1(name=u'__test_private', public=False)
+        private.interfaces = [main]
+        hidden = LayerV1(name=u'__test_hidden', public=False)
+        layer_v2 = LayerInternalWMS(name=u'__test_layer_v2')
+        self.role = Role(name=u'__test_role')
+        area = WKTElement(
+            "POLYGON((-100 30, -100 50, 100 50, 100 30, -100 30))", srid=21781
+        )
+        RestrictionArea(
+            name=u'__test_ra1', layers=[private], roles=[self.role],
+            area=area
+        )
+        RestrictionArea(
+            name=u'__test_ra2', layers=[public], roles=[self.role],
+            readwrite=True
+        )
+
+        DBSession.add_all([main, public, private, hidden, layer_v2, self.role])
+        transaction.commit()
+
+        self.role_id = self.role.id
+        self.public_id = public.id
+        self.private_id = private.id
+
+    def tearDown(self):  # noqa
+        import transaction
+        from c2cgeoportal.models import DBSession, Role, TreeItem, \
+            RestrictionArea, Interface
+
+        transaction.commit()
+
+        for ra in DBSession.query(RestrictionArea).filter(
+                RestrictionArea.name.in_([u'__test_ra1', u'__test_ra2'])).all():
+            ra.roles = []
+            ra.layers = []
+            DBSession.delete(ra)
+        for item in DBSession.query(TreeItem).filter(
+                TreeItem.name.like(u'__test_%')).all():
+            DBSession.delete(item)
+        DBSession.query(Role).filter(Role.name == u'__test_role').delete()
+        DBSession.query(Interface).filter(Interface.name == u'__test_main').delete()
+
+        transaction.commit()
+
+    def test_anonymous(self):
+        from c2cgeoportal.lib.permission import get_permission_index
+
+        index = get_permission_index(None)
+        layers = index.visible_layers(1, u'__test_main')
+        self.assertEquals(layers, set([u'__test_public']))
+        self.assertEquals(index.visible_layers(2) & set([u'__test_layer_v2']), set([u'__test_layer_v2']))
+        private_layers = index.private_layers({u'__test_hidden': [u'a']})
+        self.assertTrue(u'__test_private' in private_layers)
+        self.assertTrue(u'a' in private_layers)
+        self.assertEquals(index.readwrite_layers, set())
+
+    def test_role(self):
+        from c2cgeoportal.lib.permission import get_permission_index
+
+        index = get_permission_index(self.role_id)
+        layers = index.visible_layers(1, u'__test_main')
+        self.assertEquals(layers, set([u'__test_public', u'__test_private']))
+        private_layers = index.private_layers()
+        self.assertFalse(u'__test_private' in private_layers)
+        self.assertTrue(u'__test_hidden' in private_layers)
+        self.assertEquals(index.readwrite_layers, set([self.public_id]))
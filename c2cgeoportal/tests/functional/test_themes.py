@@ -29,6 +29,7 @@
 
 
 import re
+import json
 import transaction
 
 from unittest2 import TestCase
@@ -171,7 +172,7 @@ class TestThemesView(TestCase):
     @attr(order=True)
     def test_version(self):
         entry = self._create_entry_obj()
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(
             [self._only_name(t) for t in themes],
             [{
@@ -189,7 +190,7 @@ class TestThemesView(TestCase):
             "version": "2",
             "catalogue": "true",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [])
         self.assertEquals(
             [self._only_name(t) for t in themes['items']],
@@ -226,7 +227,7 @@ class TestThemesView(TestCase):
             "group": "__test_layer_group_3",
             "catalogue": "true",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [])
         self.assertEquals(
             self._only_name(themes['item']),
@@ -248,7 +249,7 @@ class TestThemesView(TestCase):
             "group": "__test_layer_group_4",
             "catalogue": "true",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [])
         self.assertEquals(
             self._only_name(themes['item']),
@@ -274,7 +275,7 @@ class TestThemesView(TestCase):
             "version": "2",
             "interface": "min_levels",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [
             u"The Layer '__test_layer_internal_wms' cannot be directly in the theme '__test_theme_layer' (0/1)."
         ])
@@ -283,7 +284,7 @@ class TestThemesView(TestCase):
             "version": "2",
             "min_levels": "2",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [
             u"The Layer '__test_theme/__test_layer_group_1/__test_layer_internal_wms' is under indented (1/2).",
             u"Layer '__test_layer_external_wms' cannot be in the group '__test_layer_group_1' (internal/external mix).",
@@ -300,7 +301,7 @@ class TestThemesView(TestCase):
             "interface": "min_levels",
             "min_levels": "0",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [
         ])
         self.assertEquals(
@@ -318,7 +319,7 @@ class TestThemesView(TestCase):
         entry = self._create_entry_obj(params={
             "version": "2",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [
             u"Layer '__test_layer_external_wms' cannot be in the group '__test_layer_group_1' (internal/external mix).",
             u"Layer '__test_layer_wmts' cannot be in the group '__test_layer_group_1' (internal/external mix).",
@@ -347,7 +348,7 @@ class TestThemesView(TestCase):
             "version": "2",
             "catalogue": "true",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [])
 
     @attr(tinterface=True)
@@ -357,7 +358,7 @@ class TestThemesView(TestCase):
             "interface": "mobile",
             "catalogue": "true",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [])
         self.assertEquals(
             [self._only_name(t) for t in themes['items']],
@@ -383,7 +384,7 @@ class TestThemesView(TestCase):
             "version": "2",
             "catalogue": "true",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [])
         self.assertEquals(
             [self._only_name(t, 'metadata') for t in themes['items']],
@@ -429,6 +430,16 @@ class TestThemesView(TestCase):
             }]
         )
 
+    @attr(group=True)
+    def test_group_not_found(self):
+        from pyramid.httpexceptions import HTTPNotFound
+
+        entry = self._create_entry_obj(params={
+            "version": "2",
+            "group": "__test_unknown_group",
+        })
+        self.assertRaises(HTTPNotFound, entry.themes)
+
     @attr(dimentions=True)
     def test_dimentions(self):
         entry = self._create_entry_obj(params={
@@ -436,7 +447,7 @@ class TestThemesView(TestCase):
             "group": "__test_layer_group_3",
             "catalogue": "true",
         })
-        themes = entry.themes()
+        themes = json.loads(entry.themes().body)
         self.assertEquals(self._get_filtred_errors(themes), [])
         self.assertEquals(
             self._only_name(themes['item'], 'dimensions'),
@@ -449,3 +460,93 @@ class TestThemesView(TestCase):
                 }]
             }
         )
+
+    @attr(etag=True)
+    def test_etag(self):
+        from pyramid.httpexceptions import HTTPNotModified
+        from c2cgeoportal.lib.caching import invalidate_tags, TREE
+
+        entry = self._create_entry_obj(params={
+            "version": "2",
+        })
+        entry.themes()
+        etag = entry.request.response.etag
+        self.assertIsNotNone(etag)
+
+        request = self._create_request_obj(params={
+            "version": "2",
+        })
+        request.headers['If-None-Match'] = '"%s"' % etag
+        from c2cgeoportal.views.entry import Entry
+        self.assertIsInstance(Entry(request).themes(), HTTPNotModified)
+
+        # not the same parameters
+        request = self._create_request_obj(params={
+            "version": "2",
+            "catalogue": "true",
+        })
+        request.headers['If-None-Match'] = '"%s"' % etag
+        self.assertNotIsInstance(Entry(request).themes(), HTTPNotModified)
+
+        # not the same content-coding
+        request = self._create_request_obj(params={
+            "version": "2",
+        })
+        request.headers['If-None-Match'] = '"%s"' % etag
+        request.headers['Accept-Encoding'] = 'gzip'
+        self.assertNotIsInstance(Entry(request).themes(), HTTPNotModified)
+
+        # the tree has changed
+        invalidate_tags(TREE)
+        request = self._create_request_obj(params={
+            "version": "2",
+        })
+        request.headers['If-None-Match'] = '"%s"' % etag
+        self.assertNotIsInstance(Entry(request).themes(), HTTPNotModified)
+
+    @attr(query_count=True)
+    def test_query_count(self):
+        import sqlahelper
+        from sqlalchemy import event
+        from c2cgeoportal.lib.caching import invalidate_region
+        from c2cgeoportal.models import DBSession, Theme, LayerGroup, \
+            LayerInternalWMS, Interface, UIMetadata
+
+        def count_queries():
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            engine = sqlahelper.get_engine()
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                invalidate_region()
+                entry = self._create_entry_obj(params={
+                    "version": "2",
+                    "catalogue": "true",
+                })
+                entry.themes()
+            finally:
+                event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+            return len(statements)
+
+        shallow_count = count_queries()
+
+        # add a deep theme
+        main = DBSession.query(Interface).filter(Interface.name == 'main').one()
+        children = []
+        for depth in range(10):
+            layer = LayerInternalWMS(name=u'__test_layer_deep_%i' % depth, public=True)
+            layer.interfaces = [main]
+            layer.ui_metadata = [UIMetadata('test', 'deep_%i' % depth)]
+            group = LayerGroup(name=u'__test_layer_group_deep_%i' % depth)
+            group.children = [layer] + children
+            children = [group]
+        theme = Theme(name=u'__test_theme_deep')
+        theme.interfaces = [main]
+        theme.children = children
+        DBSession.add(theme)
+        transaction.commit()
+
+        self.assertEquals(count_queries(), shallow_count)
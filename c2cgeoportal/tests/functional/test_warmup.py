@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+from unittest import TestCase
+from nose.plugins.attrib import attr
+
+import transaction
+from pyramid import testing
+
+from c2cgeoportal.tests.functional import (  # noqa
+    tear_down_common as tearDownModule,
+    set_up_common as setUpModule,
+    create_dummy_request, host)
+
+
+@attr(functional=True)
+@attr(warmup=True)
+class TestWarmup(TestCase):
+
+    def setUp(self):  # noqa
+        from c2cgeoportal import get_user_from_request
+        from c2cgeoportal.models import DBSession, LayerV1, \
+            Theme, LayerGroup, Interface, Role
+
+        self.config = testing.setUp()
+        self.config.set_request_property(get_user_from_request, name='user')
+        self.registry = create_dummy_request().registry
+        self.application_url = 'http://%s/' % host
+
+        main = Interface(name=u'main')
+
+        layer = LayerV1(name=u'__test_layer', public=True)
+        layer.interfaces = [main]
+
+        layer_group = LayerGroup(name=u'__test_layer_group')
+        layer_group.children = [layer]
+
+        theme = Theme(name=u'__test_theme')
+        theme.children = [layer_group]
+        theme.interfaces = [main]
+
+        role = Role(name=u'__test_role')
+
+        DBSession.add_all([theme, role])
+        transaction.commit()
+
+    def tearDown(self):  # noqa
+        testing.tearDown()
+
+        from c2cgeoportal.models import DBSession, LayerV1, \
+            Theme, LayerGroup, Interface, Role
+
+        for t in DBSession.query(Theme).filter(Theme.name == '__test_theme').all():
+            DBSession.delete(t)
+        for layergroup in DBSession.query(LayerGroup).all():
+            DBSession.delete(layergroup)
+        for layer in DBSession.query(LayerV1).all():
+            DBSession.delete(layer)
+        DBSession.query(Interface).filter(Interface.name == 'main').delete()
+        DBSession.query(Role).filter(Role.name == '__test_role').delete()
+
+        transaction.commit()
+
+    def _without_themes(self, function):
+        """ Call the function with an entry where building the themes
+        fails, to check that the payloads come from the cache. """
+        from c2cgeoportal.lib.warmup import _prepare
+        from c2cgeoportal.views.entry import Entry
+
+        def themes(*args, **kwargs):  # pragma: nocover
+            raise AssertionError('The themes are not in the cache')
+
+        original_themes = Entry.__dict__['_themes']
+        Entry._themes = themes
+        request, closer = _prepare(self.registry, self.application_url, '/', None)
+        try:
+            entry = Entry(request)
+            wms, _ = entry._wms_layers()
+            return function(entry, getattr(wms, 'version', None))
+        finally:
+            closer()
+            Entry._themes = original_themes
+            transaction.abort()
+
+    def test_get_items(self):
+        from c2cgeoportal.models import DBSession, Role
+        from c2cgeoportal.lib.warmup import get_items
+
+        role_id = DBSession.query(Role.id).filter(Role.name == '__test_role').one()[0]
+        items = get_items(versions=(2,))
+        transaction.abort()
+
+        self.assertIn(('capabilities', None), items)
+        self.assertIn(('capabilities', role_id), items)
+        self.assertIn(('mobile', None, u'main'), items)
+        self.assertIn(('mobile', role_id, u'main'), items)
+        self.assertIn(('themes', None, u'main', 2), items)
+        self.assertIn(('themes', role_id, u'main', 2), items)
+        self.assertNotIn(('themes', None, u'main', 1), items)
+
+    def test_warmup_themes(self):
+        from c2cgeoportal.lib import caching
+        from c2cgeoportal.lib.warmup import warmup_item
+
+        caching.invalidate_regions()
+        item = ('themes', None, u'main', 2)
+        result_item, duration, errors = warmup_item(
+            self.registry, self.application_url, item
+        )
+        self.assertEquals(result_item, item)
+
+        payload = self._without_themes(lambda entry, wms_version: entry._themes_payload(
+            None, None, u'main', 2, False, 1, wms_version
+        ))
+        self.assertIn('__test_theme', payload['identity'])
+
+    def test_warmup_mobile(self):
+        from c2cgeoportal.lib import caching
+        from c2cgeoportal.lib.warmup import warmup_item
+
+        caching.invalidate_regions()
+        item = ('mobile', None, u'main')
+        self.assertEquals(warmup_item(
+            self.registry, self.application_url, item
+        )[0], item)
+
+        themes, errors = self._without_themes(
+            lambda entry, wms_version: entry._mobile_themes(None, u'main', wms_version)
+        )
+        self.assertEquals([t['name'] for t in themes], [u'__test_theme'])
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+from unittest import TestCase
+
+from dogpile.cache.api import NO_VALUE
+
+
+class TestCaching(TestCase):
+    def setUp(self):  # noqa
+        from c2cgeoportal.lib import caching
+        self._regions = dict(caching._regions)
+
+    def tearDown(self):  # noqa
+        from c2cgeoportal.lib import caching
+        caching._regions.clear()
+        caching._regions.update(self._regions)
+
+    def test_refresh_in_background(self):
+        import time
+        import threading
+        from c2cgeoportal.lib.caching import init_region
+
+        region = init_region({
+            'backend': 'dogpile.cache.memory',
+            'expiration_time': 1000,
+            'refresh_in_background': True,
+        }, 'test_refresh')
+
+        values = []
+        created = threading.Event()
+
+        def creator():
+            values.append(len(values))
+            created.set()
+            return values[-1]
+
+        self.assertEqual(region.get_or_create('key', creator), 0)
+        region.invalidate(hard=False)
+        created.clear()
+        # the stale value is served while it's refreshed
+        self.assertEqual(region.get_or_create('key', creator), 0)
+        created.wait(10)
+        time.sleep(0.1)
+        self.assertEqual(region.get_or_create('key', creator), 1)
+
+    def test_max_stale(self):
+        import time
+        from c2cgeoportal.lib.caching import init_region
+
+        region = init_region({
+            'backend': 'dogpile.cache.memory',
+            'expiration_time': 1000,
+            'max_stale': 1000,
+        }, 'test_max_stale')
+        region.set('key', 'value')
+        self.assertEqual(region.get('key', ignore_expiration=True), 'value')
+
+        value = region.backend.proxied.get('key')
+        value.metadata['ct'] = time.time() - 1500
+        self.assertEqual(region.get('key', ignore_expiration=True), 'value')
+        value.metadata['ct'] = time.time() - 2500
+        self.assertEqual(region.get_or_create('key', lambda: 'new'), 'new')
+
+    def test_file_lock(self):
+        import shutil
+        import tempfile
+        from c2cgeoportal.lib.caching import FileLockBackend
+
+        lock_dir = tempfile.mkdtemp()
+        try:
+            backend = FileLockBackend(lock_dir)
+            mutex1 = backend.get_mutex(u'key')
+            mutex2 = backend.get_mutex(u'key')
+            self.assertTrue(mutex1.acquire(False))
+            self.assertFalse(mutex2.acquire(False))
+            mutex1.release()
+            self.assertTrue(mutex2.acquire(False))
+            mutex2.release()
+        finally:
+            shutil.rmtree(lock_dir)
+
+    def test_tags(self):
+        from c2cgeoportal.lib.caching import init_region, \
+            keygen_with_tags, invalidate_tags
+
+        region = init_region({'backend': 'dogpile.cache.memory'})
+        calls = []
+
+        @region.cache_on_arguments(function_key_generator=keygen_with_tags('t1'))
+        def tagged1(arg):
+            calls.append(('t1', arg))
+            return len(calls)
+
+        @region.cache_on_arguments(function_key_generator=keygen_with_tags('t1', 't2'))
+        def tagged2(arg):
+            calls.append(('t2', arg))
+            return len(calls)
+
+        self.assertEqual(tagged1('a'), 1)
+        self.assertEqual(tagged2('a'), 2)
+        self.assertEqual(tagged1('a'), 1)
+        self.assertEqual(tagged2('a'), 2)
+
+        invalidate_tags('t2')
+        self.assertEqual(tagged1('a'), 1)
+        self.assertEqual(tagged2('a'), 3)
+
+        invalidate_tags('t1')
+        self.assertEqual(tagged1('a'), 4)
+        self.assertEqual(tagged2('a'), 5)
+
+    def test_tags_soft_invalidation(self):
+        from c2cgeoportal.lib.caching import init_region, \
+            get_tags_version, invalidate_region, capabilities_tag
+
+        init_region({'backend': 'dogpile.cache.memory', 'expiration_time': 100})
+        tag = capabilities_tag('http://example.com/mapserv?map=/a b.map')
+        version = get_tags_version('t1', tag)
+        self.assertEqual(get_tags_version('t1', tag), version)
+
+        invalidate_region(hard=False)
+        new_version = get_tags_version('t1', tag)
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(get_tags_version('t1', tag), new_version)
+
+    def test_tags_round_trip(self):
+        from c2cgeoportal.lib.caching import init_region, \
+            get_tags_version, invalidate_tags
+
+        region = init_region({'backend': 'dogpile.cache.memory'})
+        backend = region.backend
+        calls = []
+
+        def get(key):
+            calls.append(key)
+            return backend.__class__.get(backend, key)
+
+        def get_multi(keys):
+            calls.append(keys)
+            return backend.__class__.get_multi(backend, keys)
+
+        backend.get = get
+        backend.get_multi = get_multi
+
+        version = get_tags_version('t1', 't2', 't3')
+        self.assertEqual(get_tags_version('t1', 't2', 't3'), version)
+        self.assertEqual(len(calls), 2)
+
+        invalidate_tags('t2')
+        self.assertNotEqual(get_tags_version('t1', 't2', 't3'), version)
+        self.assertEqual(len(calls), 3)
+
+    def test_region_conf(self):
+        from c2cgeoportal.lib.caching import get_region_conf
+
+        conf = {
+            'backend': 'dogpile.cache.memory',
+            'expiration_time': 10,
+            'upstream': {
+                'max_stale': 100,
+            },
+            'permission': {
+                'backend': 'c2cgeoportal.memory_lru',
+                'arguments': {
+                    'max_entries': 10,
+                },
+            },
+        }
+        self.assertEqual(get_region_conf(conf, 'upstream'), {
+            'backend': 'dogpile.cache.memory',
+            'expiration_time': 10,
+            'refresh_in_background': True,
+            'max_stale': 100,
+        })
+        self.assertEqual(get_region_conf(conf, 'permission'), {
+            'backend': 'c2cgeoportal.memory_lru',
+            'expiration_time': 10,
+            'arguments': {
+                'max_entries': 10,
+            },
+        })
+        self.assertEqual(get_region_conf(conf, 'tree'), {
+            'backend': 'dogpile.cache.memory',
+            'expiration_time': 10,
+        })
+
+    def test_cache_on_arguments(self):
+        from c2cgeoportal.lib.caching import init_region, cache_on_arguments
+
+        calls = []
+
+        @cache_on_arguments('test_named')
+        def cached(arg):
+            calls.append(arg)
+            return len(calls)
+
+        # not initialized, use the default region
+        default_region = init_region({'backend': 'dogpile.cache.memory'})
+        self.assertEqual(cached('a'), 1)
+        self.assertEqual(cached('a'), 1)
+        self.assertEqual(default_region.get(
+            'c2cgeoportal.tests.test_caching:cached|a'
+        ), 1)
+
+        region = init_region({'backend': 'dogpile.cache.memory'}, 'test_named')
+        self.assertEqual(cached('a'), 2)
+        self.assertEqual(cached('a'), 2)
+        self.assertEqual(region.get('c2cgeoportal.tests.test_caching:cached|a'), 2)
+
+    def test_should_cache_fn(self):
+        import time
+        from c2cgeoportal.lib.caching import init_region, cache_on_arguments
+
+        region = init_region({
+            'backend': 'dogpile.cache.memory',
+            'expiration_time': 1000,
+            'refresh_in_background': True,
+        }, 'test_should_cache')
+        results = [(None, ['error']), ('a', []), (None, ['error']), ('b', [])]
+
+        @cache_on_arguments(
+            'test_should_cache', should_cache_fn=lambda value: value[0] is not None
+        )
+        def fetch():
+            return results.pop(0)
+
+        def wait(length):
+            for i in range(100):
+                if len(results) == length:
+                    break
+                time.sleep(0.01)
+            time.sleep(0.05)
+
+        # the errors aren't cached
+        self.assertEqual(fetch(), (None, ['error']))
+        self.assertEqual(fetch(), ('a', []))
+        self.assertEqual(fetch(), ('a', []))
+
+        # nor stored by the refresh in background
+        region.invalidate(hard=False)
+        self.assertEqual(fetch(), ('a', []))
+        wait(1)
+        self.assertEqual(fetch(), ('a', []))
+        wait(0)
+        self.assertEqual(fetch(), ('b', []))
+
+    def test_expiration_times(self):
+        from c2cgeoportal.lib.caching import init_region, get_region_conf, \
+            get_named_region, get_expiration_time
+
+        default_region = init_region({'backend': 'dogpile.cache.memory'})
+        self.assertIs(get_named_region('test_ogc'), default_region)
+        self.assertIsNone(get_expiration_time('test_ogc', 'getlegendgraphic'))
+
+        conf = get_region_conf({'backend': 'dogpile.cache.memory'}, 'ogc')
+        self.assertEqual(conf['backend'], 'c2cgeoportal.memory_lru')
+        region = init_region(conf, 'test_ogc')
+        self.assertIs(get_named_region('test_ogc'), region)
+        self.assertEqual(get_expiration_time('test_ogc', 'getlegendgraphic'), 86400)
+        self.assertIsNone(get_expiration_time('test_ogc', 'getcapabilities'))
+
+    def test_memory_lru(self):
+        from c2cgeoportal.lib.caching import init_region
+
+        region = init_region({
+            'backend': 'c2cgeoportal.memory_lru',
+            'arguments': {
+                'max_entries': 2,
+            },
+        }, 'test_lru')
+        region.set('a', 1)
+        region.set('b', 2)
+        self.assertEqual(region.get('a'), 1)
+        region.set('c', 3)
+        # b is the least recently used
+        self.assertEqual(region.get('a'), 1)
+        self.assertEqual(region.get('b'), NO_VALUE)
+        self.assertEqual(region.get('c'), 3)
+
+    def test_memory_lru_size(self):
+        from c2cgeoportal.lib.caching import MemoryLRUBackend
+
+        backend = MemoryLRUBackend({'max_size': 250})
+        backend.set('a', 'a' * 100)
+        backend.set('b', 'b' * 100)
+        self.assertEqual(backend.get('a'), 'a' * 100)
+        backend.set('c', 'c' * 100)
+        self.assertEqual(backend.get('b'), NO_VALUE)
+        self.assertEqual(backend.get('a'), 'a' * 100)
+        # too big to be stored
+        backend.set('d', 'd' * 300)
+        self.assertEqual(backend.get('d'), NO_VALUE)
+        self.assertTrue(backend.size <= 250)
+
+    def test_local_cache(self):
+        from dogpile.cache.region import make_region
+        from c2cgeoportal.lib.caching import LocalCacheBackend, new_request
+
+        # two processes that share a backend
+        shared = {}
+        backends = []
+        regions = []
+        for _ in range(2):
+            backends.append(LocalCacheBackend('test', {'max_entries': 10}))
+            regions.append(make_region().configure(
+                'dogpile.cache.memory', arguments={'cache_dict': shared},
+                wrap=[backends[-1]],
+            ))
+
+        new_request()
+        regions[0].set('key', 1)
+        self.assertEqual(regions[1].get('key'), 1)
+        # the local cache is used
+        shared.clear()
+        self.assertEqual(regions[1].get('key'), 1)
+
+        backends[0].new_generation()
+        # dropped at the next request
+        self.assertEqual(regions[1].get('key'), 1)
+        new_request()
+        self.assertEqual(regions[1].get('key'), NO_VALUE)
+
+    def test_serializer(self):
+        from c2cgeoportal.lib.caching import init_region, get_stats
+
+        region = init_region({
+            'backend': 'dogpile.cache.memory',
+            'serializer': {
+                'compress_threshold': 100,
+                'chunk_size': 1000,
+            },
+        }, 'test_serializer')
+        backend = region.backend.proxied
+
+        region.set('small', 'a')
+        self.assertEqual(region.get('small'), 'a')
+        self.assertEqual(backend.get('small')[:1], 'p')
+
+        region.set('compressed', 'a' * 10000)
+        self.assertEqual(region.get('compressed'), 'a' * 10000)
+        self.assertEqual(backend.get('compressed')[:1], 'z')
+
+        import os
+        big = os.urandom(5000)
+        region.set('chunked', big)
+        self.assertEqual(region.get('chunked'), big)
+        self.assertEqual(backend.get('chunked')[:1], 'c')
+        # manifest and 6 chunks
+        self.assertEqual(len(backend._cache), 3 + 6)
+
+        # the old chunks are removed
+        region.set('chunked', 'b')
+        self.assertEqual(len(backend._cache), 3)
+        self.assertEqual(region.get('chunked'), 'b')
+
+        self.assertEqual(region.get('missing'), NO_VALUE)
+        stats = get_stats()['test_serializer']
+        self.assertEqual(stats['sets'], 4)
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['compressed'], 1)
+        self.assertEqual(stats['chunked'], 1)
+
+    def test_canonicalize(self):
+        from sqlalchemy import Column, Integer
+        from sqlalchemy.ext.declarative import declarative_base
+        from sqlalchemy.orm import make_transient_to_detached
+        from c2cgeoportal.lib.caching import canonicalize
+
+        self.assertEqual(
+            canonicalize({'b': [1, None], 'a': set(['y', 'x'])}),
+            '{a=(x,y),b=[1,~]}'
+        )
+        # the separators are escaped
+        self.assertNotEqual(canonicalize(['a,b']), canonicalize(['a', 'b']))
+        self.assertEqual(canonicalize(u'\xe9 |'), '%C3%A9%20%7C')
+        self.assertEqual(canonicalize(
+            {'Host': 'example.com', 'cookie': 'secret'}, ['host']
+        ), '{Host=example.com}')
+
+        base = declarative_base()
+
+        class Item(base):
+            __tablename__ = 'item'
+            id = Column(Integer, primary_key=True)
+
+        item = Item(id=42)
+        make_transient_to_detached(item)
+        self.assertEqual(canonicalize(item), 'Item#42')
+
+    def test_keygen(self):
+        from c2cgeoportal.lib.caching import keygen_function, MAX_KEY_LENGTH, \
+            PROXY_HEADERS
+
+        def fn(a, b=None, *args, **kwargs):
+            pass  # pragma: no cover
+
+        keygen = keygen_function(None, fn)
+        self.assertEqual(
+            keygen(1, 2), 'c2cgeoportal.tests.test_caching:fn|1|2'
+        )
+        self.assertEqual(keygen(1, 2), keygen(1, b=2))
+        self.assertEqual(keygen(1), keygen(a=1, b=None))
+        self.assertEqual(
+            keygen(1, 2, 3, d=4), 'c2cgeoportal.tests.test_caching:fn|1|2|3|d=4'
+        )
+
+        key = keygen('x' * 1000)
+        self.assertEqual(len(key), MAX_KEY_LENGTH)
+        self.assertTrue(key.startswith('c2cgeoportal.tests.test_caching:fn|xxx'))
+        self.assertNotEqual(key, keygen('x' * 999))
+
+        class Proxy:
+            def proxy(self, url, headers):
+                pass  # pragma: no cover
+
+        keygen = keygen_function(None, Proxy.proxy.im_func, allow_lists={
+            'headers': PROXY_HEADERS
+        })
+        self.assertEqual(
+            keygen(Proxy(), 'http://example.com/', {'Host': 'h', 'Cookie': 'c'}),
+            keygen(Proxy(), 'http://example.com/', {'Host': 'h'}),
+        )
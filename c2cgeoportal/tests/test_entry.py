@@ -36,6 +36,7 @@ def setUpModule():  # noqa
     c2cgeoportal.schema = 'main'
     c2cgeoportal.srid = 21781
     c2cgeoportal.caching.init_region({'backend': 'dogpile.cache.memory'})
+    c2cgeoportal.caching.init_region({'backend': 'dogpile.cache.memory'}, 'upstream')
 
 
 class TestEntryView(TestCase):
@@ -80,46 +81,42 @@ class TestEntryView(TestCase):
         self.assertEquals(request.response.content_type, 'text/javascript')
 
     def test__get_child_layers_info_with_scalehint(self):
-        import math
         from pyramid.testing import DummyRequest
         from c2cgeoportal.views.entry import Entry
+        from c2cgeoportal.lib.wmscapabilities import WMSLayer
 
         request = DummyRequest()
         request.user = None
         entry = Entry(request)
 
-        class Layer(object):
-            pass
-
-        child_layer_1 = Layer()
-        child_layer_1.name = 'layer_1'
-        child_layer_1.scaleHint = {
-            'min': 1 * math.sqrt(2),
-            'max': 2 * math.sqrt(2)
-        }
-        child_layer_1.layers = []
-
-        child_layer_2 = Layer()
-        child_layer_2.name = 'layer_2'
-        child_layer_2.scaleHint = {
-            'min': 3 * math.sqrt(2),
-            'max': 4 * math.sqrt(2)
-        }
-        child_layer_2.layers = []
-
-        layer = Layer()
-        layer.layers = [child_layer_1, child_layer_2]
+        child_layer_1 = WMSLayer(
+            name='layer_1', parent=None, children=(), queryable=0,
+            resolution_hint=(1, 2), metadata_urls=(),
+            timepositions=None, defaulttimeposition=None,
+        )
+        child_layer_2 = WMSLayer(
+            name='layer_2', parent=None, children=(), queryable=1,
+            resolution_hint=(3, 4), metadata_urls=(),
+            timepositions=None, defaulttimeposition=None,
+        )
+        layer = WMSLayer(
+            name='layer', parent=None, children=(child_layer_1, child_layer_2),
+            queryable=0, resolution_hint=(1, 4), metadata_urls=(),
+            timepositions=None, defaulttimeposition=None,
+        )
 
         child_layers_info = entry._get_child_layers_info(layer)
 
         expected = [{
             'name': 'layer_1',
             'minResolutionHint': 1.0,
-            'maxResolutionHint': 2.0
+            'maxResolutionHint': 2.0,
+            'queryable': 0,
         }, {
             'name': 'layer_2',
             'minResolutionHint': 3.0,
-            'maxResolutionHint': 4.0
+            'maxResolutionHint': 4.0,
+            'queryable': 1,
         }]
         self.assertEqual(child_layers_info, expected)
 
@@ -159,32 +156,54 @@ class TestEntryView(TestCase):
     def test__get_child_layers_info_without_scalehint(self):
         from pyramid.testing import DummyRequest
         from c2cgeoportal.views.entry import Entry
+        from c2cgeoportal.lib.wmscapabilities import WMSLayer
 
         request = DummyRequest()
         request.user = None
         entry = Entry(request)
 
-        class Layer(object):
-            pass
-
-        child_layer_1 = Layer()
-        child_layer_1.name = 'layer_1'
-        child_layer_1.scaleHint = None
-        child_layer_1.layers = []
-
-        child_layer_2 = Layer()
-        child_layer_2.name = 'layer_2'
-        child_layer_2.scaleHint = None
-        child_layer_2.layers = []
-
-        layer = Layer()
-        layer.layers = [child_layer_1, child_layer_2]
+        child_layer_1 = WMSLayer(
+            name='layer_1', parent=None, children=(), queryable=0,
+            resolution_hint=(float('inf'), 0), metadata_urls=(),
+            timepositions=None, defaulttimeposition=None,
+        )
+        child_layer_2 = WMSLayer(
+            name='layer_2', parent=None, children=(), queryable=1,
+            resolution_hint=(float('inf'), 0), metadata_urls=(),
+            timepositions=None, defaulttimeposition=None,
+        )
+        layer = WMSLayer(
+            name='layer', parent=None, children=(child_layer_1, child_layer_2),
+            queryable=0, resolution_hint=(float('inf'), 0), metadata_urls=(),
+            timepositions=None, defaulttimeposition=None,
+        )
 
         child_layers_info = entry._get_child_layers_info(layer)
 
         expected = [{
-            'name': 'layer_1'
+            'name': 'layer_1',
+            'queryable': 0,
         }, {
             'name': 'layer_2',
+            'queryable': 1,
         }]
         self.assertEqual(child_layers_info, expected)
+
+    def test_wms_layers_once(self):
+        from pyramid.testing import DummyRequest
+        from c2cgeoportal.views.entry import Entry
+
+        request = DummyRequest()
+        request.user = None
+        request.registry.settings['mapserv_url'] = 'http://example.com/mapserv'
+        entry = Entry(request)
+        calls = []
+
+        def wms_getcap(url):
+            calls.append(url)
+            return {'layer': None}, []
+        entry._wms_getcap = wms_getcap
+
+        self.assertEqual(entry._wms_layers(), ({'layer': None}, ['layer']))
+        self.assertEqual(entry._wms_layers(), ({'layer': None}, ['layer']))
+        self.assertEqual(calls, ['http://example.com/mapserv'])
@@ -60,3 +60,38 @@ class TestGetURL(TestCase):
         errors = []
         self.assertEquals(get_url("config://srv2/icon.png", request, errors=errors), None)
         self.assertEquals(errors, ["The server 'srv2' isn't found in the config"])
+        self.assertEquals(get_url("config://srv2/icon2.png", request, errors=errors), None)
+        self.assertEquals(errors, ["The server 'srv2' isn't found in the config"])
+
+    def test_get_url_memoized(self):
+        from c2cgeoportal.lib import get_url
+
+        request = create_dummy_request({
+            "package": "my_project",
+        })
+        calls = []
+
+        def static_url(path, **kwargs):
+            calls.append(path)
+            return 'http://server.org/' + path
+        request.static_url = static_url
+
+        self.assertEquals(get_url("static:///icon.png", request), "http://server.org/my_project:static/icon.png")
+        self.assertEquals(get_url("static:///icon.png", request), "http://server.org/my_project:static/icon.png")
+        self.assertEquals(calls, ["my_project:static/icon.png"])
+
+        request = create_dummy_request({
+            "package": "other_project",
+        })
+        request.static_url = static_url
+        self.assertEquals(get_url("static:///icon.png", request), "http://server.org/other_project:static/icon.png")
+        self.assertEquals(calls, ["my_project:static/icon.png", "other_project:static/icon.png"])
+
+        # the cache buster token changes after an invalidation
+        from c2cgeoportal.lib import caching
+        caching.invalidate_region()
+        self.assertEquals(get_url("static:///icon.png", request), "http://server.org/other_project:static/icon.png")
+        self.assertEquals(calls, [
+            "my_project:static/icon.png", "other_project:static/icon.png",
+            "other_project:static/icon.png",
+        ])
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+import time
+import threading
+from unittest import TestCase
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    delay = 0
+    # close the connection after the response without telling the client,
+    # like a server with a keep-alive timeout
+    drop = False
+
+    def do_GET(self):  # noqa
+        _Handler.connections.add(self.client_address)
+        time.sleep(_Handler.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('OK')
+        self.close_connection = _Handler.drop
+
+    def do_POST(self):  # noqa
+        _Handler.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = _Handler.drop
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestUpstream(TestCase):
+
+    def setUp(self):  # noqa
+        from c2cgeoportal.lib import upstream
+
+        upstream.init({'pool_size': 1})
+        _Handler.connections = set()
+        _Handler.delay = 0
+        _Handler.drop = False
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%i/test' % self.server.server_port
+
+    def tearDown(self):  # noqa
+        from c2cgeoportal.lib import upstream
+
+        upstream.init({})
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        from c2cgeoportal.lib import upstream
+
+        for i in range(3):
+            resp, content = upstream.request(self.url)
+            self.assertEquals(resp.status, 200)
+            self.assertEquals(content, 'OK')
+
+        self.assertEquals(len(_Handler.connections), 1)
+        stats = upstream.get_stats()['http://127.0.0.1:%i' % self.server.server_port]
+        self.assertEquals(stats['requests'], 3)
+        self.assertEquals(stats['created'], 1)
+        self.assertEquals(stats['idle'], 1)
+        self.assertEquals(stats['in_use'], 0)
+
+    def test_retry(self):
+        import socket
+        from c2cgeoportal.lib import upstream
+
+        # a port without server
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        upstream.init({'retries': 2})
+        self.assertRaises(socket.error, upstream.request, 'http://127.0.0.1:%i/test' % port)
+        stats = upstream.get_stats()['http://127.0.0.1:%i' % port]
+        self.assertEquals(stats['requests'], 3)
+        self.assertEquals(stats['retried'], 2)
+        self.assertEquals(stats['errors'], 3)
+        self.assertEquals(stats['idle'], 0)
+
+    def test_stream(self):
+        from StringIO import StringIO
+        from c2cgeoportal.lib import upstream
+
+        data = 'x' * 2500
+        for i in range(2):
+            resp = upstream.stream(
+                self.url, method='POST', body=StringIO(data),
+                headers={'Content-Length': str(len(data))}, chunk_size=1000,
+            )
+            self.assertEquals(resp.status, 200)
+            self.assertEquals(resp['content-type'], 'text/plain')
+            self.assertEquals([len(c) for c in resp], [1000, 1000, 500])
+
+        # a body read from a file can't be sent again, then each request
+        # uses a new connection
+        self.assertEquals(len(_Handler.connections), 2)
+        stats = upstream.get_stats()['http://127.0.0.1:%i' % self.server.server_port]
+        self.assertEquals(stats['requests'], 2)
+        self.assertEquals(stats['idle_connections'], 1)
+
+        for i in range(2):
+            resp = upstream.stream(self.url)
+            self.assertEquals(resp.read(), 'OK')
+        self.assertEquals(len(_Handler.connections), 2)
+        self.assertEquals(stats['in_use'], 0)
+
+        # not completely read
+        resp = upstream.stream(self.url, chunk_size=1)
+        self.assertEquals(next(resp), 'O')
+        resp.close()
+        stats = upstream.get_stats()['http://127.0.0.1:%i' % self.server.server_port]
+        self.assertEquals(stats['idle_connections'], 0)
+        self.assertEquals(stats['in_use'], 0)
+
+    def test_stream_dropped_connection(self):
+        from StringIO import StringIO
+        from c2cgeoportal.lib import upstream
+
+        upstream.init({'pool_size': 1, 'retries': 0})
+        _Handler.drop = True
+        for i in range(2):
+            resp = upstream.stream(
+                self.url, method='POST', body=StringIO('data'),
+                headers={'Content-Length': '4'},
+            )
+            self.assertEquals(resp.read(), 'data')
+
+        # the idle connection is closed by the server
+        for i in range(2):
+            resp = upstream.stream(self.url)
+            self.assertEquals(resp.read(), 'OK')
+
+        stats = upstream.get_stats()['http://127.0.0.1:%i' % self.server.server_port]
+        self.assertEquals(stats['retried'], 2)
+        self.assertEquals(stats['state'], upstream.CLOSED)
+        self.assertEquals(stats['in_use'], 0)
+
+    def test_circuit_breaker(self):
+        import socket
+        from c2cgeoportal.lib import upstream
+
+        # a port without server
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        url = 'http://127.0.0.1:%i/test' % port
+
+        upstream.init({'retries': 0, 'failure_threshold': 2, 'reset_timeout': 1000})
+        self.assertRaises(socket.error, upstream.request, url)
+        self.assertRaises(socket.error, upstream.request, url)
+        self.assertRaises(upstream.Unavailable, upstream.request, url)
+        stats = upstream.get_stats()['http://127.0.0.1:%i' % port]
+        self.assertEquals(stats['state'], upstream.OPEN)
+        self.assertEquals(stats['requests'], 2)
+        self.assertEquals(stats['rejected'], 1)
+
+        # the probe fails
+        upstream.get_pool(url).reset_timeout = 0
+        self.assertRaises(socket.error, upstream.request, url)
+        self.assertEquals(upstream.get_pool(url).state, upstream.OPEN)
+
+        # the probe succeeds
+        pool = upstream.get_pool(self.url)
+        pool.state = upstream.OPEN
+        pool.opened_at = time.time() - 1000
+        self.assertEquals(upstream.request(self.url)[1], 'OK')
+        self.assertEquals(pool.state, upstream.CLOSED)
+
+    def test_interrupted(self):
+        from c2cgeoportal.lib import upstream
+
+        def interrupt(*args):
+            raise KeyboardInterrupt()
+
+        # an interrupted request isn't a failure of the server
+        pool = upstream.get_pool(self.url)
+        pool._send = interrupt
+        self.assertRaises(KeyboardInterrupt, upstream.request, self.url)
+        self.assertEquals(pool.failures, 0)
+        self.assertEquals(pool.state, upstream.CLOSED)
+        self.assertEquals(pool.in_flight, 0)
+
+        class InterruptedHttp(object):
+            connections = {}
+
+            def request(self, *args, **kwargs):
+                raise KeyboardInterrupt()
+
+        # the interrupted client is released
+        pool = upstream.get_pool(self.url, name='interrupted')
+        pool._idle.append(InterruptedHttp())
+        self.assertRaises(
+            KeyboardInterrupt, upstream.request, self.url, name='interrupted'
+        )
+        stats = pool.get_stats()
+        self.assertEquals(stats['in_use'], 0)
+        self.assertEquals(stats['idle'], 0)
+
+    def test_default_upstreams(self):
+        from c2cgeoportal.lib import upstream
+
+        upstream.init({'upstreams': {'mapserver': {'max_in_flight': 4}}})
+        pool = upstream.get_pool(self.url, name='mapserver')
+        self.assertEquals(pool.max_in_flight, 4)
+        self.assertEquals(pool.read_timeout, 60)
+        self.assertEquals(upstream.get_pool(self.url, name='print').read_timeout, 300)
+        self.assertEquals(upstream.get_pool(self.url).read_timeout, None)
+
+    def test_max_in_flight(self):
+        from c2cgeoportal.lib import upstream
+
+        upstream.init({'max_in_flight': 2, 'upstreams': {'mapserver': {'max_in_flight': 1}}})
+        _Handler.delay = 0.2
+        results = []
+
+        def run():
+            try:
+                results.append(upstream.request(self.url, name='mapserver')[1])
+            except upstream.Unavailable:
+                results.append('Unavailable')
+
+        threads = [threading.Thread(target=run) for i in range(2)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(results, ['Unavailable', 'OK'])
+        stats = upstream.get_stats()['mapserver:http://127.0.0.1:%i' % self.server.server_port]
+        self.assertEquals(stats['rejected'], 1)
+        self.assertEquals(stats['in_flight'], 0)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Camptocamp SA
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+
+
+from unittest import TestCase
+
+CAPABILITIES = """<?xml version='1.0' encoding="UTF-8" standalone="no" ?>
+<!DOCTYPE WMT_MS_Capabilities SYSTEM
+  "http://schemas.opengis.net/wms/1.1.1/WMS_MS_Capabilities.dtd"
+ [
+ <!ELEMENT VendorSpecificCapabilities EMPTY>
+ ]>
+<WMT_MS_Capabilities version="1.1.1" xmlns:xlink="http://www.w3.org/1999/xlink">
+<Service><Name>OGC:WMS</Name><Title>test</Title></Service>
+<Capability>
+<Layer>
+  <Name>root</Name>
+  <Layer queryable="0">
+    <Name>group</Name>
+    <MetadataURL type="TC211">
+      <Format>text/plain</Format>
+      <OnlineResource xlink:type="simple" xlink:href="http://example.com/group.metadata"/>
+    </MetadataURL>
+    <Layer queryable="1">
+      <Name>child</Name>
+      <Style><Name>default</Name></Style>
+      <ScaleHint min="2.8284271247461903" max="5.656854249492381" />
+      <MetadataURL type="TC211">
+        <Format>text/plain</Format>
+        <OnlineResource xlink:type="simple" xlink:href="http://example.com/child.metadata"/>
+      </MetadataURL>
+    </Layer>
+    <Layer>
+      <Title>unnamed</Title>
+      <Layer queryable="1">
+        <Name>time</Name>
+        <Extent name="elevation">1,2</Extent>
+        <Extent name="time" default="2015">2015,2016,2017</Extent>
+      </Layer>
+    </Layer>
+  </Layer>
+</Layer>
+</Capability>
+</WMT_MS_Capabilities>
+"""
+
+
+class TestWMSCapabilities(TestCase):
+    def test_layers(self):
+        from c2cgeoportal.lib.wmscapabilities import parse_capabilities
+
+        wms = parse_capabilities(CAPABILITIES)
+        self.assertEqual(list(wms), ['root', 'group', 'child', 'time'])
+        self.assertTrue('child' in wms)
+        self.assertFalse('default' in wms)
+        self.assertEqual(wms['root'].parent, None)
+        self.assertEqual(wms['child'].parent, 'group')
+        # the parent is the nearest named layer
+        self.assertEqual(wms['time'].parent, 'group')
+        self.assertEqual(
+            [child.name for child in wms['group'].children],
+            ['child', None]
+        )
+        self.assertEqual(wms['group'].queryable, 0)
+        self.assertEqual(wms['child'].queryable, 1)
+
+    def test_resolution_hint(self):
+        from c2cgeoportal.lib.wmscapabilities import parse_capabilities
+
+        wms = parse_capabilities(CAPABILITIES)
+        self.assertEqual(
+            ['%0.2f' % r for r in wms['child'].resolution_hint],
+            ['2.00', '4.00']
+        )
+        self.assertEqual(
+            ['%0.2f' % r for r in wms['root'].resolution_hint],
+            ['2.00', '4.00']
+        )
+        self.assertEqual(wms['time'].resolution_hint, (float('inf'), 0))
+
+    def test_metadata_urls(self):
+        from c2cgeoportal.lib.wmscapabilities import parse_capabilities
+
+        wms = parse_capabilities(CAPABILITIES)
+        self.assertEqual(list(wms['group'].metadata_urls), [{
+            'type': 'TC211',
+            'format': 'text/plain',
+            'url': 'http://example.com/group.metadata',
+        }, {
+            'type': 'TC211',
+            'format': 'text/plain',
+            'url': 'http://example.com/child.metadata',
+        }])
+        self.assertEqual(list(wms['time'].metadata_urls), [])
+
+    def test_time(self):
+        from c2cgeoportal.lib.wmscapabilities import parse_capabilities
+
+        wms = parse_capabilities(CAPABILITIES)
+        self.assertEqual(wms['time'].timepositions, ['2015', '2016', '2017'])
+        self.assertEqual(wms['time'].defaulttimeposition, '2015')
+        self.assertEqual(wms['child'].timepositions, None)
+
+    def test_pickle(self):
+        import pickle
+        from c2cgeoportal.lib.wmscapabilities import parse_capabilities
+
+        wms = parse_capabilities(CAPABILITIES)
+        wms2 = pickle.loads(pickle.dumps(wms, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(list(wms2), list(wms))
+        self.assertEqual(wms2['group'], wms['group'])
+
+    def test_error(self):
+        from c2cgeoportal.lib.wmscapabilities import parse_capabilities
+
+        self.assertRaises(ValueError, parse_capabilities, "<ServiceExceptionReport/>")
+        self.assertRaises(ValueError, parse_capabilities, "not an XML")
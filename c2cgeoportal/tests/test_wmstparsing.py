@@ -71,6 +71,43 @@ class TestExtent(TestCase):
             "maxDefValue": "2005-01-01T00:00:00Z",
         })
 
+    def test_regular_values(self):
+        from c2cgeoportal.lib.wmstparsing import parse_extent
+        e1 = parse_extent(["2000", "2004"], "2000")
+        e2 = parse_extent(["2002", "2006", "2004"], "2002")
+        e1.merge(e2)
+        d = e1.to_dict()
+        self.assertEqual(d, {
+            "minValue": "2000-01-01T00:00:00Z",
+            "maxValue": "2006-01-01T00:00:00Z",
+            "resolution": "year",
+            "values": [
+                "2000-01-01T00:00:00Z", "2002-01-01T00:00:00Z",
+                "2004-01-01T00:00:00Z", "2006-01-01T00:00:00Z",
+            ],
+            "interval": (2, 0, 0, 0),
+            "minDefValue": "2000-01-01T00:00:00Z",
+            "maxDefValue": None,
+        })
+
+        extent = parse_extent([
+            "2010-02-03T12:00:00Z", "2010-02-04T18:00:00Z", "2010-02-06T00:00:00Z"
+        ], "2010-02-03")
+        self.assertEqual(extent.to_dict()["interval"], (0, 0, 1, 21600))
+
+        extent = parse_extent(["2010-01", "2010-02", "2010-03"], "2010-01")
+        self.assertEqual(extent.to_dict()["interval"], (0, 1, 0, 0))
+
+        extent = parse_extent(["2010-01-01", "2010-01-02", "2010-01-04"], "2010-01-01")
+        self.assertFalse("interval" in extent.to_dict())
+
+    def test_same_values(self):
+        from c2cgeoportal.lib.wmstparsing import parse_extent
+        extent = parse_extent([
+            "2010-02-03T12:34:00+01:00", "2010-02-03T11:34:00Z"
+        ], "2010-02-03")
+        self.assertEqual(extent.to_dict()["values"], ["2010-02-03T12:34:00+01:00"])
+
     def test_merge_interval(self):
         from c2cgeoportal.lib.wmstparsing import parse_extent, TimeExtentInterval
         e1 = parse_extent(["2000/2005/P1Y"], "2000/2005")
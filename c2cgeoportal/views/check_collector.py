@@ -34,9 +34,10 @@ from pyramid.view import view_config
 from pyramid.response import Response
 
 import httplib
-from httplib2 import Http
 from urlparse import urlparse
 
+from c2cgeoportal.lib import upstream
+
 
 class CheckerCollector(object):  # pragma: no cover
 
@@ -78,13 +79,19 @@ class CheckerCollector(object):  # pragma: no cover
         )
 
     def _testurl(self, url):
-        h = Http()
-
         urlfragments = urlparse(url)
         localurl = "%s://localhost%s" % (urlfragments.scheme, urlfragments.path)
         headers = {'Host': urlfragments.netloc}
 
-        resp, content = h.request(localurl, headers=headers)
+        try:
+            resp, content = upstream.request(
+                localurl, headers=headers, name='checker'
+            )
+        except upstream.Unavailable as e:
+            self.status_int = max(self.status_int, httplib.SERVICE_UNAVAILABLE)
+            return '<span style="color: red;">%i - %s</span>' % (
+                httplib.SERVICE_UNAVAILABLE, e
+            ), None
 
         if resp.status != httplib.OK:
             self.status_int = max(self.status_int, resp.status)
@@ -32,10 +32,11 @@ from pyramid.view import view_config
 from pyramid.response import Response
 
 import httplib
-from httplib2 import Http
 import simplejson
 import logging
 
+from c2cgeoportal.lib import upstream
+
 log = logging.getLogger(__name__)
 
 
@@ -57,9 +58,22 @@ class Checker(object):  # pragma: no cover
             body=msg, status="%i %s" % (self.status_int, self.status), cache_control="no-cache"
         )
 
-    def testurl(self, url):
-        h = Http()
+    def _request(self, url, **kwargs):
+        """ Send a self-check request with the ``checker`` upstream pool,
+        then an open circuit breaker of the checks doesn't reject the other
+        requests to localhost, and the reverse. Return ``None`` if the
+        request isn't sent, the status is then set. """
+        try:
+            return upstream.request(url, name='checker', **kwargs)
+        except upstream.Unavailable as e:
+            log.error(e)
+            self.set_status(
+                httplib.SERVICE_UNAVAILABLE,
+                httplib.responses[httplib.SERVICE_UNAVAILABLE],
+            )
+            return None
 
+    def testurl(self, url):
         log.info("Checker for url: %s" % url)
 
         url = url.replace(self.request.environ.get('SERVER_NAME'), 'localhost')
@@ -68,7 +82,10 @@ class Checker(object):  # pragma: no cover
             "Cache-Control": "no-cache",
         }
 
-        resp, content = h.request(url, headers=headers)
+        result = self._request(url, headers=headers)
+        if result is None:
+            return url + "<br/>Upstream unavailable"
+        resp, content = result
 
         if resp.status != httplib.OK:
             print resp.items()
@@ -142,15 +159,16 @@ class Checker(object):  # pragma: no cover
 
         _url = self.request.route_url('printproxy_create') + \
             '?url=' + self.request.route_url('printproxy')
-        h = Http()
-
         log.info("Checker for printproxy request (create): %s" % _url)
         _url = _url.replace(self.request.environ.get('SERVER_NAME'), "localhost")
         headers = {
             'Content-Type': 'application/json;charset=utf-8',
             'Host': self.request.environ.get('HTTP_HOST')
         }
-        resp, content = h.request(_url, 'POST', headers=headers, body=body)
+        result = self._request(_url, method='POST', headers=headers, body=body)
+        if result is None:
+            return 'Failed creating PDF: upstream unavailable'
+        resp, content = result
 
         if resp.status != httplib.OK:
             self.set_status(resp.status, resp.reason)
@@ -160,7 +178,10 @@ class Checker(object):  # pragma: no cover
         json = simplejson.loads(content)
         _url = json['getURL'].replace(self.request.environ.get('SERVER_NAME'), "localhost")
         headers = {'Host': self.request.environ.get('HTTP_HOST')}
-        resp, content = h.request(_url, headers=headers)
+        result = self._request(_url, headers=headers)
+        if result is None:
+            return 'Failed retrieving PDF: upstream unavailable'
+        resp, content = result
 
         if resp.status != httplib.OK:
             self.set_status(resp.status, resp.reason)
@@ -177,13 +198,14 @@ class Checker(object):  # pragma: no cover
             self.request.route_url('fulltextsearch'),
             self.settings['fulltextsearch']
         )
-        h = Http()
-
         log.info("Checker for fulltextsearch: %s" % _url)
         _url = _url.replace(self.request.environ.get('SERVER_NAME'), "localhost")
         headers = {'host': self.request.environ.get('HTTP_HOST')}
 
-        resp, content = h.request(_url, headers=headers)
+        result = self._request(_url, headers=headers)
+        if result is None:
+            return 'Upstream unavailable'
+        resp, content = result
 
         if resp.status != httplib.OK:
             self.set_status(resp.status, resp.reason)
@@ -197,6 +219,25 @@ class Checker(object):  # pragma: no cover
 
         return 'OK'
 
+    @view_config(route_name='checker_upstreams')
+    def upstreams(self):
+        """ Report the state of the circuit breakers of the upstream servers,
+        fails when one of them is open.
+
+        The circuit breakers are by process, then only the state of the
+        process that serves this request is reported. """
+        states = []
+        for key, stats in sorted(upstream.get_stats().items()):
+            if stats['state'] == upstream.OPEN:
+                self.set_status(
+                    httplib.SERVICE_UNAVAILABLE,
+                    httplib.responses[httplib.SERVICE_UNAVAILABLE],
+                )
+            states.append("%s: %s (%i failures, %i in flight)" % (
+                key, stats['state'], stats['failures'], stats['in_flight']
+            ))
+        return self.make_response("<br/>".join(states) or 'OK')
+
     @view_config(route_name='checker_wmscapabilities')
     def wmscapabilities(self):
         _url = self.request.route_url('mapserverproxy')
@@ -28,41 +28,78 @@
 # either expressed or implied, of the FreeBSD Project.
 
 
-import httplib2
 import urllib
 import logging
 import json
 import sys
+import copy
+import zlib
+import time
+import hashlib
+import threading
 
+from collections import OrderedDict
 from urlparse import urlparse
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
 
 from pyramid.view import view_config
 from pyramid.i18n import get_locale_name, TranslationStringFactory
 from pyramid.httpexceptions import HTTPFound, HTTPNotFound, \
-    HTTPBadRequest, HTTPUnauthorized, HTTPForbidden, HTTPBadGateway
+    HTTPBadRequest, HTTPUnauthorized, HTTPForbidden, HTTPBadGateway, \
+    HTTPNotModified
 from pyramid.security import remember, forget
 from pyramid.response import Response
+from webob.acceptparse import Accept
+from webob.etag import ETagMatcher
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy import engine_from_config
 import sqlahelper
-from owslib.wms import WebMapService
 from xml.dom.minidom import parseString
-from math import sqrt
 
-from c2cgeoportal.lib import get_setting, get_protected_layers_query, get_url
+from c2cgeoportal.lib import get_setting, get_url, upstream
 from c2cgeoportal.lib.cacheversion import get_cache_version
-from c2cgeoportal.lib.caching import get_region, invalidate_region
+from c2cgeoportal.lib.caching import cache_on_arguments, invalidate_regions, get_stats, \
+    get_tags_version, invalidate_tags, capabilities_tag, canonicalize, \
+    TREE, RESTRICTION, ROLE, FUNCTIONALITY
 from c2cgeoportal.lib.functionality import get_functionality, \
     get_mapserver_substitution_params
+from c2cgeoportal.lib.permission import get_permission_index
+from c2cgeoportal.lib.treeloader import load_tree
+from c2cgeoportal.lib.warmup import warmup_in_background
+from c2cgeoportal.lib.wmscapabilities import parse_capabilities
 from c2cgeoportal.lib.wmstparsing import parse_extent, TimeInformation
-from c2cgeoportal.models import DBSession, User, Role, \
-    Theme, LayerGroup, RestrictionArea, Interface, \
+from c2cgeoportal.models import DBSession, User, \
+    Theme, LayerGroup, \
     Layer, LayerV1, LayerInternalWMS, LayerExternalWMS, LayerWMTS
 
 
 _ = TranslationStringFactory('c2cgeoportal')
 log = logging.getLogger(__name__)
-cache_region = get_region()
+
+_fetch_pool = None
+_fetch_pool_lock = threading.Lock()
+
+
+def _is_result(value):
+    """ Return whether an upstream document ``(result, errors)`` has a
+    result, the errors (an unavailable or failed upstream server) aren't
+    cached. """
+    return value[0] is not None
+
+
+def _get_fetch_pool(threads):
+    """ Return the pool of threads used to fetch the upstream documents. """
+    global _fetch_pool
+    with _fetch_pool_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPool(threads)
+        return _fetch_pool
 
 
 class Entry(object):
@@ -78,6 +115,8 @@ class Entry(object):
         self.settings = request.registry.settings
         self.debug = "debug" in request.params
         self.lang = get_locale_name(request)
+        # the WMS capabilities and errors, fetched once by request
+        self._wms = None
 
     @view_config(route_name='testi18n', renderer='testi18n.html')
     def testi18n(self):  # pragma: no cover
@@ -85,6 +124,11 @@ class Entry(object):
         return {'title': _('title i18n')}
 
     def _wms_getcap(self, url):
+        return self._wms_getcap_cached(
+            self._wms_getcap_url(url), get_tags_version(capabilities_tag(url))
+        )
+
+    def _wms_getcap_url(self, url):
         if url.find('?') < 0:
             url += '?'
 
@@ -93,10 +137,12 @@ class Entry(object):
         if sparams:  # pragma: no cover
             url += urllib.urlencode(sparams) + '&'
 
-        return self._wms_getcap_cached(url)
+        return url
 
-    @cache_region.cache_on_arguments()
-    def _wms_getcap_cached(self, url):
+    @cache_on_arguments('upstream', should_cache_fn=_is_result)
+    def _wms_getcap_cached(self, url, capabilities_version):
+        """ ``capabilities_version`` is the version of the capabilities tag
+        of the configured URL. """
         errors = []
         wms = None
 
@@ -110,12 +156,13 @@ class Entry(object):
         log.info("Get WMS GetCapabilities for url: %s" % url)
 
         # forward request to target (without Host Header)
-        http = httplib2.Http()
         h = dict(self.request.headers)
         if urlparse(url).hostname != 'localhost':  # pragma: no cover
             h.pop('Host')
         try:
-            resp, content = http.request(url, method='GET', headers=h)
+            resp, content = upstream.request(
+                url, method='GET', headers=h, name='mapserver'
+            )
         except:  # pragma: no cover
             errors.append("Unable to GetCapabilities from url %s" % url)
             return None, errors
@@ -128,8 +175,8 @@ class Entry(object):
             return None, errors
 
         try:
-            wms = WebMapService(None, xml=content)
-        except AttributeError:
+            wms = parse_capabilities(content)
+        except ValueError:
             error = _(
                 "WARNING! an error occured while trying to "
                 "read the mapfile and recover the themes."
@@ -139,66 +186,23 @@ class Entry(object):
             log.exception(error)
         return wms, errors
 
-    def _create_layer_query(self, role_id, version):
-        """ Create an SQLAlchemy query for Layer and for the role
-            identified to by ``role_id``.
-        """
-
-        if version == 1:
-            q = DBSession.query(LayerV1)
-        else:
-            q = DBSession.query(Layer).with_polymorphic(
-                [LayerInternalWMS, LayerExternalWMS, LayerWMTS]
-            )
-
-        q = q.filter(Layer.public.is_(True))
-        if role_id is not None:
-            q = q.union(get_protected_layers_query(role_id))
-
-        return q
-
-    def _get_layer_metadata_urls(self, layer):
-        metadata_urls = []
-        if len(layer.metadataUrls) > 0:
-            metadata_urls = layer.metadataUrls
-        for childLayer in layer.layers:
-            metadata_urls.extend(self._get_layer_metadata_urls(childLayer))
-        return metadata_urls
-
-    def _get_layer_resolution_hint(self, layer):
-        resolution_hint_min = float('inf')
-        resolution_hint_max = 0
-        if layer.scaleHint:
-            # scaleHint is based upon a pixel diagonal length whereas we use
-            # resolutions based upon a pixel edge length. There is a sqrt(2)
-            # ratio between edge and diagonal of a square.
-            resolution_hint_min = float(layer.scaleHint['min']) / sqrt(2)
-            resolution_hint_max = float(layer.scaleHint['max']) / sqrt(2)
-        for childLayer in layer.layers:
-            resolution = self._get_layer_resolution_hint(childLayer)
-            resolution_hint_min = min(resolution_hint_min, resolution[0])
-            resolution_hint_max = max(resolution_hint_max, resolution[1])
-
-        return (resolution_hint_min, resolution_hint_max)
-
     def _get_child_layers_info(self, layer):
         """ Return information about sub layers of a layer.
 
             Arguments:
 
-            * ``layer`` The layer object in the WMS capabilities.
+            * ``layer`` The ``WMSLayer`` from the WMS capabilities index.
         """
         child_layers_info = []
-        for child_layer in layer.layers:
+        for child_layer in layer.children:
             child_layer_info = dict(name=child_layer.name)
-            resolution = self._get_layer_resolution_hint(child_layer)
+            resolution = child_layer.resolution_hint
             if resolution[0] <= resolution[1]:
                 child_layer_info.update({
                     'minResolutionHint': float('%0.2f' % resolution[0]),
                     'maxResolutionHint': float('%0.2f' % resolution[1])
                 })
-            if hasattr(child_layer, 'queryable'):
-                child_layer_info['queryable'] = child_layer.queryable
+            child_layer_info['queryable'] = child_layer.queryable
             child_layers_info.append(child_layer_info)
         return child_layers_info
 
@@ -211,8 +215,6 @@ class Entry(object):
         }
         for metadata in layer.ui_metadata:
             l['metadata'][metadata.name] = get_url(metadata.value, self.request, errors=errors)
-        if layer.geo_table:
-            self._fill_editable(l, layer)
 
         if isinstance(layer, LayerV1):
             l.update({
@@ -269,7 +271,7 @@ class Entry(object):
                     time.merge_extent(extent)
                     time.merge_mode(layer.time_mode)
 
-                for child_layer in wms_layer_obj.layers:
+                for child_layer in wms_layer_obj.children:
                     if child_layer.timepositions:
                         extent = parse_extent(child_layer.timepositions,
                                               child_layer.defaulttimeposition)
@@ -282,16 +284,19 @@ class Entry(object):
 
         return errors
 
-    def _fill_editable(self, l, layer):
-        if self.request.user:
-            c = DBSession.query(RestrictionArea) \
-                .filter(RestrictionArea.roles.any(
-                    Role.id == self.request.user.role.id)) \
-                .filter(RestrictionArea.layers.any(LayerV1.id == layer.id)) \
-                .filter(RestrictionArea.readwrite.is_(True)) \
-                .count()
-            if c > 0:
-                l['editable'] = True
+    def _get_editable_layers(self):
+        """ Return the ids of the layers editable by the current user. """
+        if self.request.user is None:
+            return frozenset()
+        return self._editable_layers(self.request.user.role.id)
+
+    def _editable_layers(self, role_id):
+        """ Return the ids of the layers editable by the role. """
+        return get_permission_index(role_id).readwrite_layers
+
+    def _fill_editable(self, l, layer_id, editable_layers):
+        if layer_id in editable_layers:
+            l['editable'] = True
 
     def _fill_wms(self, l, layer, version=1):
         l['imageType'] = layer.image_type
@@ -341,18 +346,16 @@ class Entry(object):
         # now look at what's in the WMS capabilities doc
         if layer.name in wms_layers:
             wms_layer_obj = wms[layer.name]
-            metadata_urls = self._get_layer_metadata_urls(wms_layer_obj)
-            if len(metadata_urls) > 0:
-                l['metadataUrls'] = metadata_urls
-            resolutions = self._get_layer_resolution_hint(wms_layer_obj)
+            if len(wms_layer_obj.metadata_urls) > 0:
+                l['metadataUrls'] = list(wms_layer_obj.metadata_urls)
+            resolutions = wms_layer_obj.resolution_hint
             if resolutions[0] <= resolutions[1]:
                 if 'minResolutionHint' not in l:
                     l['minResolutionHint'] = float('%0.2f' % resolutions[0])
                 if 'maxResolutionHint' not in l:
                     l['maxResolutionHint'] = float('%0.2f' % resolutions[1])
             l['childLayers'] = self._get_child_layers_info(wms_layer_obj)
-            if hasattr(wms_layer_obj, 'queryable'):
-                l['queryable'] = wms_layer_obj.queryable
+            l['queryable'] = wms_layer_obj.queryable
         else:
             errors.append(
                 "The layer '%s' is not defined in WMS capabilities" % layer.name
@@ -432,7 +435,7 @@ class Entry(object):
                 query_layer_obj = wms[query_layer]
 
                 ql = {'name': query_layer}
-                resolutions = self._get_layer_resolution_hint(query_layer_obj)
+                resolutions = query_layer_obj.resolution_hint
 
                 if resolutions[0] <= resolutions[1]:
                     ql['minResolutionHint'] = float(
@@ -459,97 +462,177 @@ class Entry(object):
             isinstance(layer, LayerInternalWMS) or \
             isinstance(layer, LayerV1) and layer.layer_type == 'internal WMS'
 
-    def _group(
-            self, path, group, layers, depth=1, min_levels=1,
-            catalogue=False, version=1, **kwargs):
+    def _compile_layer(self, layer, wms, wms_layers, errors=None):
+        """ Return the role independent compiled layer, the errors are only
+        reported for the roles that can see the layer. """
+        time = TimeInformation()
+        l, l_errors = self._layer(layer, wms=wms, wms_layers=wms_layers, time=time)
+        return {
+            'type': 'layer',
+            'id': layer.id,
+            'name': layer.name,
+            'item': l,
+            'time': time if time.has_time() else None,
+            'editable': layer.geo_table is not None and layer.geo_table != '',
+            'errors': l_errors + (errors or []),
+        }
+
+    def _compile_group(
+            self, path, group, depth=1, min_levels=1,
+            catalogue=False, version=1, wms=None, wms_layers=None,
+            registry=None):
+        """ Return the role independent compiled group, the layers are kept
+        whatever their restrictions, ``_filter_item`` gives the group seen
+        by a role.
+
+        The compiled groups, including the sub groups, are added by name
+        in the ``registry`` dictionary when it's given. """
         children = []
-        errors = []
 
         # escape loop
         if depth > 30:
-            errors.append(
-                "Too many recursions with group '%s'" % group.name
-            )
-            return None, errors
+            return {
+                'type': 'error',
+                'errors': ["Too many recursions with group '%s'" % group.name],
+            }
 
         for tree_item in group.children:
             if type(tree_item) == LayerGroup:
                 depth += 1
                 if type(group) == Theme or catalogue or \
                         group.is_internal_wms == tree_item.is_internal_wms:
-                    gp, gp_errors = self._group(
+                    children.append(self._compile_group(
                         "%s/%s" % (path, tree_item.name),
-                        tree_item, layers, depth=depth, min_levels=min_levels,
-                        catalogue=catalogue, version=version, **kwargs
-                    )
-                    errors += gp_errors
-                    if gp is not None:
-                        children.append(gp)
+                        tree_item, depth=depth, min_levels=min_levels,
+                        catalogue=catalogue, version=version,
+                        wms=wms, wms_layers=wms_layers, registry=registry
+                    ))
                 else:
-                    errors.append(
-                        "Group '%s' cannot be in group '%s' (internal/external mix)." %
-                        (tree_item.name, group.name)
-                    )
+                    children.append({
+                        'type': 'error',
+                        'errors': [
+                            "Group '%s' cannot be in group '%s' (internal/external mix)." %
+                            (tree_item.name, group.name)
+                        ],
+                    })
             elif self._layer_included(tree_item, version):
-                if (tree_item.name in layers):
-                    if (catalogue or group.is_internal_wms ==
-                            self._is_internal_wms(tree_item)):
-                        l, l_errors = self._layer(tree_item, **kwargs)
-                        errors += l_errors
-                        if depth < min_levels:
-                            errors.append("The Layer '%s' is under indented (%i/%i)." % (
+                if (catalogue or group.is_internal_wms ==
+                        self._is_internal_wms(tree_item)):
+                    if depth < min_levels:
+                        layer = self._compile_layer(tree_item, wms, wms_layers, [
+                            "The Layer '%s' is under indented (%i/%i)." % (
                                 path + "/" + tree_item.name, depth, min_levels
-                            ))
-                        else:
-                            children.append(l)
+                            )
+                        ])
+                        layer['item'] = None
                     else:
-                        errors.append(
+                        layer = self._compile_layer(tree_item, wms, wms_layers)
+                    children.append(layer)
+                else:
+                    children.append({
+                        'type': 'layer',
+                        'name': tree_item.name,
+                        'item': None,
+                        'time': None,
+                        'errors': [
                             "Layer '%s' cannot be in the group '%s' (internal/external mix)." %
                             (tree_item.name, group.name)
-                        )
+                        ],
+                    })
 
-        if len(children) > 0:
-            g = {
-                'id': group.id,
-                'name': group.name,
-                'children': children,
-                'metadata': {},
-            }
-            if version == 1:
-                g.update({
-                    'isExpanded': group.is_expanded,
-                    'isInternalWMS': group.is_internal_wms,
-                    'isBaseLayer': group.is_base_layer,
-                })
-            for metadata in group.ui_metadata:
-                g['metadata'][metadata.name] = get_url(metadata.value, self.request, errors=errors)
-            if version == 1 and group.metadata_url:
-                g['metadataURL'] = group.metadata_url
+        errors = []
+        g = {
+            'id': group.id,
+            'name': group.name,
+            'metadata': {},
+        }
+        if version == 1:
+            g.update({
+                'isExpanded': group.is_expanded,
+                'isInternalWMS': group.is_internal_wms,
+                'isBaseLayer': group.is_base_layer,
+            })
+        for metadata in group.ui_metadata:
+            g['metadata'][metadata.name] = get_url(metadata.value, self.request, errors=errors)
+        if version == 1 and group.metadata_url:
+            g['metadataURL'] = group.metadata_url
+
+        compiled = {
+            'type': 'group',
+            'item': g,
+            'children': children,
+            'errors': errors,
+        }
+        if registry is not None:
+            registry.setdefault(group.name, compiled)
+        return compiled
+
+    def _filter_item(self, compiled, layers, time, editable_layers):
+        """ Return the item and the errors seen by a role from a compiled
+        item.
+
+        Arguments:
+
+        * ``compiled`` The compiled item, see ``_compile_group``.
+        * ``layers`` The set of the layer names visible by the role.
+        * ``time`` The ``TimeInformation`` where the time of the visible
+          layers is merged.
+        * ``editable_layers`` The set of the ids of the editable layers.
+        """
+        if compiled['type'] == 'error':
+            return None, compiled['errors']
+
+        if compiled['type'] == 'layer':
+            if compiled['name'] not in layers:
+                return None, []
+            errors = list(compiled['errors'])
+            layer_time = compiled['time']
+            if layer_time is not None and time is not None:
+                try:
+                    # the extent is updated by the merge, the merge
+                    # replaces the values then a shallow copy is enough
+                    time.merge_extent(copy.copy(layer_time.extent))
+                    time.merge_mode(layer_time.mode)
+                except:  # pragma no cover
+                    errors.append("Error while handling time for layer '%s' : '%s'"
+                                  % (compiled['name'], sys.exc_info()[1]))
+            if compiled['item'] is None:
+                return None, errors
+            layer = dict(compiled['item'])
+            if compiled['editable']:
+                self._fill_editable(layer, compiled['id'], editable_layers)
+            return layer, errors
+
+        children = []
+        errors = []
+        for child in compiled['children']:
+            c, c_errors = self._filter_item(child, layers, time, editable_layers)
+            errors += c_errors
+            if c is not None:
+                children.append(c)
 
-            return g, errors
+        if len(children) > 0:
+            g = dict(compiled['item'])
+            g['children'] = children
+            return g, errors + compiled['errors']
         else:
             return None, errors
 
-    @cache_region.cache_on_arguments()
     def _layers(self, role_id, version, interface):
-        query = self._create_layer_query(role_id, version)
-        if interface is not None:
-            query = query.join(Layer.interfaces)
-            query = query.filter(Interface.name == interface)
-        return [l.name for l in query.all()]
+        return get_permission_index(role_id).visible_layers(version, interface)
 
-    @cache_region.cache_on_arguments()
     def _wms_layers(self):
         # retrieve layers metadata via GetCapabilities
-        wms, wms_errors = self._wms_getcap(
-            self.request.registry.settings['mapserv_url']
-        )
+        if self._wms is None:
+            self._wms = self._wms_getcap(
+                self.request.registry.settings['mapserv_url']
+            )
+        wms, wms_errors = self._wms
         if len(wms_errors) > 0:
             return [], wms_errors
 
-        return wms, list(wms.contents)
+        return wms, list(wms)
 
-    @cache_region.cache_on_arguments()
     def _themes(
         self, role_id, interface="main", filter_themes=True, version=1,
         catalogue=False, min_levels=1
@@ -559,62 +642,221 @@ class Entry(object):
         by ``role_id``.
         ``mobile`` tells whether to retrieve mobile or desktop layers
         """
+        if role_id is not None:
+            # the role id may come from the request parameters
+            role_id = int(role_id)
+
         errors = []
-        layers = self._layers(role_id, version, interface)
+        layers = set(self._layers(role_id, version, interface))
+        editable_layers = self._get_editable_layers()
+        wms, _ = self._wms_layers()
+
+        export_themes = []
+        for theme in self._compiled_themes(
+            interface, filter_themes, version, catalogue, min_levels,
+            getattr(wms, 'version', None)
+        ):
+            # test if the theme is visible for the current user
+            if not theme['public'] and role_id not in theme['restricted_roles']:
+                continue
+
+            children = []
+            for child in theme['children']:
+                time = TimeInformation()
+                c, c_errors = self._filter_item(child, layers, time, editable_layers)
+                errors += c_errors
+                if c is not None:
+                    if time.has_time():  # pragma: nocover
+                        c["time"] = time.to_dict()
+                    children.append(c)
+
+            if len(children) > 0:
+                errors += theme['errors']
+                t = dict(theme['item'])
+                t['children'] = children
+                export_themes.append(t)
+
+        # the same error can come from several items
+        return export_themes, list(OrderedDict.fromkeys(errors))
+
+    @cache_on_arguments('permission', tags=(TREE, RESTRICTION, ROLE, FUNCTIONALITY))
+    def _themes_payload(
+        self, role_id, user_role_id, interface, version, catalogue, min_levels,
+        wms_version
+    ):
+        """
+        Return the themes as they are sent by the ``themes`` view: serialized
+        in JSON, compressed with gzip and with brotli (if it's installed),
+        by encoding, and the errors.
+
+        ``user_role_id`` is the role of the user, used to get the editable
+        layers, and ``wms_version`` the version of the WMS capabilities.
+        """
+        themes, errors = self._themes(
+            role_id, interface, True, version, catalogue, min_levels
+        )
+        return self._payload(themes if version == 1 else {
+            "items": themes,
+            "errors": errors
+        }, errors)
+
+    @cache_on_arguments('tree', tags=(TREE,))
+    def _compiled_groups(self, catalogue, version, wms_version):
+        """
+        Return the index group name => group compiled by ``_compile_group``,
+        used to get a group without walking the tree. With duplicated
+        names the first compiled group is used.
+
+        The groups without parent group are compiled first, their sub groups
+        are registered while compiling them, then every group is compiled
+        only once.
+
+        ``wms_version`` is the version of the WMS capabilities.
+        """
         wms, wms_layers = self._wms_layers()
+        # load the tree in memory before compiling the groups
+        load_tree(DBSession)
+        all_groups = DBSession.query(LayerGroup).order_by(LayerGroup.id).all()
+        roots = [
+            group for group in all_groups if not any(
+                isinstance(parent, LayerGroup) for parent in group.parents
+            )
+        ]
+        groups = {}
+        for group in roots + all_groups:
+            if group.name not in groups:
+                self._compile_group(
+                    group.name, group, catalogue=catalogue, version=version,
+                    wms=wms, wms_layers=wms_layers, registry=groups
+                )
+        return groups
 
-        themes = DBSession.query(Theme)
-        themes = themes.filter(Theme.public.is_(True))
-        if role_id is not None:
-            auth_themes = DBSession.query(Theme)
-            auth_themes = auth_themes.filter(Theme.public.is_(False))
-            auth_themes = auth_themes.join(Theme.restricted_roles)
-            auth_themes = auth_themes.filter(Role.id == role_id)
+    @cache_on_arguments('permission', tags=(TREE, RESTRICTION, ROLE))
+    def _group_payload(
+        self, role_id, user_role_id, interface, group, version, catalogue,
+        wms_version
+    ):
+        """
+        Return the group as it is sent by the ``themes`` view, like
+        ``_themes_payload``, ``None`` if the group doesn't exist.
+        """
+        compiled = self._compiled_groups(catalogue, version, wms_version).get(group)
+        if compiled is None:
+            return None
+        item, errors = self._filter_item(
+            compiled, self._layers(role_id, version, interface), TimeInformation(),
+            frozenset() if user_role_id is None else self._editable_layers(user_role_id)
+        )
+        errors = list(OrderedDict.fromkeys(errors))
+        return self._payload({
+            "item": item,
+            "errors": errors
+        }, errors)
 
-            themes = themes.union(auth_themes)
+    def _payload(self, result, errors):
+        """
+        Return the payload of ``result``: serialized in JSON, compressed
+        with gzip and with brotli (if it's installed), by encoding, and
+        the ``errors``.
+        """
+        content = json.dumps(result)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        payload = {
+            'identity': content,
+            'gzip': compressor.compress(content) + compressor.flush(),
+            'errors': errors,
+        }
+        if brotli is not None:  # pragma: no cover
+            payload['br'] = brotli.compress(content)
+        return payload
 
-        themes = themes.order_by(Theme.ordering.asc())
+    def _content_encoding(self):
+        """
+        Return the best content-coding of a ``_payload`` accepted by the
+        client, ``None`` for the identity.
+        """
+        return Accept(self.request.headers.get('Accept-Encoding', '')).best_match(
+            [e for e in ('br', 'gzip') if e != 'br' or brotli is not None]
+        )
 
-        if filter_themes and interface is not None:
-            themes = themes.join(Theme.interfaces)
-            themes = themes.filter(Interface.name == interface)
+    def _payload_response(self, payload):
+        """
+        Return the response with the best encoding of a payload of
+        ``_payload``.
+        """
+        response = self.request.response
+        response.content_type = 'application/json'
+        response.vary = ('Accept-Encoding',)
+        encoding = self._content_encoding()
+        if encoding is not None:
+            response.content_encoding = encoding
+            response.body = payload[encoding]
+        else:
+            response.body = payload['identity']
+        return response
 
-        export_themes = []
-        for theme in themes.all():
-            children, children_errors = self._get_children(
-                theme, layers, wms, wms_layers, version, catalogue, min_levels
+    @cache_on_arguments('tree', tags=(TREE, FUNCTIONALITY))
+    def _compiled_themes(
+        self, interface, filter_themes, version, catalogue, min_levels,
+        wms_version
+    ):
+        """
+        Return the themes compiled independently of the role, they are
+        built once then filtered by ``_themes`` for each role.
+
+        ``wms_version`` is the version of the WMS capabilities, used
+        to build the themes again when the capabilities change.
+        """
+        wms, wms_layers = self._wms_layers()
+
+        compiled_themes = []
+        for theme in self._get_themes(interface, filter_themes):
+            errors = []
+            icon = get_url(
+                theme.icon, self.request,
+                self.request.static_url(
+                    'c2cgeoportal:static/images/blank.gif'
+                ),
+                errors=errors
             )
-            errors += children_errors
 
-            # test if the theme is visible for the current user
-            if len(children) > 0:
-                icon = get_url(
-                    theme.icon, self.request,
-                    self.request.static_url(
-                        'c2cgeoportal:static/images/blank.gif'
-                    ),
-                    errors=errors
+            t = {
+                'id': theme.id,
+                'name': theme.name,
+                'icon': icon,
+                'functionalities': self._get_functionalities(theme),
+                'metadata': {},
+            }
+            if version == 1:
+                t.update({
+                    'in_mobile_viewer': theme.is_in_interface('mobile'),
+                })
+            for metadata in theme.ui_metadata:
+                t['metadata'][metadata.name] = get_url(
+                    metadata.value, self.request, errors=errors
                 )
 
-                t = {
-                    'id': theme.id,
-                    'name': theme.name,
-                    'icon': icon,
-                    'children': children,
-                    'functionalities': self._get_functionalities(theme),
-                    'metadata': {},
-                }
-                if version == 1:
-                    t.update({
-                        'in_mobile_viewer': theme.is_in_interface('mobile'),
-                    })
-                for metadata in theme.ui_metadata:
-                    t['metadata'][metadata.name] = get_url(
-                        metadata.value, self.request, errors=errors
-                    )
-                export_themes.append(t)
+            compiled_themes.append({
+                'item': t,
+                'public': theme.public,
+                'restricted_roles': set([role.id for role in theme.restricted_roles]),
+                'children': self._get_children(
+                    theme, wms, wms_layers, version, catalogue, min_levels
+                ),
+                'errors': errors,
+            })
 
-        return export_themes, errors
+        return compiled_themes
+
+    def _get_themes(self, interface, filter_themes):
+        """ Return the themes, with the whole tree loaded in memory. """
+        themes = []
+        for theme in load_tree(DBSession).themes:
+            if filter_themes and interface is not None and \
+                    not theme.is_in_interface(interface):
+                continue
+            themes.append(theme)
+        return themes
 
     def _get_functionalities(self, theme):
         result = {}
@@ -625,46 +867,130 @@ class Entry(object):
                 result[functionality.name] = [functionality.value]
         return result
 
+    def _not_modified(self, role_id, interface, extra=()):
+        """
+        Set a strong ETag on the response and return a 304 response if it
+        matches the ``If-None-Match`` header, else ``None``.
+
+        The ETag depends on the cache version, the version of the cached
+        data (the tags and the WMS capabilities), the role, the user, the
+        interface, the request and the ``extra`` values (the content-coding,
+        the WFS types, ...), then it's checked before building anything.
+        """
+        wms, _ = self._wms_layers()
+        etag = hashlib.sha1('|'.join([canonicalize(v) for v in (
+            get_cache_version(),
+            get_tags_version(TREE, RESTRICTION, ROLE, FUNCTIONALITY),
+            getattr(wms, 'version', None),
+            self.request.application_url,
+            self.request.path,
+            self.lang,
+            role_id,
+            interface,
+            self.request.user.username if self.request.user is not None else None,
+            self.request.params,
+            extra,
+        )])).hexdigest()
+        self.request.response.etag = etag
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None and \
+                etag in ETagMatcher.parse(if_none_match, strong=False):
+            headers = {
+                'ETag': self.request.response.headers['ETag'],
+                'Cache-Control': self.request.response.headers['Cache-Control'],
+            }
+            if 'Vary' in self.request.response.headers:
+                headers['Vary'] = self.request.response.headers['Vary']
+            return HTTPNotModified(headers=headers)
+        return None
+
     @view_config(route_name='invalidate', renderer='json')
     def invalidate_cache(self):  # pragma: no cover
-        invalidate_region()
+        if self.request.params.get('capabilities') == 'true':
+            # only what depends on the MapServer capabilities
+            invalidate_tags(*[
+                capabilities_tag(url) for url in set([
+                    self.settings['mapserv_url'], self._get_wfs_url()
+                ])
+            ])
+            return {
+                'success': True
+            }
+        invalidate_regions()
+        if get_setting(self.settings, ('cache_warmup', 'after_invalidate'), False):
+            warmup_in_background(
+                self.request.registry, self.request.application_url,
+                threads=get_setting(self.settings, ('cache_warmup', 'threads'), 4),
+            )
         return {
             'success': True
         }
 
-    @cache_region.cache_on_arguments()
-    def _get_children(self, theme, layers, wms, wms_layers, version, catalogue, min_levels):
+    @view_config(route_name='cache_stats', renderer='json')
+    def cache_stats(self):  # pragma: no cover
+        return get_stats()
+
+    @view_config(route_name='upstream_stats', renderer='json')
+    def upstream_stats(self):  # pragma: no cover
+        # the pools are keyed by the internal upstream hosts, then like the
+        # admin interface it's only for the authenticated users
+        if self.request.user is None:
+            raise HTTPForbidden()
+        return upstream.get_stats()
+
+    def _get_children(self, theme, wms, wms_layers, version, catalogue, min_levels):
         children = []
-        errors = []
         for item in theme.children:
             if type(item) == LayerGroup:
-                time = TimeInformation()
-                gp, gp_errors = self._group(
+                children.append(self._compile_group(
                     "%s/%s" % (theme.name, item.name),
-                    item, layers, time=time, wms=wms, wms_layers=wms_layers,
+                    item, wms=wms, wms_layers=wms_layers,
                     version=version, catalogue=catalogue, min_levels=min_levels
-                )
-                errors += gp_errors
-
-                if gp is not None:
-                    if time.has_time():  # pragma: nocover
-                        gp.update({"time": time.to_dict()})
-                    children.append(gp)
+                ))
             elif self._layer_included(item, version):
                 if min_levels > 0:
-                    errors.append("The Layer '%s' cannot be directly in the theme '%s' (0/%i)." % (
-                        item.name, theme.name, min_levels
-                    ))
-                elif item.name in layers:
-                    time = TimeInformation()
-                    l, l_errors = self._layer(
-                        item, time=time, wms=wms, wms_layers=wms_layers
-                    )
-                    if time.has_time():  # pragma: nocover
-                        l.update({"time": time.to_dict()})
-                    errors += l_errors
-                    children.append(l)
-        return children, errors
+                    children.append({
+                        'type': 'error',
+                        'errors': [
+                            "The Layer '%s' cannot be directly in the theme '%s' (0/%i)." %
+                            (item.name, theme.name, min_levels)
+                        ],
+                    })
+                else:
+                    children.append(self._compile_layer(item, wms, wms_layers))
+        return children
+
+    def _fetch_concurrently(self, fetches, errors):
+        """
+        Run the fetches concurrently in a pool of threads and return their
+        results, a fetch is a function and its arguments, or ``None``.
+
+        A fetch that doesn't end before ``upstream_fetch.timeout`` seconds
+        gives ``None`` and an error in ``errors``, it continues in the
+        background to fill the cache.
+        """
+        timeout = get_setting(self.settings, ('upstream_fetch', 'timeout'), 30)
+        pool = _get_fetch_pool(
+            get_setting(self.settings, ('upstream_fetch', 'threads'), 10)
+        )
+        deadline = time.time() + timeout
+        async_results = [
+            None if fetch is None else pool.apply_async(fetch[0], fetch[1:])
+            for fetch in fetches
+        ]
+        results = []
+        for fetch, async_result in zip(fetches, async_results):
+            if async_result is None:
+                results.append(None)
+                continue
+            try:
+                results.append(async_result.get(max(0, deadline - time.time())))
+            except TimeoutError:  # pragma: no cover
+                error = "Timeout while getting: %s" % ", ".join(str(a) for a in fetch[1:])
+                log.error(error)
+                errors.append(error)
+                results.append(None)
+        return results
 
     def _get_wfs_url(self):
         if 'mapserv_wfs_url' in self.request.registry.settings and \
@@ -691,6 +1017,12 @@ class Entry(object):
         return self._wfs_types(url, role_id)
 
     def _wfs_types(self, wfs_url, role_id):
+        return self._wfs_types_cached(
+            self._wfs_types_url(wfs_url, role_id),
+            get_tags_version(capabilities_tag(wfs_url))
+        )
+
+    def _wfs_types_url(self, wfs_url, role_id):
         if wfs_url.find('?') < 0:
             wfs_url += '?'
 
@@ -702,10 +1034,12 @@ class Entry(object):
         if role_id is not None:
             wfs_url += "role_id=%s&" % role_id
 
-        return self._wfs_types_cached(wfs_url)
+        return wfs_url
 
-    @cache_region.cache_on_arguments()
-    def _wfs_types_cached(self, wfs_url):
+    @cache_on_arguments('upstream', should_cache_fn=_is_result)
+    def _wfs_types_cached(self, wfs_url, capabilities_version):
+        """ ``capabilities_version`` is the version of the capabilities tag
+        of the configured URL. """
         errors = []
 
         # retrieve layers metadata via GetCapabilities
@@ -719,12 +1053,13 @@ class Entry(object):
         log.info("WFS GetCapabilities for base url: %s" % wfsgc_url)
 
         # forward request to target (without Host Header)
-        http = httplib2.Http()
         h = dict(self.request.headers)
         if urlparse(wfsgc_url).hostname != 'localhost':  # pragma: no cover
             h.pop('Host')
         try:
-            resp, get_capabilities_xml = http.request(wfsgc_url, method='GET', headers=h)
+            resp, get_capabilities_xml = upstream.request(
+                wfsgc_url, method='GET', headers=h, name='mapserver'
+            )
         except:  # pragma: no cover
             errors.append("Unable to GetCapabilities from url %s" % wfsgc_url)
             return None, errors
@@ -755,13 +1090,16 @@ class Entry(object):
         except:  # pragma: no cover
             return get_capabilities_xml, errors
 
-    @cache_region.cache_on_arguments()
     def _external_themes(self, interface):  # pragma nocover
-        errors = []
+        url = self._external_themes_url(interface)
+        if url is None:
+            return None, []
+        return self._external_themes_cached(url)
 
+    def _external_themes_url(self, interface):
         if not ('external_themes_url' in self.settings
                 and self.settings['external_themes_url']):
-            return None, errors
+            return None
         ext_url = self.settings['external_themes_url']
         url_params = {
             'interface': interface
@@ -776,14 +1114,18 @@ class Entry(object):
         ext_url += '&'.join([
             '='.join(p) for p in url_params.items()
         ])
+        return ext_url
+
+    @cache_on_arguments('upstream', should_cache_fn=_is_result)
+    def _external_themes_cached(self, ext_url):  # pragma nocover
+        errors = []
 
         # forward request to target (without Host Header)
-        http = httplib2.Http()
         h = dict(self.request.headers)
         if urlparse(ext_url).hostname != 'localhost':
             h.pop('Host')
         try:
-            resp, content = http.request(ext_url, method='GET', headers=h)
+            resp, content = upstream.request(ext_url, method='GET', headers=h)
         except:
             errors.append(
                 "Unable to get external themes from url %s" % ext_url
@@ -804,7 +1146,7 @@ class Entry(object):
             self.request.user.role.name if self.request.user is not None else None
         )
 
-    @cache_region.cache_on_arguments()
+    @cache_on_arguments('permission', tags=(ROLE, FUNCTIONALITY))
     def _functionality_cached(self, role):
         functionality = {}
         for func in get_setting(
@@ -816,7 +1158,7 @@ class Entry(object):
             )
         return functionality
 
-    @cache_region.cache_on_arguments()
+    @cache_on_arguments()
     def _get_layers_enum(self):
         layers_enum = {}
         if 'layers_enum' in self.request.registry.settings:
@@ -887,14 +1229,52 @@ class Entry(object):
 
         interface = self.request.interface_name
 
-        themes, errors = self._themes(role_id, interface)
-        wfs_types, add_errors = self._internal_wfs_types(role_id)
+        # the upstream documents are fetched concurrently
+        external_wfs_url = self._get_external_wfs_url()
+        external_themes_url = self._external_themes_url(interface)
+        errors = []
+        wms, wfs_types, external_wfs_types, external_themes = self._fetch_concurrently([
+            (
+                self._wms_getcap_cached, self._wms_getcap_url(self.settings['mapserv_url']),
+                get_tags_version(capabilities_tag(self.settings['mapserv_url']))
+            ),
+            (
+                self._wfs_types_cached, self._wfs_types_url(self._get_wfs_url(), role_id),
+                get_tags_version(capabilities_tag(self._get_wfs_url()))
+            ),
+            (
+                self._wfs_types_cached, self._wfs_types_url(external_wfs_url, role_id),
+                get_tags_version(capabilities_tag(external_wfs_url))
+            ) if external_wfs_url else None,
+            (self._external_themes_cached, external_themes_url)
+            if external_themes_url else None,
+        ], errors)
+
+        wfs_types, add_errors = wfs_types or (None, [])
         errors.extend(add_errors)
-        external_wfs_types, add_errors = self._external_wfs_types(role_id)
+        external_wfs_types, add_errors = external_wfs_types or ([], [])
         errors.extend(add_errors)
-        external_themes, add_errors = self._external_themes(interface)
+        external_themes, add_errors = external_themes or (None, [])
         errors.extend(add_errors)
 
+        if wms is None:  # pragma: no cover
+            # timeout, don't wait for the capabilities to build the themes
+            themes = {'identity': json.dumps([]), 'errors': []}
+        else:
+            self._wms = wms
+            not_modified = self._not_modified(
+                role_id, interface,
+                extra=(wfs_types, external_wfs_types, external_themes)
+            )
+            if not_modified is not None:
+                return not_modified
+
+            themes = self._themes_payload(
+                role_id, role_id, interface, 1, False, 1,
+                getattr(wms[0], 'version', None)
+            )
+        errors = themes['errors'] + errors
+
         cache_version = get_cache_version()
         url_params = {
             'version': cache_version
@@ -906,7 +1286,7 @@ class Entry(object):
             url_role_params['role'] = self.request.user.role.name
 
         d = {
-            'themes': json.dumps(themes),
+            'themes': themes['identity'],
             'user': self.request.user,
             'WFSTypes': json.dumps(wfs_types),
             'externalWFSTypes': json.dumps(external_wfs_types),
@@ -1033,6 +1413,18 @@ class Entry(object):
         """
         errors = []
         interface = self.request.interface_name
+        user = self.request.user
+        role_id = None if user is None else user.role.id
+
+        # comma-separated string including the feature types supported
+        # by WFS service
+        wfs_types, wfs_errors = self._internal_wfs_types(role_id)
+        if len(wfs_errors) > 0:  # pragma: no cover
+            raise HTTPBadGateway('\n'.join(wfs_errors))
+
+        not_modified = self._not_modified(role_id, interface, extra=(wfs_types,))
+        if not_modified is not None:
+            return not_modified
 
         mobile_default_themes = get_functionality(
             'mobile_default_theme',
@@ -1043,19 +1435,10 @@ class Entry(object):
             'theme',
             mobile_default_themes[0] if len(mobile_default_themes) > 0 else None
         )
-        user = self.request.user
-
-        role_id = None if user is None else user.role.id
-        themes, errors = self._themes(role_id, interface, False)
-
-        for t in themes:
-            self.flatten_layers(t)
-
-        # comma-separated string including the feature types supported
-        # by WFS service
-        wfs_types, errors = self._internal_wfs_types(role_id)
-        if len(errors) > 0:  # pragma: no cover
-            raise HTTPBadGateway('\n'.join(errors))
+        wms, _ = self._wms_layers()
+        themes, errors = self._mobile_themes(
+            role_id, interface, getattr(wms, 'version', None)
+        )
 
         # info includes various information that is not used by config.js,
         # but by other - private to the integrator - parts of the mobile
@@ -1066,16 +1449,10 @@ class Entry(object):
 
         # get the list of themes available for mobile
         themes_ = []
-        themes, errors = self._themes(role_id, interface, False)
         for theme in themes:
             # mobile theme or hidden theme explicitely loaded
             if theme['in_mobile_viewer'] or theme['name'] == theme_name:
-                themes_.append({
-                    'name': theme['name'],
-                    'icon': theme['icon'],
-                    'allLayers': theme['allLayers'],
-                    'layers': theme['layers'],
-                })
+                themes_.append(theme['item'])
 
         self.request.response.content_type = 'application/javascript'
         return {
@@ -1087,45 +1464,85 @@ class Entry(object):
             'info': info,
         }
 
-    @view_config(route_name='apijs', renderer='api/api.js')
-    def apijs(self):
-        self.request.response.headers['Cache-Control'] = 'no-cache'
-        wms, wms_errors = self._wms_getcap(
-            self.request.registry.settings['mapserv_url'])
+    @cache_on_arguments('permission', tags=(TREE, RESTRICTION, ROLE, FUNCTIONALITY))
+    def _mobile_themes(self, role_id, interface, wms_version):
+        """
+        Return the themes of the role flattened for the mobile application,
+        and the errors.
+
+        ``wms_version`` is the version of the WMS capabilities.
+        """
+        themes, errors = self._themes(role_id, interface, False)
+
+        mobile_themes = []
+        for theme in themes:
+            self.flatten_layers(theme)
+            mobile_themes.append({
+                'in_mobile_viewer': theme['in_mobile_viewer'],
+                'name': theme['name'],
+                'item': {
+                    'name': theme['name'],
+                    'icon': theme['icon'],
+                    'allLayers': theme['allLayers'],
+                    'layers': theme['layers'],
+                },
+            })
+        return mobile_themes, errors
+
+    @cache_on_arguments()
+    def _queryable_layers(self, cache_version, role_id, url, capabilities_version):
+        """
+        Return the JSON list of the queryable layers of the WMS capabilities,
+        ``cache_version`` is the current ``get_cache_version``, ``url`` is
+        the capabilities URL with the substitution params of the user and
+        ``capabilities_version`` the version of its capabilities tag.
+        """
+        wms, wms_errors = self._wms_getcap_cached(url, capabilities_version)
         if len(wms_errors) > 0:  # pragma: no cover
             raise HTTPBadGateway('\n'.join(wms_errors))
-        queryable_layers = [
-            name for name in list(wms.contents)
-            if wms[name].queryable == 1]
-        cache_version = self.settings.get('cache_version', None)
+        return json.dumps([
+            name for name in wms
+            if wms[name].queryable == 1])
+
+    def _api_js(self):
+        """
+        Return the values of the api.js and xapi.js templates. The
+        response is publicly cacheable when it's requested with the
+        current ``cache_version`` by an anonymous user, otherwise it's
+        private or it isn't cached.
+        """
+        cache_version = get_cache_version()
+        if self.request.params.get('cache_version') == cache_version:
+            if self.request.user is None:
+                self.request.response.cache_control.public = True
+            self.request.response.cache_control.max_age = \
+                self.settings["default_max_age"]
+        else:
+            self.request.response.headers['Cache-Control'] = 'no-cache'
+        url_params = {'version': self.settings.get('cache_version', None)}
+        mapserv_url = self.settings['mapserv_url']
         d = {
             'lang': self.lang,
             'debug': self.debug,
-            'queryable_layers': json.dumps(queryable_layers),
-            'url_params': {'version': cache_version} if cache_version else {},
+            'queryable_layers': self._queryable_layers(
+                cache_version,
+                self.request.user.role.id if self.request.user is not None else None,
+                self._wms_getcap_url(mapserv_url),
+                get_tags_version(capabilities_tag(mapserv_url)),
+            ),
+            'url_params': url_params if url_params['version'] else {},
             'tiles_url': json.dumps(self.settings.get("tiles_url")),
         }
         self.request.response.content_type = 'application/javascript'
         return d
 
+    @view_config(route_name='apijs', renderer='api/api.js')
+    def apijs(self):
+        return self._api_js()
+
     @view_config(route_name='xapijs', renderer='api/xapi.js')
     def xapijs(self):
-        self.request.response.headers['Cache-Control'] = 'no-cache'
-        wms, wms_errors = self._wms_getcap(
-            self.request.registry.settings['mapserv_url'])
-        queryable_layers = [
-            name for name in list(wms.contents)
-            if wms[name].queryable == 1]
-        cache_version = self.settings.get('cache_version', None)
-        d = {
-            'lang': self.lang,
-            'debug': self.debug,
-            'queryable_layers': json.dumps(queryable_layers),
-            'url_params': {'version': cache_version} if cache_version else {},
-            'tiles_url': json.dumps(self.settings.get("tiles_url")),
-        }
-        self.request.response.content_type = 'application/javascript'
-        return d
+        return self._api_js()
 
     @view_config(route_name='apihelp', renderer='api/apihelp.html')
     def apihelp(self):
@@ -1133,6 +1550,7 @@ class Entry(object):
         return {
             'lang': self.lang,
             'debug': self.debug,
+            'cache_version': get_cache_version(),
         }
 
     @view_config(route_name='xapihelp', renderer='api/xapihelp.html')
@@ -1141,6 +1559,7 @@ class Entry(object):
         return {
             'lang': self.lang,
             'debug': self.debug,
+            'cache_version': get_cache_version(),
         }
 
     @view_config(route_name='themes', renderer='json')
@@ -1157,27 +1576,33 @@ class Entry(object):
         min_levels = int(self.request.params.get("min_levels", 1))
         group = self.request.params.get("group", None)
 
+        # the body depends on the content-coding, so does the strong ETag
+        self.request.response.vary = ('Accept-Encoding',)
+        not_modified = self._not_modified(
+            role_id, interface, extra=(self._content_encoding(),)
+        )
+        if not_modified is not None:
+            return not_modified
+
         if group is None:
-            items, errors = self._themes(
-                role_id, interface, True, version, catalogue, min_levels
-            )
-            return items if version == 1 else {
-                "items": items,
-                "errors": errors
-            }
+            wms, _ = self._wms_layers()
+            return self._payload_response(self._themes_payload(
+                role_id,
+                self.request.user.role.id if self.request.user is not None else None,
+                interface, version, catalogue, min_levels,
+                getattr(wms, 'version', None)
+            ))
         else:
-            time = TimeInformation()
-            layers = self._layers(role_id, version, interface)
-            wms, wms_layers = self._wms_layers()
-            lg = DBSession.query(LayerGroup).filter(LayerGroup.name == group).one()
-            item, errors = self._group(
-                lg.name, lg, layers, time=time, wms=wms, wms_layers=wms_layers,
-                catalogue=catalogue, version=version
+            wms, _ = self._wms_layers()
+            payload = self._group_payload(
+                role_id,
+                self.request.user.role.id if self.request.user is not None else None,
+                interface, group, version, catalogue,
+                getattr(wms, 'version', None)
             )
-            return {
-                "item": item,
-                "errors": errors
-            }
+            if payload is None:
+                raise HTTPNotFound("Group '%s' not found" % group)
+            return self._payload_response(payload)
 
     @view_config(context=HTTPForbidden, renderer='login.html')
     def loginform403(self):
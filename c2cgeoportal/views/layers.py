@@ -53,8 +53,6 @@ from c2cgeoportal.lib import caching
 from c2cgeoportal.lib.dbreflection import get_class, get_table
 from c2cgeoportal.models import DBSessions, DBSession, Layer, RestrictionArea, Role
 
-cache_region = caching.get_region()
-
 
 class Layers(object):
 
@@ -146,6 +144,8 @@ class Layers(object):
             raise HTTPForbidden()
         cls = proto.mapped_class
         geom_attr = proto.geom_attr
+        # the access is checked in the database for each request, the
+        # permission index is cached by process
         ras = DBSession.query(RestrictionArea.area, RestrictionArea.area.ST_SRID())
         ras = ras.join(RestrictionArea.roles)
         ras = ras.join(RestrictionArea.layers)
@@ -353,7 +353,7 @@ class Layers(object):
 
         return self._metadata(str(layer.geo_table), layer.exclude_properties)
 
-    @cache_region.cache_on_arguments()
+    @caching.cache_on_arguments('enumeration')
     def _metadata(self, geo_table, exclude_properties):
         return get_class(
             geo_table,
@@ -373,7 +373,7 @@ class Layers(object):
             general_dbsession_name, layername, fieldname
         )
 
-    @cache_region.cache_on_arguments()
+    @caching.cache_on_arguments('enumeration')
     def _enumerate_attribute_values(self, general_dbsession_name, layername, fieldname):
         if layername not in self.layers_enum_config:  # pragma: no cover
             raise HTTPBadRequest('Unknown layer: %s' % layername)
@@ -28,7 +28,6 @@
 # either expressed or implied, of the FreeBSD Project.
 
 
-import httplib2
 import urllib
 import sys
 import logging
@@ -36,17 +35,23 @@ import logging
 from urlparse import urlparse
 
 from pyramid.httpexceptions import HTTPBadGateway, HTTPNotAcceptable, \
-    HTTPInternalServerError
+    HTTPInternalServerError, HTTPServiceUnavailable
 from pyramid.response import Response
 from pyramid.view import view_config
 
-from c2cgeoportal.lib import caching
+from c2cgeoportal.lib import caching, upstream
 from c2cgeoportal.lib.functionality import get_mapserver_substitution_params
 from c2cgeoportal.lib.filter_capabilities import filter_capabilities
 
-cache_region = caching.get_region()
 log = logging.getLogger(__name__)
 
+# The parameters which values are case insensitive, they are case folded
+# in the cache keys.
+CASE_INSENSITIVE_PARAMS = (
+    'service', 'request', 'version', 'format', 'outputformat',
+    'exceptions', 'transparent', 'sld_version',
+)
+
 
 class MapservProxy:
 
@@ -170,14 +175,68 @@ class MapservProxy:
                 _url, params, public_cache, method, self.request.headers, role_id
             )
         else:
+            if method == "POST" and self.request.content_length:
+                # the WFS transactions can be big, send the body to
+                # MapServer without reading it in memory
+                body = self.request.body_file
+            else:
+                body = self.request.body
             return self._proxy(
-                _url, params, use_cache, public_cache, method, self.request.body,
+                _url, params, use_cache, public_cache, method, body,
                 self.request.headers, role_id
             )
 
-    @cache_region.cache_on_arguments()
+    def _cache_key(self, _url, params, headers, role_id):
+        """ Return the cache key of an OGC request, from the case folded
+        parameters, the role and the headers are only used for the
+        GetCapabilities. """
+        normalized = {}
+        for k, v in params.iteritems():
+            k = k.lower()
+            v = unicode(v)
+            normalized[k] = v.lower() if k in CASE_INSENSITIVE_PARAMS else v
+        parts = ['ogc', _url, normalized]
+        if self.lower_params['request'] == u'getcapabilities':
+            allowed = set(h.lower() for h in caching.PROXY_HEADERS)
+            parts.extend([
+                self.request.application_url, role_id,
+                dict((k, v) for k, v in headers.items() if k.lower() in allowed),
+            ])
+        parts.append(caching.get_tags_version(
+            caching.TREE, caching.RESTRICTION, caching.capabilities_tag(_url)
+        ))
+        return caching.make_key(*parts)
+
     def _proxy_cache(self, _url, params, public_cache, method, headers, role_id):
-        return self._proxy(_url, params, True, public_cache, method, None, headers, role_id)
+        def create():
+            response = self._proxy(
+                _url, params, True, public_cache, method, None, headers, role_id
+            )
+            return response.body, response.status_int, response.headers.get("Content-Type")
+
+        request_type = self.lower_params['request']
+        body, status, content_type = caching.get_named_region('ogc').get_or_create(
+            self._cache_key(_url, params, headers, role_id), create,
+            expiration_time=caching.get_expiration_time('ogc', request_type),
+            should_cache_fn=lambda value: value[1] == 200,
+        )
+        response = Response(body, status=status)
+        if content_type is not None:
+            response.headers["Content-Type"] = content_type
+        if status == 200:
+            self._set_cache_control(response, True, public_cache)
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    def _set_cache_control(self, response, use_cache, public_cache):
+        if use_cache:
+            response.cache_control.public = public_cache
+            response.cache_control.max_age = self.request.registry.settings["default_max_age"]
+            if self.request.user and not public_cache:
+                response.cache_control.private = True
+        else:
+            response.cache_control.no_cache = True
 
     def _proxy(self, _url, params, use_cache, public_cache, method, body, headers, role_id):
         # name of the JSON callback (value for the "callback" query string param
@@ -202,17 +261,32 @@ class MapservProxy:
         log.info("Querying mapserver proxy at URL: %s." % _url)
 
         # forward self.request to target (without Host Header)
-        http = httplib2.Http()
         headers = dict(headers)
         if urlparse(_url).hostname != 'localhost':  # pragma: no cover
             headers.pop('Host')
         # mapserver don't need the cookie, and sometimes it failed with it.
         if 'Cookie' in headers:  # pragma: no cover
             headers.pop('Cookie')
+
+        # the response is streamed to the client when we don't need to
+        # transform or to cache it
+        if callback is None and not use_cache and \
+                self.lower_params.get('request') != 'getcapabilities':
+            return self._proxy_stream(_url, method, body, headers)
+
+        if hasattr(body, 'read'):
+            body = body.read()
         try:
-            resp, content = http.request(
-                _url, method=method, body=body, headers=headers
+            # no coalescing here: a cached response is created once by key
+            # under the lock of the ogc cache region, then the identical
+            # cached requests made at the same time share one MapServer call
+            resp, content = upstream.request(
+                _url, method=method, body=body, headers=headers,
+                name="mapserver",
             )
+        except upstream.Unavailable as e:  # pragma: no cover
+            log.error(e)
+            return HTTPServiceUnavailable("See logs for details")
         except:  # pragma: no cover
             log.error(
                 "Error '%s' while getting the URL: %s." %
@@ -253,13 +327,45 @@ class MapservProxy:
 
         headers = {"Content-Type": content_type}
         response = Response(content, status=resp.status, headers=headers)
+        self._set_cache_control(response, use_cache, public_cache)
 
-        if use_cache:
-            response.cache_control.public = public_cache
-            response.cache_control.max_age = self.request.registry.settings["default_max_age"]
-            if self.request.user and not public_cache:
-                response.cache_control.private = True
-        else:
-            response.cache_control.no_cache = True
+        return response
+
+    def _proxy_stream(self, _url, method, body, headers):
+        # the content is sent as is to the client
+        headers.pop('Accept-Encoding', None)
+        try:
+            resp = upstream.stream(
+                _url, method=method, body=body, headers=headers,
+                name="mapserver",
+            )
+        except upstream.Unavailable as e:  # pragma: no cover
+            log.error(e)
+            return HTTPServiceUnavailable("See logs for details")
+        except:  # pragma: no cover
+            log.error(
+                "Error '%s' while getting the URL: %s." %
+                (sys.exc_info()[0], _url))
+            return HTTPBadGateway("See logs for details")  # pragma: no cover
+
+        if resp.status != 200:
+            log.error("\nError\n '%s'\n in response from URL:\n %s\n "
+                      "with query:\n %s" %
+                      (resp.reason, _url, resp.read()))  # pragma: no cover
+            return HTTPInternalServerError(
+                "See logs for details")  # pragma: no cover
+
+        # check for allowed content types
+        if "content-type" not in resp:
+            resp.close()  # pragma: no cover
+            return HTTPNotAcceptable()  # pragma: no cover
+
+        response = Response(
+            app_iter=resp, status=resp.status,
+            headers={"Content-Type": resp["content-type"]},
+        )
+        if "content-length" in resp:
+            response.content_length = int(resp["content-length"])
+        response.cache_control.no_cache = True
 
         return response
@@ -28,7 +28,6 @@
 # either expressed or implied, of the FreeBSD Project.
 
 
-import httplib2
 import urllib
 import logging
 
@@ -38,13 +37,12 @@ from simplejson.decoder import JSONDecodeError
 
 from pyramid.view import view_config
 from pyramid.response import Response
-from pyramid.httpexceptions import HTTPBadGateway
+from pyramid.httpexceptions import HTTPBadGateway, HTTPServiceUnavailable
 
-from c2cgeoportal.lib import caching
+from c2cgeoportal.lib import caching, upstream
 from c2cgeoportal.lib.functionality import get_functionality
 
 log = logging.getLogger(__name__)
-cache_region = caching.get_region()
 
 
 class Printproxy(object):  # pragma: no cover
@@ -66,19 +64,27 @@ class Printproxy(object):  # pragma: no cover
 
         return self._info(templates, query_string)
 
-    @cache_region.cache_on_arguments()
+    # only the capabilities are cached, not the errors
+    @caching.cache_on_arguments(
+        'print', should_cache_fn=lambda response:
+        getattr(response, 'status_int', None) == 200
+    )
     def _info(self, templates, query_string):
         # get URL
         _url = self.config['print_url'] + 'info.json' + '?' + query_string
         log.info("Get print capabilities from %s." % _url)
 
         # forward request to target (without Host Header)
-        http = httplib2.Http()
         h = dict(self.request.headers)
         if urlparse(_url).hostname != 'localhost':
             h.pop('Host')
         try:
-            resp, content = http.request(_url, method='GET', headers=h)
+            resp, content = upstream.request(
+                _url, method='GET', headers=h, name='print'
+            )
+        except upstream.Unavailable as e:
+            log.error(e)
+            return HTTPServiceUnavailable()
         except:
             return HTTPBadGateway()
 
@@ -124,7 +130,6 @@ class Printproxy(object):  # pragma: no cover
         body = self.request.environ['wsgi.input'].read(content_length)
 
         # forward request to target (without Host Header)
-        http = httplib2.Http()
         h = dict(self.request.headers)
         if urlparse(_url).hostname != 'localhost':
             h.pop('Host')
@@ -132,9 +137,12 @@ class Printproxy(object):  # pragma: no cover
         h["Cache-Control"] = "no-cache"
 
         try:
-            resp, content = http.request(
-                _url, method='POST', body=body, headers=h
+            resp, content = upstream.request(
+                _url, method='POST', body=body, headers=h, name='print'
             )
+        except upstream.Unavailable as e:
+            log.error(e)
+            return HTTPServiceUnavailable()
         except:
             return HTTPBadGateway()
 
@@ -154,7 +162,6 @@ class Printproxy(object):  # pragma: no cover
         log.info("Get print document from %s." % _url)
 
         # forward request to target (without Host Header)
-        http = httplib2.Http()
         h = dict(self.request.headers)
         if urlparse(_url).hostname != 'localhost':
             h.pop('Host')
@@ -162,7 +169,12 @@ class Printproxy(object):  # pragma: no cover
         h["Cache-Control"] = "no-cache"
 
         try:
-            resp, content = http.request(_url, method='GET', headers=h)
+            resp, content = upstream.request(
+                _url, method='GET', headers=h, name='print'
+            )
+        except upstream.Unavailable as e:
+            log.error(e)
+            return HTTPServiceUnavailable()
         except:
             return HTTPBadGateway()
 
@@ -112,6 +112,7 @@ setup(
             'manage_users = c2cgeoportal.scripts.manage_users:main',
             'c2ctool = c2cgeoportal.scripts.c2ctool:main',
             'db2pot = c2cgeoportal.scripts.db2pot:main',
+            'cache_warmup = c2cgeoportal.scripts.cache_warmup:main',
         ],
         'pyramid.scaffold': [
             'c2cgeoportal_create = c2cgeoportal.scaffolds:TemplateCreate',